@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BasededatosPLS.settings')
 
 application = get_asgi_application()
+
+# Optionally load the NL query subsystem in the background (settings.NL_WARM_UP)
+from miapBBDDpls.views import start_nl_warm_up  # noqa: E402
+
+start_nl_warm_up()
@@ -1,8 +1,15 @@
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Repository root holding database_build.py and few_shot_examples.json; made importable
+# so management commands can reuse the build helpers.
+REPO_DIR = BASE_DIR.parent
+if str(REPO_DIR) not in sys.path:
+    sys.path.append(str(REPO_DIR))
 # settings.py
 
 
@@ -71,6 +78,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'miapBBDDpls.instrumentation.TimingMiddleware',  # First, so its timings cover the whole request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -110,6 +118,67 @@ DATABASES = {
     }
 }
 
+# MongoDB (PlasmID data and saved queries)
+# One pooled client is shared by every request in a process; see views.get_mongo_client.
+
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME', 'PruebaTFMallplasmids')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGO_CONNECT_TIMEOUT_MS = 5000
+MONGO_SOCKET_TIMEOUT_MS = None          # No client-side limit on long aggregations
+MONGO_WAIT_QUEUE_TIMEOUT_MS = 10000     # Fail fast instead of queueing forever when the pool is exhausted
+
+# How database_build.py stored the sequences (its --sequence-storage): 'embedded' in the plasmid and
+# gene documents, or 'blob', where they only keep '<field>_ref' references into the sequences
+# collection. The schema page and the NL prompt describe the fields that actually exist.
+SEQUENCE_STORAGE = os.environ.get('SEQUENCE_STORAGE', 'embedded')
+
+# Serve execute_query, new_query and download_csv with the async views and AsyncMongoClient.
+# Only enable under an ASGI server (e.g. uvicorn BasededatosPLS.asgi:application).
+ASYNC_QUERY_VIEWS = os.environ.get('ASYNC_QUERY_VIEWS', '') == '1'
+
+# Query cost policy for user and LLM-generated queries (see miappBBDDpls/query_guard.py).
+# Queries estimated to scan more than QUERY_SCAN_MAX_DOCS documents are rejected, above
+# QUERY_SCAN_WARN_DOCS they run with a warning; None disables either check.
+QUERY_SCAN_WARN_DOCS = int(os.environ.get('QUERY_SCAN_WARN_DOCS', 1_000_000))
+QUERY_SCAN_MAX_DOCS = int(os.environ.get('QUERY_SCAN_MAX_DOCS', 50_000_000))
+QUERY_EXPLAIN_MAX_TIME_MS = 2000        # Time limit for counting the documents an indexed $match selects
+QUERY_MAX_TIME_MS = int(os.environ.get('QUERY_MAX_TIME_MS', 30000))          # Result pages
+QUERY_CSV_MAX_TIME_MS = int(os.environ.get('QUERY_CSV_MAX_TIME_MS', 600000))  # Full CSV exports
+QUERY_LOOKUP_MAX_TIME_MS = int(os.environ.get('QUERY_LOOKUP_MAX_TIME_MS', 5000))  # Premade query list, NL cache, sequence blobs
+QUERY_ALLOW_DISK_USE = None             # Result pages; None sends no option, so the server default applies
+QUERY_CSV_ALLOW_DISK_USE = True
+
+# Query result cache (per process); entries are also dropped when database_build.py records a rebuild
+QUERY_CACHE_MAX_ENTRIES = 256
+QUERY_CACHE_TTL_SECONDS = 600
+
+# Natural language query wizard
+# Extra few-shot examples loaded (with the built-in ones) the first time a pipeline is generated
+FEW_SHOT_EXAMPLES_FILE = os.environ.get('FEW_SHOT_EXAMPLES_FILE', str(REPO_DIR / 'few_shot_examples.json'))
+# Load the LLM stack in the background when a WSGI/ASGI worker starts instead of on the first NL query
+NL_WARM_UP = os.environ.get('NL_WARM_UP', '') == '1'
+
+# Background NL job pool: model calls run on at most NL_JOB_WORKERS threads per process,
+# with at most NL_JOBS_PER_USER unfinished jobs per user/session. Job state is kept in the
+# nl_jobs MongoDB collection, shared by all processes, for NL_JOB_TTL_SECONDS after a job finishes.
+NL_JOB_WORKERS = int(os.environ.get('NL_JOB_WORKERS', 2))
+NL_JOBS_PER_USER = 1
+NL_JOB_TTL_SECONDS = 600
+
+# Request instrumentation (see miappBBDDpls/instrumentation.py): per-stage and MongoDB command
+# timings, served in the Prometheus text format at /metrics/ to these client addresses only,
+# and optionally reported to browsers in a Server-Timing response header
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+# Or to any client sending "Authorization: Bearer <METRICS_TOKEN>" (disabled when empty)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Reverse proxies whose X-Forwarded-For header is trusted to name the client address.
+# Forwarded requests from any other address are refused by the address check.
+TRUSTED_PROXY_IPS = [ip for ip in os.environ.get('TRUSTED_PROXY_IPS', '').split(',') if ip]
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', '') == '1'
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
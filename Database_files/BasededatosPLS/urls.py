@@ -1,7 +1,11 @@
 # queries/urls.py
 
+from django.conf import settings
 from django.urls import path
-from miapBBDDpls import views
+from miapBBDDpls import async_views, views
+
+# Query execution and NL job stream views: async under ASGI deployments, synchronous otherwise
+query_views = async_views if settings.ASYNC_QUERY_VIEWS else views
 
 urlpatterns = [
     path('', views.home_view, name='home'),
@@ -9,10 +13,16 @@ urlpatterns = [
     path('queries/premade/', views.premade_queries, name='premade_queries'),
     path('queries/save/', views.save_queries, name='save_queries'), 
     path('queries/schema/', views.database_schema, name='database_schema'),  
-    path('queries/execute/', views.execute_query, name='execute_query'),
+    path('queries/execute/', query_views.execute_query, name='execute_query'),
+    path('queries/cache-stats/', views.query_cache_stats, name='query_cache_stats'),
+    path('metrics/', views.metrics, name='metrics'),
     path('natural_language_query/', views.natural_language_query, name='natural_language_query'),
-    path('download-csv/', views.download_csv, name='download_csv'),  
-    path('queries/new/', views.new_query, name='new_query'),
+    path('natural_language_query/jobs/', views.submit_nl_job, name='submit_nl_job'),
+    path('natural_language_query/jobs/<str:job_id>/', views.nl_job_status, name='nl_job_status'),
+    path('natural_language_query/jobs/<str:job_id>/stream/', query_views.nl_job_stream, name='nl_job_stream'),
+    path('download-csv/', query_views.download_csv, name='download_csv'),  
+    path('queries/new/', query_views.new_query, name='new_query'),
     path('examples/', views.examples, name='examples'),
+    path('sequences/<str:sequence_ref>/', views.sequence_fasta, name='sequence_fasta'),
 ]
 
@@ -0,0 +1,402 @@
+import asyncio
+import csv
+import json
+import os
+import time
+import weakref
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from pymongo import AsyncMongoClient
+
+import json_backend
+import sequence_store
+from . import views
+from .pagination import decode_page_token, first_page_state, page_filter, page_pipeline, page_token_key
+from .projection import truncation_stage, uses_find_only_operators
+from .instrumentation import add_count, mongo_command_timer, span
+from .nl_jobs import job_finished, job_state
+from .query_guard import QueryRejected
+from .views import (
+    BUILD_GENERATION_CHECK_SECONDS,
+    CSV_BATCH_SIZE,
+    CSV_HEADER_PROBE_DOCUMENTS,
+    DISPLAY_LIMIT,
+    MAX_FIELD_LENGTH,
+    Echo,
+    csv_omitted_fields_message,
+    disk_use_option,
+    flatten_display_document,
+    make_display_page,
+    logger,
+    query_result_cache,
+)
+
+# Async versions of the query execution views, for deployments served by an ASGI server
+# (settings.ASYNC_QUERY_VIEWS). Waiting on MongoDB does not hold a thread, so one process
+# can keep many slow aggregations in flight at once.
+
+# --- Async MongoDB Connection Utility ---
+# AsyncMongoClient is bound to the event loop it is first used on: one pooled client per loop.
+_async_mongo_clients = weakref.WeakKeyDictionary()
+_async_mongo_clients_pid = None
+
+def get_async_mongo_client():
+    """
+    Returns the async MongoDB client for the running event loop, creating it on first use.
+    It uses the same pool and timeout settings as the synchronous client.
+    """
+    global _async_mongo_clients, _async_mongo_clients_pid
+    if _async_mongo_clients_pid != os.getpid():
+        # Clients inherited through a fork are not usable
+        _async_mongo_clients = weakref.WeakKeyDictionary()
+        _async_mongo_clients_pid = os.getpid()
+
+    loop = asyncio.get_running_loop()
+    client = _async_mongo_clients.get(loop)
+    if client is None:
+        client = AsyncMongoClient(
+            settings.MONGO_URI,
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS,
+            waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[mongo_command_timer],
+        )
+        _async_mongo_clients[loop] = client
+        logger.info(f"Created async MongoDB client with a pool of up to {settings.MONGO_MAX_POOL_SIZE} connections.")
+    return client
+
+def get_async_db():
+    """
+    Returns the MongoDB database instance on the async client.
+    """
+    return get_async_mongo_client()[settings.MONGO_DB_NAME]
+
+async def get_build_generation(db):
+    """
+    Async counterpart of views.get_build_generation, sharing its cached value.
+    """
+    generation, checked_at = views._build_generation
+    now = time.monotonic()
+    if now - checked_at >= BUILD_GENERATION_CHECK_SECONDS:
+        try:
+            build_info = await db['build_info'].find_one({'_id': 'build'}) or {}
+            generation = build_info.get('generation')
+        except Exception as e:
+            logger.warning(f"Could not read the build generation: {e}")
+        views._build_generation = (generation, now)
+    return generation
+
+async def run_display_query(db, target_collection, json_query, page_token=''):
+    """
+    Async counterpart of views.run_display_query, sharing the query result cache.
+    """
+    cache_key = query_result_cache.make_key(target_collection, json_query, DISPLAY_LIMIT, page_token)
+    generation = await get_build_generation(db)
+    cached_page = query_result_cache.get(cache_key, generation)
+    if cached_page is not None:
+        logger.debug(f"Serving query on {target_collection} from the result cache.")
+        return cached_page
+
+    query_key = page_token_key(target_collection, json_query)
+    state = decode_page_token(page_token, query_key) if page_token else first_page_state(json_query)
+    # Raises QueryRejected when the query is over the scan budget
+    with span('preflight'):
+        warning = await check_query_cost_async(target_collection, json_query)
+
+    # Sequence fields are cut to MAX_FIELD_LENGTH on the server instead of after transfer
+    truncation = truncation_stage(json_query, MAX_FIELD_LENGTH)
+    collection = db[target_collection]
+    if isinstance(json_query, list):
+        logger.debug(f"Executing aggregation pipeline on collection: {target_collection} (page {state['page']})")
+        results_cursor = await collection.aggregate(page_pipeline(json_query, state, DISPLAY_LIMIT) + [truncation],
+                                                    maxTimeMS=settings.QUERY_MAX_TIME_MS,
+                                                    **disk_use_option(settings.QUERY_ALLOW_DISK_USE))
+    elif uses_find_only_operators(json_query):
+        logger.debug(f"Executing find query on collection: {target_collection} with query: {json_query} (page {state['page']})")
+        results_cursor = collection.find(page_filter(json_query, state),
+                                         max_time_ms=settings.QUERY_MAX_TIME_MS,
+                                         allow_disk_use=settings.QUERY_ALLOW_DISK_USE).sort('_id', 1).limit(DISPLAY_LIMIT + 1)
+    else:
+        logger.debug(f"Executing find query as a pipeline on collection: {target_collection} with query: {json_query} (page {state['page']})")
+        results_cursor = await collection.aggregate([
+            {'$match': page_filter(json_query, state)},
+            {'$sort': {'_id': 1}},
+            {'$limit': DISPLAY_LIMIT + 1},
+            truncation,
+        ], maxTimeMS=settings.QUERY_MAX_TIME_MS, **disk_use_option(settings.QUERY_ALLOW_DISK_USE))
+
+    with span('fetch'):
+        results = await results_cursor.to_list(DISPLAY_LIMIT + 1)
+        await add_display_sequences(db, results)
+    add_count('documents', len(results))
+    page = make_display_page(results, state, query_key, warning)
+
+    query_result_cache.set(cache_key, page, generation)
+    return page
+
+async def add_display_sequences(db, results):
+    """
+    Async counterpart of views.add_display_sequences.
+    """
+    refs = sequence_store.collect_sequence_refs(results)
+    if refs:
+        blobs = await db[sequence_store.SEQUENCES_COLLECTION].find(
+            {'_id': {'$in': refs}}, max_time_ms=settings.QUERY_LOOKUP_MAX_TIME_MS).to_list(None)
+        sequence_store.add_sequence_prefixes(results, blobs, MAX_FIELD_LENGTH)
+
+async def check_query_cost_async(target_collection, json_query):
+    """
+    Runs the query_guard pre-flight (views.check_query_cost_once) in a worker thread. It only
+    issues explain and count commands, which return quickly, so it reuses the synchronous client.
+    """
+    return await sync_to_async(views.check_query_cost_once, thread_sensitive=False)(
+        views.get_db(), target_collection, json_query)
+
+async def run_query_view(request, error_template):
+    """
+    Shared body of execute_query and new_query: parses the posted query, runs it and
+    renders the results. Errors are rendered with error_template.
+    """
+    json_query_str = request.POST.get('json_query', '').strip()
+    natural_language_query = request.POST.get('natural_language_query', '').strip()
+    target_collection = request.POST.get('target_collection', '').strip()
+    page_token = request.POST.get('page_token', '').strip()
+
+    logger.debug(f"Received JSON Query String: {json_query_str}")
+    logger.debug(f"Natural Language Query: {natural_language_query}")
+    logger.debug(f"Target Collection: {target_collection}")
+
+    context = {
+        'error': '',
+        'json_query': json_query_str,
+        'natural_language_query': natural_language_query,
+        'results': [],
+        'target_collection': target_collection
+    }
+
+    try:
+        with span('parse_json'):
+            json_query = json_backend.loads(json_query_str)
+        logger.debug(f"Parsed JSON Query: {json_query}")
+    except json.JSONDecodeError as e:
+        context['error'] = f'Invalid JSON query format: {str(e)}'
+        logger.error(context['error'])
+        return await sync_to_async(render)(request, error_template, context)
+
+    if not target_collection:
+        if isinstance(json_query, list):
+            context['error'] = 'Target collection must be specified for aggregation pipelines.'
+        else:
+            context['error'] = 'Target collection must be specified for single-field queries.'
+        logger.error(context['error'])
+        return await sync_to_async(render)(request, error_template, context)
+
+    try:
+        page = await run_display_query(get_async_db(), target_collection, json_query, page_token)
+    except QueryRejected as e:
+        context['error'] = str(e)
+        logger.warning(f"Query Rejected: {e}")
+        return await sync_to_async(render)(request, error_template, context)
+    except Exception as e:
+        context['error'] = f"An error occurred while executing the query: {str(e)}"
+        logger.error(f"Query Execution Error: {e}")
+        return await sync_to_async(render)(request, error_template, context)
+
+    flattened_results = page['results']
+    logger.debug(f"Query returned {len(flattened_results)} results (page {page['page_number']}): {flattened_results[:3]}")
+
+    # Store the full query in session for CSV download
+    await sync_to_async(request.session.__setitem__)('current_query', {
+        'json_query': json_query_str,
+        'target_collection': target_collection
+    })
+
+    context['results'] = flattened_results
+    context['error'] = '' if flattened_results else 'No results found.'
+    context['page_number'] = page['page_number']
+    context['next_page_token'] = page['next_page_token']
+    context['previous_page_token'] = page['previous_page_token']
+    context['warning'] = page['warning']
+    with span('render'):
+        return await sync_to_async(render)(request, 'query_result.html', context)
+
+async def execute_query(request):
+    if request.method == 'POST':
+        return await run_query_view(request, 'query_result.html')
+    return redirect('queries_home')
+
+async def new_query(request):
+    if request.method == 'POST':
+        return await run_query_view(request, 'new_query.html')
+    return await sync_to_async(render)(request, 'new_query.html', {
+        'error': '',
+        'natural_language_query': '',
+        'json_query': '',
+        'results': []
+    })
+
+async def download_csv(request):
+    """
+    Async counterpart of views.download_csv: streams all results of the current query as CSV.
+    """
+    # Retrieve the current query from the session
+    current_query = await sync_to_async(request.session.get)('current_query', None)
+
+    if not current_query:
+        error_message = "No query found in session. Please execute a query first."
+        logger.error(error_message)
+        return HttpResponse(error_message, content_type='text/plain')
+
+    json_query_str = current_query.get('json_query', '').strip()
+    target_collection = current_query.get('target_collection', '').strip()
+
+    logger.debug(f"Downloading CSV for Query: {json_query_str} on Collection: {target_collection}")
+
+    try:
+        json_query = json_backend.loads(json_query_str)
+    except json.JSONDecodeError as e:
+        error = f'Invalid JSON query format: {str(e)}'
+        logger.error(error)
+        return HttpResponse(error, content_type='text/plain')
+
+    if not target_collection:
+        error = 'Target collection must be specified for aggregation pipelines.' if isinstance(json_query, list) \
+            else 'Target collection must be specified for single-field queries.'
+        logger.error(error)
+        return HttpResponse(error, content_type='text/plain')
+
+    try:
+        await check_query_cost_async(target_collection, json_query)
+        db = get_async_db()
+        collection = db[target_collection]
+        if isinstance(json_query, list):
+            logger.debug(f"Executing aggregation pipeline on collection: {target_collection} for CSV download")
+            results_cursor = await collection.aggregate(json_query + [truncation_stage(json_query, MAX_FIELD_LENGTH)],
+                                                        batchSize=CSV_BATCH_SIZE,
+                                                        maxTimeMS=settings.QUERY_CSV_MAX_TIME_MS,
+                                                        allowDiskUse=settings.QUERY_CSV_ALLOW_DISK_USE)
+        else:
+            logger.debug(f"Executing find query on collection: {target_collection} with query: {json_query}")
+            if uses_find_only_operators(json_query):
+                results_cursor = collection.find(json_query, max_time_ms=settings.QUERY_CSV_MAX_TIME_MS,
+                                                 allow_disk_use=settings.QUERY_CSV_ALLOW_DISK_USE).batch_size(CSV_BATCH_SIZE)
+            else:
+                # As a pipeline, so sequence fields are cut on the server
+                results_cursor = await collection.aggregate([{'$match': json_query}, truncation_stage(json_query, MAX_FIELD_LENGTH)],
+                                                            batchSize=CSV_BATCH_SIZE,
+                                                            maxTimeMS=settings.QUERY_CSV_MAX_TIME_MS,
+                                                            allowDiskUse=settings.QUERY_CSV_ALLOW_DISK_USE)
+
+        # Only the first documents are read up front, to discover the CSV header
+        rows = flatten_csv_documents(db, results_cursor)
+        first_results = []
+        async for row in rows:
+            first_results.append(row)
+            if len(first_results) >= CSV_HEADER_PROBE_DOCUMENTS:
+                break
+
+        if not first_results:
+            await results_cursor.close()
+            error_message = "No results found for the current query."
+            logger.warning(error_message)
+            return HttpResponse(error_message, content_type='text/plain')
+
+        headers = list(dict.fromkeys(key for result in first_results for key in result))
+
+        response = StreamingHttpResponse(stream_csv_rows(headers, first_results, rows, results_cursor),
+                                         content_type='text/csv')
+        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        response['Content-Disposition'] = f'attachment; filename="query_results_{timestamp}.csv"'
+        return response
+
+    except QueryRejected as e:
+        logger.warning(f"Query Rejected: {e}")
+        return HttpResponse(str(e), content_type='text/plain')
+
+    except Exception as e:
+        error = f"An error occurred while generating the CSV: {str(e)}"
+        logger.error(f"CSV Generation Error: {e}")
+        return HttpResponse(error, content_type='text/plain')
+
+async def flatten_csv_documents(db, results_cursor):
+    """
+    Async counterpart of views.flatten_csv_documents.
+    """
+    while True:
+        batch = await results_cursor.to_list(CSV_BATCH_SIZE)
+        if not batch:
+            return
+        await add_display_sequences(db, batch)
+        for document in batch:
+            yield flatten_display_document(document)
+
+async def stream_csv_rows(headers, first_results, rows, results_cursor):
+    """
+    Async counterpart of views.stream_csv_rows, reading the rest of the cursor without blocking.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+
+    record_count = 0
+    header_keys = set(headers)
+    omitted_keys = {}
+    try:
+        for result in first_results:
+            yield writer.writerow([str(result.get(key, '')) for key in headers])
+            record_count += 1
+        async for result in rows:
+            omitted_keys.update(dict.fromkeys(key for key in result if key not in header_keys))
+            yield writer.writerow([str(result.get(key, '')) for key in headers])
+            record_count += 1
+        if omitted_keys:
+            logger.warning(csv_omitted_fields_message(len(first_results), omitted_keys))
+        logger.info(f"CSV download successful with {record_count} records.")
+    except Exception as e:
+        logger.error(f"CSV Generation Error after {record_count} records: {e}")
+        raise
+    finally:
+        await results_cursor.close()
+
+async def nl_job_stream(request, job_id):
+    """
+    Async counterpart of views.nl_job_stream. One connection stays open while the job runs,
+    re-reading it every NL_JOB_STREAM_POLL_SECONDS without holding a thread.
+    """
+    owner = await sync_to_async(views.get_job_owner)(request)
+    collection = get_async_db()[views.NL_JOBS_COLLECTION]
+
+    async def get_job():
+        document = await collection.find_one({'_id': job_id, 'owner': owner})
+        return job_state(document) if document else None
+
+    job = await get_job()
+    if job is None:
+        return JsonResponse({'error': 'Job not found.'}, status=404)
+
+    async def events(job):
+        sent = views.last_event_id(request)
+        idle_seconds = 0.0
+        while job is not None:
+            for event in views.nl_job_events(job, sent):
+                yield event
+            if job_finished(job):
+                return
+            if len(job['tokens']) > sent:
+                sent, idle_seconds = len(job['tokens']), 0.0
+            elif idle_seconds >= views.NL_JOB_STREAM_HEARTBEAT_SECONDS:
+                yield ": keep-alive\n\n"
+                idle_seconds = 0.0
+            await asyncio.sleep(views.NL_JOB_STREAM_POLL_SECONDS)
+            idle_seconds += views.NL_JOB_STREAM_POLL_SECONDS
+            job = await get_job()
+
+    response = StreamingHttpResponse(events(job), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
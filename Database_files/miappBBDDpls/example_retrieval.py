@@ -0,0 +1,72 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+
+def tokenize(text):
+    """
+    Splits text into lower-case word tokens, keeping gene-style names such as ctx-m-15 whole.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class ExampleIndex:
+    """
+    TF-IDF index over the questions of the few-shot examples.
+
+    Document vectors are L2-normalized and stored as per-token postings (example
+    indices and weights in NumPy arrays), so scoring a question only touches the
+    examples that share a token with it and stays fast as the library grows.
+    """
+
+    def __init__(self, examples):
+        self.examples = list(examples)
+        documents = [Counter(tokenize(example['input'])) for example in self.examples]
+
+        document_frequency = Counter(token for counts in documents for token in counts)
+        example_count = len(documents)
+        # Smoothed inverse document frequency
+        self.idf = {
+            token: math.log((1 + example_count) / (1 + frequency)) + 1.0
+            for token, frequency in document_frequency.items()
+        }
+
+        postings = {}
+        for example_idx, counts in enumerate(documents):
+            weights = {token: count * self.idf[token] for token, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for token, weight in weights.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(example_idx)
+                postings[token][1].append(weight / norm)
+
+        self.postings = {
+            token: (np.array(indices, dtype=np.int32), np.array(weights, dtype=np.float32))
+            for token, (indices, weights) in postings.items()
+        }
+
+    def scores(self, question):
+        """
+        Returns the cosine similarity between the question and every example.
+        """
+        scores = np.zeros(len(self.examples), dtype=np.float32)
+        counts = Counter(token for token in tokenize(question) if token in self.postings)
+        for token, count in counts.items():
+            indices, weights = self.postings[token]
+            scores[indices] += count * self.idf[token] * weights
+        return scores
+
+    def top_k(self, question, k):
+        """
+        Returns the k examples most similar to the question, best first.
+        Ties keep the original example order.
+        """
+        if k <= 0 or not self.examples:
+            return []
+        scores = self.scores(question)
+        ranked = np.lexsort((np.arange(len(scores)), -scores))[:k]
+        return [self.examples[idx] for idx in ranked]
@@ -0,0 +1,255 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from pymongo import monitoring
+
+# Histogram buckets, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Timings of the request being handled in this thread or task (None outside requests)
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Per-request breakdown: total seconds per named stage, MongoDB command time and counts.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.mongo_seconds = 0.0
+        self.mongo_commands = 0
+        self.counts = {}
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self, total_seconds):
+        """
+        Returns the Server-Timing header value for this request (durations in milliseconds).
+        """
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        if self.mongo_commands:
+            entries.append(f'mongo;dur={self.mongo_seconds * 1000:.2f};desc="{self.mongo_commands} commands"')
+        entries.append(f"total;dur={total_seconds * 1000:.2f}")
+        return ', '.join(entries)
+
+
+class Histogram:
+    """
+    Prometheus histogram with a fixed label set.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (bucket_counts, total, count) in sorted(self._series.items()):
+            label_text = format_labels(self.label_names, labels)
+            separator = ',' if label_text else ''
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f'{self.name}_bucket{{{label_text}{separator}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{label_text}{separator}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class Counter:
+    """
+    Prometheus counter with a fixed label set.
+    """
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def inc(self, labels, value=1):
+        self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{{{format_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def format_labels(label_names, labels):
+    """
+    Formats label pairs for the Prometheus text format, escaping the values.
+    """
+    return ','.join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), chr(92) + "n")}"'
+        for name, value in zip(label_names, labels)
+    )
+
+
+class MetricsRegistry:
+    """
+    Process-wide request, stage and MongoDB command metrics, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_duration = Histogram('plasmiddb_request_duration_seconds',
+                                          'Time spent handling requests, by view.', ('view',))
+        self.stage_duration = Histogram('plasmiddb_stage_duration_seconds',
+                                        'Time spent in each instrumented stage of a view.', ('view', 'stage'))
+        self.mongo_duration = Histogram('plasmiddb_mongo_command_duration_seconds',
+                                        'MongoDB command round-trip time, by command.', ('command',))
+        self.mongo_failures = Counter('plasmiddb_mongo_command_failures_total',
+                                      'MongoDB commands that returned an error, by command.', ('command',))
+        self.documents = Counter('plasmiddb_result_documents_total',
+                                 'Documents fetched from MongoDB for display, by view.', ('view',))
+        self.response_bytes = Counter('plasmiddb_response_bytes_total',
+                                      'Bytes of non-streaming response bodies, by view.', ('view',))
+
+    def observe_mongo_command(self, command_name, seconds, failed=False):
+        with self._lock:
+            self.mongo_duration.observe((command_name,), seconds)
+            if failed:
+                self.mongo_failures.inc((command_name,))
+
+    def observe_request(self, view, total_seconds, timings, response_bytes=None):
+        with self._lock:
+            self.request_duration.observe((view,), total_seconds)
+            for stage, seconds in timings.stages.items():
+                self.stage_duration.observe((view, stage), seconds)
+            if 'documents' in timings.counts:
+                self.documents.inc((view,), timings.counts['documents'])
+            if response_bytes is not None:
+                self.response_bytes.inc((view,), response_bytes)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.request_duration, self.stage_duration, self.mongo_duration, self.mongo_failures,
+                           self.documents, self.response_bytes):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+@contextmanager
+def span(name):
+    """
+    Times a stage of the current request. Outside a request, the block runs untimed.
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_stage(name, time.perf_counter() - start)
+
+
+def add_count(name, value):
+    """
+    Adds to a per-request count, such as the number of documents fetched.
+    """
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.counts[name] = timings.counts.get(name, 0) + value
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    pymongo command listener feeding command round-trip times to the metrics registry and
+    to the timings of the request that issued them. pymongo calls it in the thread or task
+    that runs the command, so the request context is the caller's.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+    def _record(self, event, failed):
+        seconds = event.duration_micros / 1e6
+        metrics_registry.observe_mongo_command(event.command_name, seconds, failed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.mongo_seconds += seconds
+            timings.mongo_commands += 1
+
+
+mongo_command_timer = MongoCommandTimer()
+
+
+class TimingMiddleware:
+    """
+    Collects the timing breakdown of every request, records it in the metrics registry
+    and, with settings.SERVER_TIMING_HEADER, reports it in a Server-Timing header.
+    Works for sync and async views.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total_seconds = time.perf_counter() - timings.started
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        # Streaming bodies are produced after the view returns, so only the time to the first byte is measured
+        response_bytes = None if response.streaming else len(response.content)
+        metrics_registry.observe_request(view, total_seconds, timings, response_bytes)
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = timings.server_timing(total_seconds)
+        return response
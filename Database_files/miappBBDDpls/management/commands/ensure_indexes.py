@@ -0,0 +1,70 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+import database_build
+
+from ... import views
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the curated MongoDB index set (database_build.INDEX_SPECS) and report "
+        "timings for the example and few-shot queries before and after."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-timings', action='store_true',
+                            help="Only create the indexes, without timing the example queries.")
+        parser.add_argument('--max-time-ms', type=int, default=60000,
+                            help="Server-side time limit for each timed query.")
+
+    def handle(self, *args, **options):
+        db = views.get_db()
+        queries = self.collect_queries()
+
+        before = [] if options['skip_timings'] else self.time_queries(db, queries, options['max_time_ms'])
+        created = database_build.ensure_indexes(db)
+        for collection_name, index_names in created.items():
+            self.stdout.write(f"{collection_name}: {', '.join(index_names)}")
+        if options['skip_timings']:
+            return
+        after = self.time_queries(db, queries, options['max_time_ms'])
+
+        self.stdout.write(f"\n{'before (ms)':>12} {'after (ms)':>12}  query")
+        for (label, _, _), before_ms, after_ms in zip(queries, before, after):
+            self.stdout.write(f"{before_ms:>12} {after_ms:>12}  {label[:80]}")
+
+    def collect_queries(self):
+        """
+        Gather (label, collection, query) tuples from the examples page and the few-shot examples.
+        """
+        queries = []
+        for query in views.SAMPLE_QUERIES:
+            queries.append((query['natural_language'], query['collection'], json.loads(query['json_query'])))
+        for example in views.get_few_shot_examples():
+            output = example['output']
+            queries.append((example['input'], output['collection'], output['pipeline']))
+        return queries
+
+    def time_queries(self, db, queries, max_time_ms):
+        """
+        Run every query to completion and return their wall times in milliseconds, in query order.
+        """
+        timings = []
+        for label, collection_name, query in queries:
+            collection = db[collection_name]
+            start = time.perf_counter()
+            try:
+                if isinstance(query, list):
+                    cursor = collection.aggregate(query, maxTimeMS=max_time_ms)
+                else:
+                    cursor = collection.find(query).max_time_ms(max_time_ms)
+                for _ in cursor:
+                    pass
+                timings.append(f"{(time.perf_counter() - start) * 1000:.1f}")
+            except Exception as e:
+                self.stderr.write(f"Query failed ({label[:60]}): {e}")
+                timings.append('error')
+        return timings
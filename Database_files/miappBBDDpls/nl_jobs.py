@@ -0,0 +1,180 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING
+
+import json_backend
+
+UNFINISHED_STATUSES = ('queued', 'running')
+INTERRUPTED_ERROR = "The query generation was interrupted. Please try again."
+FAILED_ERROR = "Failed to generate a valid pipeline. Please check your query and try again."
+
+
+class TooManyJobs(Exception):
+    """
+    Raised when an owner already has the maximum number of unfinished jobs.
+    """
+
+
+def job_state(document, now=None):
+    """
+    Returns the state of a stored NL job document as a dict: 'job_id', 'owner', 'question',
+    'status', 'tokens', 'output' (the decoded model output, or None) and 'error'.
+
+    Status moves from 'queued' to 'running' to 'done' or 'failed'. A job still unfinished
+    after its expires_at was abandoned by the process running it and is reported as failed.
+    """
+    now = now or datetime.utcnow()
+    status = document['status']
+    error = document.get('error', '')
+    if status in UNFINISHED_STATUSES and document['expires_at'] <= now:
+        status, error = 'failed', INTERRUPTED_ERROR
+    output = document.get('output')
+    return {
+        'job_id': document['_id'],
+        'owner': document['owner'],
+        'question': document['question'],
+        'status': status,
+        'tokens': document.get('tokens', []),
+        'output': json_backend.loads(output) if output else None,
+        'error': error,
+    }
+
+
+def job_finished(job):
+    """
+    Returns True once a job state is 'done' or 'failed'.
+    """
+    return job['status'] not in UNFINISHED_STATUSES
+
+
+class TokenBuffer:
+    """
+    Collects the tokens a job's model streams and appends them to the job document at most
+    every flush_interval seconds, instead of issuing one update per token.
+    """
+
+    def __init__(self, collection, job_id, flush_interval):
+        self.collection = collection
+        self.job_id = job_id
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._flushed_at = time.monotonic()
+
+    def add(self, token):
+        self._pending.append(token)
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.collection.update_one({'_id': self.job_id}, {'$push': {'tokens': {'$each': self._pending}}})
+            self._pending = []
+        self._flushed_at = time.monotonic()
+
+
+class NLJobQueue:
+    """
+    Runs natural language → pipeline generation jobs on a bounded pool of worker threads, so
+    model calls never occupy more than max_workers threads per process and never block
+    request workers.
+
+    Job state lives in the MongoDB collection returned by get_collection rather than in the
+    process, so any worker process can report a job's progress and result. Each owner (user,
+    session or client address) may have at most max_jobs_per_owner unfinished jobs. Jobs are
+    deleted by a TTL index job_ttl_seconds after they finish; unfinished jobs older than that
+    are treated as abandoned.
+    """
+
+    def __init__(self, get_collection, max_workers=2, max_jobs_per_owner=1, job_ttl_seconds=600, flush_interval=0.25):
+        self.get_collection = get_collection
+        self.max_workers = max_workers
+        self.max_jobs_per_owner = max_jobs_per_owner
+        self.job_ttl_seconds = job_ttl_seconds
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._executor = None
+        self._indexes_ensured = False
+
+    def submit(self, owner, question, generate):
+        """
+        Queues generate(question, on_token) for the owner and returns the new job's state.
+        generate must return the pipeline output, or None on failure.
+        Raises TooManyJobs when the owner is at the concurrency limit.
+        """
+        collection = self.get_collection()
+        self._ensure_indexes(collection)
+        now = datetime.utcnow()
+        document = {
+            '_id': uuid.uuid4().hex,
+            'owner': owner,
+            'question': question,
+            'status': 'queued',
+            'tokens': [],
+            'output': None,
+            'error': '',
+            'created_at': now,
+            'finished_at': None,
+            'expires_at': now + timedelta(seconds=self.job_ttl_seconds),
+        }
+        collection.insert_one(document)
+        # Counted after inserting, so concurrent submits from one owner (in any process) cannot
+        # both pass the check; at worst both are refused
+        active = collection.count_documents(
+            {'owner': owner, 'status': {'$in': list(UNFINISHED_STATUSES)}, 'expires_at': {'$gt': now}}
+        )
+        if active > self.max_jobs_per_owner:
+            collection.delete_one({'_id': document['_id']})
+            raise TooManyJobs(f"At most {self.max_jobs_per_owner} natural language queries can run at once.")
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='nl-job')
+            self._executor.submit(self._run, collection, document['_id'], question, generate)
+        return job_state(document, now)
+
+    def get(self, job_id, owner):
+        """
+        Returns the state of the owner's job with this ID, or None.
+        """
+        document = self.get_collection().find_one({'_id': job_id, 'owner': owner})
+        return job_state(document) if document else None
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker threads, by default after the queued jobs have run.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _run(self, collection, job_id, question, generate):
+        collection.update_one({'_id': job_id}, {'$set': {'status': 'running'}})
+        tokens = TokenBuffer(collection, job_id, self.flush_interval)
+        try:
+            output = generate(question, tokens.add)
+        except Exception as e:
+            output, error = None, str(e)
+        else:
+            error = '' if output is not None else FAILED_ERROR
+        tokens.flush()
+        finished_at = datetime.utcnow()
+        collection.update_one({'_id': job_id}, {'$set': {
+            'status': 'failed' if output is None else 'done',
+            # Stored as text: pipeline stages have $-prefixed keys
+            'output': json_backend.dumps(output) if output is not None else None,
+            'error': error,
+            'finished_at': finished_at,
+            'expires_at': finished_at + timedelta(seconds=self.job_ttl_seconds),
+        }})
+
+    def _ensure_indexes(self, collection):
+        if self._indexes_ensured:
+            return
+        collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+        collection.create_index([('owner', ASCENDING), ('status', ASCENDING)])
+        self._indexes_ensured = True
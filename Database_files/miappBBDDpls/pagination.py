@@ -0,0 +1,193 @@
+"""
+Result paging for the query views.
+
+Find queries, and pipelines made only of KEYSET_STAGES, are paged by _id range, so their
+results are always listed in _id order, whatever order the server would otherwise return.
+Other pipelines are paged with $skip after the user's own stages. A $limit in a pipeline is
+kept as written: it bounds the whole result set, and pages are cut from that set.
+
+Page tokens are signed with SECRET_KEY and a hash of the query they were issued for
+(see page_token_key), so a token cannot be edited or replayed against another query.
+"""
+import base64
+import binascii
+import hashlib
+
+from bson import json_util
+from django.core import signing
+
+# Pipeline stages that keep one output document per input document, with its _id unchanged.
+# Pipelines made only of these can be paged by _id (keyset); anything else falls back to $skip.
+# Keyset paging puts its own $match and $sort on _id in front of the pipeline, so a $match
+# using $text (which must be the first stage) and a $sort on other fields are paged by $skip.
+KEYSET_STAGES = {'$match', '$lookup', '$addFields', '$set', '$project', '$unset', '$sort'}
+
+# _id cursors of earlier pages kept in keyset page tokens for the Previous button; pages
+# further back are only reachable from the first page
+PAGE_HISTORY_LIMIT = 50
+
+# page and skip must fit a BSON 64-bit integer
+MAX_PAGE_VALUE = 2 ** 63 - 1
+
+
+def page_token_key(collection, json_query):
+    """
+    Returns the key binding page tokens to a query on a collection.
+    """
+    return hashlib.sha256(f"{collection}\n{json_util.dumps(json_query)}".encode()).hexdigest()
+
+
+def page_token_signer(query_key):
+    """
+    Returns the signer for page tokens of the query identified by query_key.
+    """
+    return signing.Signer(salt=f"miapBBDDpls.pagination:{query_key}")
+
+
+def encode_page_token(state, query_key):
+    """
+    Encodes a page state ({'page', 'after' and 'previous', or 'skip'}) as an opaque URL-safe
+    token, signed for the query identified by query_key.
+    """
+    payload = base64.urlsafe_b64encode(json_util.dumps(state).encode()).decode()
+    return page_token_signer(query_key).sign(payload)
+
+
+def decode_page_token(page_token, query_key):
+    """
+    Decodes a page token issued for the query identified by query_key.
+    Raises ValueError when the token is malformed, was issued for another query or holds
+    an invalid page state.
+    """
+    try:
+        payload = page_token_signer(query_key).unsign(page_token)
+        state = json_util.loads(base64.urlsafe_b64decode(payload.encode()))
+    except signing.BadSignature:
+        raise ValueError("Invalid page token: it does not belong to this query.")
+    except (binascii.Error, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid page token: {e}")
+    if not valid_page_state(state):
+        raise ValueError("Invalid page token.")
+    return state
+
+
+def valid_page_state(state):
+    """
+    Returns True when state is a page state next_page_state or previous_page_state could produce.
+    """
+    def counter(value, minimum):
+        return isinstance(value, int) and not isinstance(value, bool) and minimum <= value <= MAX_PAGE_VALUE
+
+    if not isinstance(state, dict) or not counter(state.get('page'), 1):
+        return False
+    if 'skip' in state:
+        return set(state) == {'page', 'skip'} and counter(state['skip'], 0)
+    if state['page'] == 1:
+        return set(state) == {'page'}
+    previous = state.get('previous', [])
+    return ('after' in state and set(state) <= {'page', 'after', 'previous'} and isinstance(previous, list)
+            and len(previous) <= min(PAGE_HISTORY_LIMIT, state['page'] - 2))
+
+
+def keyset_supported(json_query):
+    """
+    Returns True when the query's results can be paged by _id instead of $skip.
+    """
+    if not isinstance(json_query, list):
+        return True
+    for stage in json_query:
+        if len(stage) != 1:
+            return False
+        operator, spec = next(iter(stage.items()))
+        if operator not in KEYSET_STAGES:
+            return False
+        if operator == '$match' and uses_text_search(spec):
+            return False
+        if operator == '$sort' and spec != {'_id': 1}:
+            return False
+        if operator == '$lookup' and spec.get('as') == '_id':
+            return False
+        if operator in ('$addFields', '$set') and '_id' in spec:
+            return False
+        if operator == '$project' and spec.get('_id', 1) not in (1, True):
+            return False
+        if operator == '$unset' and '_id' in ([spec] if isinstance(spec, str) else spec):
+            return False
+    return True
+
+
+def uses_text_search(query):
+    """
+    Returns True when a filter uses $text anywhere.
+    """
+    if isinstance(query, dict):
+        return any(key == '$text' or uses_text_search(value) for key, value in query.items())
+    if isinstance(query, list):
+        return any(uses_text_search(item) for item in query)
+    return False
+
+
+def page_pipeline(json_query, state, page_size):
+    """
+    Returns the aggregation pipeline fetching the page described by state, plus one
+    extra document to tell whether a next page exists.
+    """
+    if 'skip' in state:
+        return json_query + [{'$skip': state['skip']}, {'$limit': page_size + 1}]
+    keyset_stages = [{'$sort': {'_id': 1}}]
+    if 'after' in state:
+        keyset_stages.insert(0, {'$match': {'_id': {'$gt': state['after']}}})
+    return keyset_stages + json_query + [{'$limit': page_size + 1}]
+
+
+def page_filter(json_query, state):
+    """
+    Returns the find filter for the page described by state (find queries are always keyset-paged).
+    """
+    if 'after' not in state:
+        return json_query
+    return {'$and': [json_query, {'_id': {'$gt': state['after']}}]}
+
+
+def first_page_state(json_query):
+    """
+    Returns the page state of the first page: keyset when supported, otherwise $skip.
+    """
+    if keyset_supported(json_query):
+        return {'page': 1}
+    return {'page': 1, 'skip': 0}
+
+
+def next_page_state(state, results, page_size):
+    """
+    Returns the state of the page after the one whose raw results (up to page_size + 1
+    documents) were fetched with state, or None on the last page.
+    """
+    if len(results) <= page_size:
+        return None
+    if 'skip' in state:
+        return {'page': state['page'] + 1, 'skip': state['skip'] + page_size}
+    next_state = {'page': state['page'] + 1, 'after': results[page_size - 1]['_id']}
+    if 'after' in state:
+        next_state['previous'] = (state.get('previous', []) + [state['after']])[-PAGE_HISTORY_LIMIT:]
+    return next_state
+
+
+def previous_page_state(state, page_size):
+    """
+    Returns the state of the page before the one described by state, or None on the first
+    page and on keyset pages whose cursor fell out of the PAGE_HISTORY_LIMIT history.
+    """
+    if state['page'] == 1:
+        return None
+    if 'skip' in state:
+        return {'page': state['page'] - 1, 'skip': max(state['skip'] - page_size, 0)}
+    if state['page'] == 2:
+        return {'page': 1}
+    previous = state.get('previous', [])
+    if not previous:
+        return None
+    previous_state = {'page': state['page'] - 1, 'after': previous[-1]}
+    if len(previous) > 1:
+        previous_state['previous'] = previous[:-1]
+    return previous_state
@@ -0,0 +1,89 @@
+# Fields holding whole sequences; only their first MAX_FIELD_LENGTH characters are ever displayed
+SEQUENCE_FIELDS = ('sequence', 'nt_sequence', 'aa_sequence')
+
+# Query operators that only find() supports, so such filters cannot become a $match stage
+FIND_ONLY_OPERATORS = {'$where', '$near', '$nearSphere'}
+
+
+def truncate_expression(expression, max_length):
+    """
+    Aggregation expression returning the first max_length code points of a string value
+    (the same as Python's value[:max_length]) and any other value unchanged.
+    """
+    return {'$cond': [
+        {'$eq': [{'$type': expression}, 'string']},
+        {'$substrCP': [expression, 0, max_length]},
+        expression
+    ]}
+
+
+def truncate_document_expression(expression, max_length):
+    """
+    Aggregation expression returning the sub-document with its sequence fields truncated.
+    Field order is kept, and sequence fields the document does not have are not added.
+    """
+    return {'$mergeObjects': [
+        expression,
+        {field: truncate_expression(f"{expression}.{field}", max_length) for field in SEQUENCE_FIELDS}
+    ]}
+
+
+def embedded_fields(json_query):
+    """
+    Returns the top-level fields a pipeline fills with documents from other collections
+    ($lookup / $graphLookup 'as'), where joined sequences end up.
+    """
+    fields = []
+    for stage in json_query if isinstance(json_query, list) else []:
+        for operator in ('$lookup', '$graphLookup'):
+            spec = stage.get(operator)
+            name = spec.get('as') if isinstance(spec, dict) else None
+            if name and '.' not in name and name not in SEQUENCE_FIELDS and name not in fields:
+                fields.append(name)
+    return fields
+
+
+def truncation_stage(json_query, max_length):
+    """
+    Returns a $set stage that truncates sequence fields on the server, so the documents
+    returned by the query only carry the characters that will be displayed.
+
+    Covers the sequence fields at the top level and inside the documents of the query's
+    $lookup fields (arrays, or sub-documents once $unwind has run). Values of any other
+    type, and fields missing from a document, are left as they are.
+    """
+    fields = {field: truncate_expression(f"${field}", max_length) for field in SEQUENCE_FIELDS}
+    for name in embedded_fields(json_query):
+        fields[name] = {'$switch': {
+            'branches': [
+                {
+                    'case': {'$isArray': f"${name}"},
+                    'then': {'$map': {
+                        'input': f"${name}",
+                        'as': 'item',
+                        'in': {'$cond': [
+                            {'$eq': [{'$type': '$$item'}, 'object']},
+                            truncate_document_expression('$$item', max_length),
+                            '$$item'
+                        ]}
+                    }}
+                },
+                {
+                    'case': {'$eq': [{'$type': f"${name}"}, 'object']},
+                    'then': truncate_document_expression(f"${name}", max_length)
+                },
+            ],
+            'default': f"${name}"
+        }}
+    return {'$set': fields}
+
+
+def uses_find_only_operators(query):
+    """
+    Returns True when a find filter uses operators that a $match stage does not accept.
+    """
+    if isinstance(query, dict):
+        return any(key in FIND_ONLY_OPERATORS or uses_find_only_operators(value) for key, value in query.items())
+    if isinstance(query, list):
+        return any(uses_find_only_operators(item) for item in query)
+    return False
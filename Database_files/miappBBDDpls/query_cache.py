@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+
+from bson import json_util
+
+
+class QueryResultCache:
+    """
+    Thread-safe, size-bounded LRU cache with a time-to-live for executed query results.
+
+    Entries belong to a database build generation; when the generation changes
+    (the database was rebuilt), every entry is dropped.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(collection, query, display_limit, page_token=''):
+        """
+        Builds a cache key from the collection, the query, the display limit and the page token.
+        Key order inside query documents is kept: it is significant to MongoDB ($sort and
+        $project specs), so queries differing only in key order get different keys.
+        """
+        query_text = json_util.dumps(query)
+        return (collection, query_text, display_limit, page_token)
+
+    def get(self, key, generation):
+        """
+        Returns the cached value for key, or None on a miss or when the entry expired.
+        """
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, generation):
+        """
+        Stores value under key, evicting the least recently used entries beyond max_entries.
+        """
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'generation': self._generation,
+            }
+
+    def _check_generation(self, generation):
+        # Caller holds the lock
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
@@ -0,0 +1,151 @@
+import logging
+
+from django.conf import settings
+from pymongo.errors import ExecutionTimeout, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Winning plan stages that read documents through an index instead of the whole collection
+INDEX_STAGES = {'IXSCAN', 'IDHACK', 'COUNT_SCAN', 'DISTINCT_SCAN', 'EXPRESS_IXSCAN', 'EXPRESS_CLUSTERED_IXSCAN'}
+
+
+class QueryRejected(Exception):
+    """
+    Raised when a query's estimated cost is above settings.QUERY_SCAN_MAX_DOCS.
+    """
+
+
+def check_query_cost(db, collection_name, json_query):
+    """
+    Pre-flight check run before a user or LLM-generated query is executed.
+
+    Estimates how many documents the query will scan (see estimate_query_cost, a heuristic
+    rather than a bound) and compares it with the configured budget. The views run it
+    once per query through views.check_query_cost_once.
+
+    Returns:
+        str: A warning to show next to the results, or '' when the query is within budget.
+
+    Raises:
+        QueryRejected: If the estimate is above settings.QUERY_SCAN_MAX_DOCS.
+    """
+    try:
+        cost = estimate_query_cost(db, collection_name, json_query)
+    except PyMongoError as e:
+        # The query itself will report the problem if it is invalid
+        logger.warning(f"Query pre-flight failed on {collection_name}, running unchecked: {e}")
+        return ''
+
+    scanned_docs = cost['scanned_docs']
+    logger.debug(f"Query pre-flight on {collection_name}: ~{scanned_docs} documents scanned, index used: {cost['uses_index']}")
+
+    max_docs = settings.QUERY_SCAN_MAX_DOCS
+    if max_docs is not None and scanned_docs > max_docs:
+        raise QueryRejected(
+            f"Query rejected: it would scan about {scanned_docs:,} documents (limit {max_docs:,}). "
+            f"Start the pipeline with a selective $match on an indexed field, or $limit it before any $lookup."
+        )
+
+    warn_docs = settings.QUERY_SCAN_WARN_DOCS
+    if warn_docs is not None and scanned_docs > warn_docs:
+        index_note = '' if cost['uses_index'] else ' without using an index'
+        return f"This query scans about {scanned_docs:,} documents{index_note} and may be slow."
+    return ''
+
+
+def estimate_query_cost(db, collection_name, json_query):
+    """
+    Estimates the number of documents a find query or aggregation pipeline will read.
+
+    The leading query is explained (queryPlanner verbosity, so nothing is executed):
+    a collection scan reads the whole collection, an index scan reads the documents
+    its leading $match selects. Each following $lookup then costs one index probe
+    per input document when the foreign field is indexed, or a scan of the foreign
+    collection per input document when it is not. The estimate is not a bound either way:
+    $match stages after the first are assumed to filter nothing, which overestimates, while
+    stages that multiply documents ($unwind, or a $lookup matching several foreign documents)
+    are not modelled, so the stages after them can cost more than estimated.
+
+    Returns:
+        dict: 'scanned_docs' (int), 'uses_index' (bool) and 'plan_stages' (sorted list of plan stage names).
+    """
+    collection_counts = {}
+
+    def collection_count(name):
+        if name not in collection_counts:
+            collection_counts[name] = db[name].estimated_document_count()
+        return collection_counts[name]
+
+    if isinstance(json_query, list):
+        explain_command = {'aggregate': collection_name, 'pipeline': json_query, 'cursor': {}}
+        leading_match = json_query[0].get('$match', {}) if json_query else {}
+    else:
+        explain_command = {'find': collection_name, 'filter': json_query}
+        leading_match = json_query
+    explain_output = db.command({'explain': explain_command, 'verbosity': 'queryPlanner'})
+
+    plan_stages = winning_plan_stages(explain_output)
+    uses_index = 'COLLSCAN' not in plan_stages and bool(plan_stages & INDEX_STAGES)
+    if uses_index:
+        try:
+            docs = db[collection_name].count_documents(leading_match, maxTimeMS=settings.QUERY_EXPLAIN_MAX_TIME_MS)
+        except ExecutionTimeout:
+            docs = collection_count(collection_name)
+    else:
+        docs = collection_count(collection_name)
+    scanned_docs = docs
+
+    for stage in json_query if isinstance(json_query, list) else []:
+        if '$limit' in stage:
+            docs = min(docs, stage['$limit'])
+        elif '$lookup' in stage:
+            lookup = stage['$lookup']
+            if 'pipeline' not in lookup and foreign_field_indexed(db[lookup['from']], lookup.get('foreignField')):
+                scanned_docs += docs
+            else:
+                scanned_docs += docs * collection_count(lookup['from'])
+        elif '$graphLookup' in stage:
+            lookup = stage['$graphLookup']
+            if foreign_field_indexed(db[lookup['from']], lookup.get('connectToField')):
+                scanned_docs += docs
+            else:
+                scanned_docs += docs * collection_count(lookup['from'])
+        elif '$unionWith' in stage:
+            union = stage['$unionWith']
+            union_docs = collection_count(union if isinstance(union, str) else union['coll'])
+            scanned_docs += union_docs
+            docs += union_docs
+
+    return {'scanned_docs': scanned_docs, 'uses_index': uses_index, 'plan_stages': sorted(plan_stages)}
+
+
+def winning_plan_stages(explain_output):
+    """
+    Returns the set of stage names in every winning plan of an explain output
+    (find, pushed-down aggregation and classic or slot-based engine layouts).
+    """
+    stages = set()
+
+    def collect(node, in_plan):
+        if isinstance(node, dict):
+            if in_plan and isinstance(node.get('stage'), str):
+                stages.add(node['stage'])
+            for key, value in node.items():
+                collect(value, in_plan or key == 'winningPlan')
+        elif isinstance(node, list):
+            for value in node:
+                collect(value, in_plan)
+
+    collect(explain_output, False)
+    return stages
+
+
+def foreign_field_indexed(collection, field):
+    """
+    Returns True when an index on the collection starts with field, so $lookup probes it.
+    """
+    if not field:
+        return False
+    if field == '_id':
+        return True
+    return any(index['key'][0][0] == field for index in collection.index_information().values())
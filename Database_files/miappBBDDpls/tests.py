@@ -1,3 +1,1561 @@
-from django.test import TestCase
+import asyncio
+import csv
+import dataclasses
+import datetime
+import enum
+import inspect
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import mongomock
+import pandas as pd
+from bson import ObjectId
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+import database_build
+import json_backend
+import sequence_store
+from sequence_codec import PackedSequence, pack_sequence
+
+from . import async_views, instrumentation, views
+from .example_retrieval import ExampleIndex, tokenize
+from .nl_jobs import FAILED_ERROR, INTERRUPTED_ERROR, NLJobQueue, TooManyJobs
+from .pagination import (PAGE_HISTORY_LIMIT, decode_page_token, encode_page_token, first_page_state, keyset_supported,
+                         next_page_state, page_filter, page_pipeline, page_token_key, previous_page_state)
+from .projection import SEQUENCE_FIELDS, embedded_fields, truncation_stage, uses_find_only_operators
+from .query_cache import QueryResultCache
+from .query_guard import QueryRejected, check_query_cost, estimate_query_cost, foreign_field_indexed, winning_plan_stages
+
+
+class BaktaParserTests(SimpleTestCase):
+
+    FEATURES = [
+        {'type': 'cds', 'locus': 'ABC_00010', 'id': 'f1', 'gene': 'sul1', 'product': 'sulfonamide resistance',
+         'start': 10, 'stop': 850, 'strand': '+', 'contig': 'c1', 'db_xrefs': ['UniRef:UniRef50_A0A'],
+         'nt': 'ATG' * 280, 'aa': 'M' * 280, 'score': 0.75},
+        {'type': 'tRNA', 'locus': 'ABC_00020', 'start': 900, 'stop': 975, 'strand': '-', 'contig': 'c1'},
+        {'type': 'CDS', 'locus': 'ABC_00030', 'start': 1000, 'stop': 1300, 'strand': '-', 'contig': 'c2'},
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, text):
+        path = os.path.join(self.directory, 'annotation.json')
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def annotation(self, features=None):
+        return json.dumps({
+            'genome': {'genus': 'Escherichia', 'species': 'coli'},
+            'features': self.FEATURES if features is None else features,
+            'sequences': [{'id': 'c1', 'nt': 'ACGT' * 1000, 'length': 4000}, {'id': 'c2', 'nt': 'GATTACA' * 100}],
+            'stats': {'size': 4700},
+        })
+
+    def parse(self, path):
+        return {bakta_parser: database_build.parse_bakta_file(path, 'p1', bakta_parser)
+                for bakta_parser in database_build.BAKTA_PARSERS}
+
+    def test_parsers_agree(self):
+        results = self.parse(self.write(self.annotation()))
+        self.assertEqual(results['streaming'], results['full'])
+        plasmid_id, genes, error = results['full']
+        self.assertEqual((plasmid_id, error), ('p1', None))
+        self.assertEqual([gene['locus'] for gene in genes], ['ABC_00010', 'ABC_00030'])
+        self.assertEqual(genes[0]['nt_sequence'], 'ATG' * 280)
+        self.assertEqual(genes[1]['db_xrefs'], [])
+
+    def test_file_without_features(self):
+        text = json.dumps({'genome': {}, 'sequences': []})
+        self.assertEqual(self.parse(self.write(text)), {bakta_parser: ('p1', [], None)
+                                                        for bakta_parser in database_build.BAKTA_PARSERS})
+
+    def test_corruption_after_the_features_is_an_error_for_both_parsers(self):
+        text = self.annotation()
+        for corrupt in (text[:text.index('GATTACA')], text[:-1], text + ' {}', text.replace('"stats"', 'stats')):
+            with self.subTest(corrupt=corrupt[-30:]):
+                results = self.parse(self.write(corrupt))
+                self.assertEqual(results['full'], ('p1', None, 'Error decoding JSON for p1'))
+                self.assertEqual(results['streaming'], results['full'])
+
+    def test_integers_beyond_64_bits_fall_back_to_the_full_parser(self):
+        features = [dict(self.FEATURES[0], start=2 ** 70)]
+        results = self.parse(self.write(self.annotation(features)))
+        self.assertEqual(results['full'][1][0]['start'], 2 ** 70)
+        self.assertEqual(results['streaming'], results['full'])
+
+    @unittest.skipIf(database_build.ijson is None, "ijson is not installed")
+    def test_streaming_reads_the_features_with_ijson(self):
+        path = self.write(self.annotation())
+        expected = self.parse(path)['full']
+        with mock.patch.object(database_build, 'json_backend') as backend:
+            self.assertEqual(database_build.parse_bakta_file(path, 'p1', 'streaming'), expected)
+        backend.load.assert_not_called()
+
+    def test_streaming_without_ijson(self):
+        path = self.write(self.annotation())
+        expected = self.parse(path)['full']
+        with mock.patch.object(database_build, 'ijson', None):
+            self.assertEqual(database_build.parse_bakta_file(path, 'p1', 'streaming'), expected)
+
+
+def patch_mongomock_bulk_writes(testcase):
+    """
+    Let mongomock run the ReplaceOne and UpdateOne bulk operations of recent pymongo
+    versions, which pass a sort argument its bulk builder does not accept.
+    """
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ('add_replace', 'add_update'):
+        method = getattr(builder, name)
+        if 'sort' in inspect.signature(method).parameters:
+            continue
+
+        def without_sort(self, *args, _method=method, sort=None, **kwargs):
+            if sort is not None:
+                raise NotImplementedError("mongomock bulk writes do not support sort")
+            return _method(self, *args, **kwargs)
+
+        patcher = mock.patch.object(builder, name, without_sort)
+        patcher.start()
+        testcase.addCleanup(patcher.stop)
+
+
+
+def patch_mongomock_summary_stages(testcase):
+    """
+    Let mongomock run the summary pipelines: $lookup with let and a sub-pipeline, and the
+    replace-or-insert $merge on _id, neither of which it implements.
+    """
+    handlers = mongomock.aggregate._PIPELINE_HANDLERS
+    plain_lookup = handlers['$lookup']
+
+    def bind(value, variables):
+        if isinstance(value, str) and value.startswith('$$') and value[2:] in variables:
+            return {'$literal': variables[value[2:]]}
+        if isinstance(value, dict):
+            return {key: bind(item, variables) for key, item in value.items()}
+        if isinstance(value, list):
+            return [bind(item, variables) for item in value]
+        return value
+
+    def lookup(in_collection, database, options):
+        if 'pipeline' not in options:
+            return plain_lookup(in_collection, database, options)
+        if 'localField' in options:
+            raise NotImplementedError("localField with a pipeline needs MongoDB 5.0")
+        results = []
+        for doc in in_collection:
+            variables = {name: mongomock.aggregate._parse_expression(expression, doc)
+                         for name, expression in options.get('let', {}).items()}
+            matches = list(database[options['from']].aggregate(bind(options['pipeline'], variables)))
+            results.append(dict(doc, **{options['as']: matches}))
+        return results
+
+    def merge(in_collection, database, options):
+        if (options.get('on', '_id'), options.get('whenMatched'), options.get('whenNotMatched')) != \
+                ('_id', 'replace', 'insert'):
+            raise NotImplementedError("only the replace-or-insert $merge on _id is supported")
+        for doc in in_collection:
+            database[options['into']].replace_one({'_id': doc['_id']}, doc, upsert=True)
+        return []
+
+    patcher = mock.patch.dict(handlers, {'$lookup': lookup, '$merge': merge})
+    patcher.start()
+    testcase.addCleanup(patcher.stop)
+
+class BuildInputsMixin:
+    """
+    Writes build inputs (FASTA files, Bakta annotations) to a temporary folder.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.fasta_folder = os.path.join(directory.name, 'fasta')
+        self.bakta_folder = os.path.join(directory.name, 'bakta')
+        self.mobtyper_folder = os.path.join(directory.name, 'mobtyper')
+        for folder in (self.fasta_folder, self.bakta_folder, self.mobtyper_folder):
+            os.mkdir(folder)
+        self.metadata_df = pd.DataFrame(columns=['NUCCORE_ACC', 'Categorized_Environment', 'TAXONOMY_genus',
+                                                 'TAXONOMY_species', 'ASSEMBLY_Status', 'ASSEMBLY_ACC'])
+
+    def write_fasta(self, plasmid_id, *sequences, extension='.fasta'):
+        with open(os.path.join(self.fasta_folder, plasmid_id + extension), 'w') as f:
+            for index, sequence in enumerate(sequences):
+                f.write(f">{plasmid_id}_{index}\n{sequence}\n")
+
+    def remove_fasta(self, plasmid_id, extension='.fasta'):
+        os.remove(os.path.join(self.fasta_folder, plasmid_id + extension))
+
+    def write_bakta(self, plasmid_id, *loci):
+        os.makedirs(os.path.join(self.bakta_folder, plasmid_id), exist_ok=True)
+        features = [{'type': 'cds', 'locus': locus, 'start': 1, 'stop': 30, 'strand': '+', 'nt': 'ATG' * 10}
+                    for locus in loci]
+        with open(os.path.join(self.bakta_folder, plasmid_id, plasmid_id + '.json'), 'w') as f:
+            json.dump({'features': features, 'sequences': []}, f)
+
+
+class FastaBatchTests(BuildInputsMixin, SimpleTestCase):
+
+    def test_one_sequence_per_file(self):
+        self.write_fasta('NZ_1', 'ACGT', 'GGGG', 'TTTT')
+        self.write_fasta('NZ_2', 'CCCC')
+        self.write_fasta('NZ_3')
+        self.assertEqual([(plasmid_id, str(sequence)) for plasmid_id, sequence in
+                          database_build.iter_fasta(self.fasta_folder)], [('NZ_1', 'TTTT'), ('NZ_2', 'CCCC')])
+
+    def test_one_file_per_plasmid_id(self):
+        self.write_fasta('NZ_1', 'ACGT', extension='.fa')
+        self.write_fasta('NZ_1', 'GGGG', extension='.fasta')
+        with self.assertLogs(level='WARNING'):
+            fasta_files = database_build.list_fasta_files(self.fasta_folder)
+        self.assertEqual(fasta_files, [(os.path.join(self.fasta_folder, 'NZ_1.fasta'), 'NZ_1')])
+
+    def test_multi_record_file_straddling_a_batch_is_inserted_once(self):
+        self.write_fasta('NZ_1', 'AAAA')
+        self.write_fasta('NZ_2', 'CCCC', 'GGGG', 'TTTT')
+        self.write_fasta('NZ_3', 'ACGT')
+        self.write_fasta('NZ_4', 'TGCA', 'TGCATGCA')
+        db = mongomock.MongoClient().db
+        with self.assertLogs(level='INFO'):
+            count = database_build.insert_plasmids_streaming(self.fasta_folder, self.bakta_folder, {}, self.metadata_df,
+                                                             {}, {}, {}, db, batch_size=1, workers=1)
+        self.assertEqual(count, 4)
+        self.assertEqual(sorted((plasmid['plasmid_id'], plasmid['sequence']) for plasmid in db.plasmids.find()),
+                         [('NZ_1', 'AAAA'), ('NZ_2', 'TTTT'), ('NZ_3', 'ACGT'), ('NZ_4', 'TGCATGCA')])
+        self.assertEqual(dict(database_build.iter_fasta(self.fasta_folder)),
+                         {plasmid['plasmid_id']: plasmid['sequence'] for plasmid in db.plasmids.find()})
+
+
+class IncrementalBuildTests(BuildInputsMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patch_mongomock_bulk_writes(self)
+        self.db = mongomock.MongoClient().db
+        self.write_fasta('NZ_A', 'AAAA')
+        self.write_fasta('NZ_B', 'CCCC')
+        self.write_fasta('NZ_C', 'GGGG')
+        self.write_bakta('NZ_A', 'A_1', 'A_2')
+        self.write_bakta('NZ_B', 'B_1')
+        self.write_bakta('NZ_C', 'C_1')
+
+    def incremental(self, sequence_storage='embedded'):
+        with self.assertLogs(level='INFO'):
+            return database_build.update_plasmids_incremental(
+                self.fasta_folder, self.bakta_folder, self.mobtyper_folder, {}, self.metadata_df, {}, {}, {}, self.db,
+                batch_size=2, workers=1, sequence_storage=sequence_storage)
+
+    def full_build(self, record_fingerprints=True):
+        with self.assertLogs(level='INFO'):
+            database_build.insert_plasmids_streaming(self.fasta_folder, self.bakta_folder, {}, self.metadata_df, {},
+                                                     {}, {}, self.db, batch_size=2, workers=1)
+            if record_fingerprints:
+                database_build.record_build_fingerprints(self.fasta_folder, self.bakta_folder, self.mobtyper_folder,
+                                                         self.metadata_df, {}, self.db)
+
+    def contents(self):
+        """
+        Plasmid ID -> (sequence, sorted gene loci), checking that each plasmid is stored once.
+        """
+        plasmids = list(self.db.plasmids.find())
+        self.assertEqual(len({plasmid['plasmid_id'] for plasmid in plasmids}), len(plasmids))
+        self.assertEqual(self.db.genes.count_documents({'plasmid_id': {'$nin': [p['_id'] for p in plasmids]}}), 0)
+        return {plasmid['plasmid_id']: (plasmid['sequence'],
+                                        sorted(gene['locus'] for gene in self.db.genes.find({'plasmid_id': plasmid['_id']})))
+                for plasmid in plasmids}
+
+    def stored_ids(self):
+        return (sorted(plasmid['_id'] for plasmid in self.db.plasmids.find()),
+                sorted(gene['_id'] for gene in self.db.genes.find()))
+
+    def fingerprinted(self):
+        return sorted(doc['_id'] for doc in self.db.build_fingerprints.find())
+
+    def test_added_changed_unchanged_and_deleted_inputs(self):
+        self.assertEqual(self.incremental(), 3)
+        unchanged_plasmid = self.db.plasmids.find_one({'plasmid_id': 'NZ_A'})['_id']
+        unchanged_genes = sorted(gene['_id'] for gene in self.db.genes.find({'plasmid_id': unchanged_plasmid}))
+
+        self.write_fasta('NZ_B', 'CCCCTTTT')
+        self.write_bakta('NZ_B', 'B_1', 'B_2')
+        self.remove_fasta('NZ_C')
+        self.write_fasta('NZ_D', 'TTTT')
+        self.assertEqual(self.incremental(), 2)
+
+        self.assertEqual(self.contents(), {'NZ_A': ('AAAA', ['A_1', 'A_2']), 'NZ_B': ('CCCCTTTT', ['B_1', 'B_2']),
+                                           'NZ_D': ('TTTT', [])})
+        self.assertEqual(self.db.plasmids.find_one({'plasmid_id': 'NZ_A'})['_id'], unchanged_plasmid)
+        self.assertEqual(sorted(gene['_id'] for gene in self.db.genes.find({'plasmid_id': unchanged_plasmid})),
+                         unchanged_genes)
+        self.assertEqual(self.fingerprinted(), ['NZ_A', 'NZ_B', 'NZ_D'])
+        self.assertEqual(self.incremental(), 0)
+
+    def test_changed_annotation_replaces_the_genes(self):
+        self.incremental()
+        self.write_bakta('NZ_A', 'A_3')
+        self.assertEqual(self.incremental(), 1)
+        self.assertEqual(self.contents()['NZ_A'], ('AAAA', ['A_3']))
+
+    def test_first_run_after_a_full_build_rewrites_nothing(self):
+        self.full_build()
+        before = self.stored_ids()
+        self.assertEqual(self.incremental(), 0)
+        self.assertEqual(self.stored_ids(), before)
+
+        self.remove_fasta('NZ_C')
+        self.write_fasta('NZ_B', 'CCCCTTTT')
+        self.assertEqual(self.incremental(), 1)
+        self.assertEqual(self.contents(), {'NZ_A': ('AAAA', ['A_1', 'A_2']), 'NZ_B': ('CCCCTTTT', ['B_1'])})
+
+    def test_database_built_without_fingerprints(self):
+        self.full_build(record_fingerprints=False)
+        self.remove_fasta('NZ_C')
+        # Every plasmid is rewritten once, and plasmids whose inputs disappeared are still found
+        self.assertEqual(self.incremental(), 2)
+        self.assertEqual(self.contents(), {'NZ_A': ('AAAA', ['A_1', 'A_2']), 'NZ_B': ('CCCC', ['B_1'])})
+        self.assertEqual(self.fingerprinted(), ['NZ_A', 'NZ_B'])
+        self.assertEqual(self.incremental(), 0)
+
+    def test_failed_plasmids_get_no_fingerprint(self):
+        self.full_build(record_fingerprints=False)
+        # As if the batch holding NZ_B had failed
+        failed = self.db.plasmids.find_one_and_delete({'plasmid_id': 'NZ_B'})
+        self.db.genes.delete_many({'plasmid_id': failed['_id']})
+        with self.assertLogs(level='INFO'):
+            database_build.record_build_fingerprints(self.fasta_folder, self.bakta_folder, self.mobtyper_folder,
+                                                     self.metadata_df, {}, self.db)
+        self.assertEqual(self.fingerprinted(), ['NZ_A', 'NZ_C'])
+        self.assertEqual(self.incremental(), 1)
+        self.assertEqual(sorted(self.contents()), ['NZ_A', 'NZ_B', 'NZ_C'])
+
+    def test_duplicates_left_by_earlier_builds_are_reconciled(self):
+        self.full_build()
+        self.full_build()
+        self.assertEqual(self.db.plasmids.count_documents({}), 6)
+        self.remove_fasta('NZ_C')
+        self.assertEqual(self.incremental(), 2)
+        self.assertEqual(self.contents(), {'NZ_A': ('AAAA', ['A_1', 'A_2']), 'NZ_B': ('CCCC', ['B_1'])})
+        self.assertEqual(self.db.genes.count_documents({}), 3)
+
+    def test_blob_storage_leaves_no_orphan_sequences(self):
+        self.incremental('blob')
+        self.write_fasta('NZ_B', 'CCCCTTTT')
+        self.remove_fasta('NZ_C')
+        self.incremental('blob')
+        plasmids = list(self.db.plasmids.find())
+        genes = list(self.db.genes.find())
+        refs = (sequence_store.sequence_refs(plasmids, sequence_store.SEQUENCE_FIELDS['plasmids'])
+                + sequence_store.sequence_refs(genes, sequence_store.SEQUENCE_FIELDS['genes']))
+        self.assertEqual(sorted(blob['_id'] for blob in self.db[sequence_store.SEQUENCES_COLLECTION].find()),
+                         sorted(refs))
+        blobs = sequence_store.fetch_sequences(self.db, [plasmid['sequence_ref'] for plasmid in plasmids])
+        self.assertEqual(sorted(sequence for _, _, sequence in blobs.values()), ['AAAA', 'CCCCTTTT'])
+
+
+class BuildIndexTests(SimpleTestCase):
+
+    def test_ensure_indexes(self):
+        db = mongomock.MongoClient().db
+        db.hosts.create_index('family')
+        created = database_build.ensure_indexes(db)
+        self.assertEqual(set(created), set(database_build.INDEX_SPECS))
+        self.assertEqual(sorted(db.hosts.index_information()), ['_id_', 'environment_ids_1', 'genus_1_species_1'])
+        # Idempotent
+        self.assertEqual(database_build.ensure_indexes(db), created)
+
+
+class CategorizeEnvironmentsTests(SimpleTestCase):
+
+    SOURCES = ['Seawater', 'river SEDIMENT', 'Human gut', 'human gut soil', 'groundwater', 'Plant root', 'skin swab',
+               'Hospital sewage', 'Laboratory strain', 'unknown', 'N/A', 'not available', 'none', '', '   ', None,
+               float('nan'), 'Urine', 'feces (pig) / water', 'wastewater treatment plant', 'compost (ORAL?)',
+               '[soil]+', 'Human gut']
+
+    @staticmethod
+    def categorize(isolation_source):
+        # Per-row function of the original build, applied with Series.apply
+        for category, keywords in database_build.ENVIRONMENT_CATEGORIES.items():
+            if any(keyword in isolation_source for keyword in keywords):
+                return category
+        return "Other"
+
+    def test_matches_the_per_row_function(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'metadata.tsv')
+        metadata = pd.DataFrame({'NUCCORE_ACC': [f"NZ_{index}" for index in range(len(self.SOURCES))],
+                                 'BIOSAMPLE_IsolationSource': self.SOURCES})
+        metadata.to_csv(path, sep='\t', index=False)
+        with self.assertLogs(level='INFO'):
+            categorized = database_build.parse_plsdb_metadata(path)
+        # As read back, 'N/A' and empty cells are NaN
+        sources = pd.read_csv(path, sep='\t')['BIOSAMPLE_IsolationSource']
+        self.assertEqual(sources.isna().sum(), 4)
+        expected = sources.astype(str).str.lower().apply(self.categorize)
+        self.assertEqual(categorized['Categorized_Environment'].tolist(), expected.tolist())
+        self.assertEqual(categorized['Categorized_Environment'].tolist()[:4], ['Water', 'Water', 'Animal Host', 'Soil'])
+
+    def test_lower_cased_sources(self):
+        sources = pd.Series([str(source).lower() for source in self.SOURCES])
+        self.assertEqual(database_build.categorize_environments(sources).tolist(),
+                         sources.apply(self.categorize).tolist())
+
+    def test_keeps_the_index(self):
+        sources = pd.Series(['soil', 'gut', 'soil', 'lake'], index=[10, 3, 7, 3])
+        labels = database_build.categorize_environments(sources)
+        self.assertEqual(list(labels.index), [10, 3, 7, 3])
+        self.assertEqual(labels.tolist(), sources.apply(self.categorize).tolist())
+
+    def test_empty_input(self):
+        self.assertEqual(database_build.categorize_environments(pd.Series([], dtype=object)).tolist(), [])
+
+
+class CsvExportTests(SimpleTestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        # mongomock has no explain and no $type expression, used by the cost check and the truncation stage
+        for patcher in (mock.patch.object(views, 'get_db', return_value=self.db),
+                        mock.patch.object(views, 'check_query_cost', return_value=''),
+                        mock.patch.object(views, 'truncation_stage', return_value={'$match': {}})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def download(self, pipeline):
+        request = RequestFactory().get('/download_csv/')
+        request.session = {'current_query': {'json_query': json.dumps(pipeline), 'target_collection': 'genes'}}
+        response = views.download_csv(request)
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_header_has_fields_of_all_probed_documents(self):
+        self.db.genes.insert_many([{'_id': index, 'locus': f"L{index}"} for index in range(5)]
+                                  + [{'_id': 5, 'locus': 'L5', 'gene_name': 'sul1'}])
+        with mock.patch.object(views, 'CSV_HEADER_PROBE_DOCUMENTS', 10):
+            rows = self.download([{'$sort': {'_id': 1}}])
+        self.assertEqual(rows[0], ['_id', 'locus', 'gene_name'])
+        self.assertEqual(rows[6], ['5', 'L5', 'sul1'])
+        self.assertEqual(len(rows), 7)
+
+    def test_fields_first_seen_after_the_probe_are_left_out_and_logged(self):
+        self.db.genes.insert_many([{'_id': index, 'locus': f"L{index}"} for index in range(5)]
+                                  + [{'_id': 5, 'locus': 'L5', 'gene_name': 'sul1'}])
+        with mock.patch.object(views, 'CSV_HEADER_PROBE_DOCUMENTS', 3), \
+                self.assertLogs(views.logger, 'WARNING') as logs:
+            rows = self.download([{'$sort': {'_id': 1}}])
+        self.assertEqual(rows[0], ['_id', 'locus'])
+        self.assertEqual(rows[6], ['5', 'L5'])
+        self.assertIn('first 3 documents: gene_name', logs.output[0])
+
+    def test_blob_sequences_are_exported_as_on_the_results_page(self):
+        nt_sequence = 'ACGT' * 100
+        documents = []
+        for index in range(5):
+            blob = {'_id': ObjectId(), 'name': f"L{index}", 'field': 'nt_sequence',
+                    **sequence_store.encode_sequence(nt_sequence, '2bit')}
+            self.db[sequence_store.SEQUENCES_COLLECTION].insert_one(blob)
+            documents.append({'_id': index, 'locus': f"L{index}", 'nt_sequence_ref': blob['_id']})
+        self.db.genes.insert_many(documents)
+        with mock.patch.object(views, 'CSV_BATCH_SIZE', 2):
+            rows = self.download([{'$sort': {'_id': 1}}])
+        self.assertEqual(rows[0], ['_id', 'locus', 'nt_sequence', 'nt_sequence_ref'])
+        self.assertEqual(len(rows), 6)
+        for row, document in zip(rows[1:], documents):
+            self.assertEqual(row[2], nt_sequence[:views.MAX_FIELD_LENGTH])
+            self.assertEqual(row[3], str(document['nt_sequence_ref']))
+
+
+class ExampleIndexTests(SimpleTestCase):
+
+    EXAMPLES = [
+        {'input': 'Find plasmids from Escherichia coli', 'output': 0},
+        {'input': 'Which genes confer resistance to ampicillin?', 'output': 1},
+        {'input': 'Count conjugative plasmids per environment', 'output': 2},
+        {'input': 'Find genes named blaCTX-M-15', 'output': 3},
+    ]
+
+    def test_tokenize_keeps_gene_names_whole(self):
+        self.assertEqual(tokenize('Genes like blaCTX-M-15 and aac(6)-Ib'),
+                         ['genes', 'like', 'blactx-m-15', 'and', 'aac', '6', 'ib'])
+
+    def test_top_k_ranks_the_most_similar_examples_first(self):
+        index = ExampleIndex(self.EXAMPLES)
+        top = index.top_k('genes with resistance to ampicillin', 2)
+        self.assertEqual([example['output'] for example in top], [1, 3])
+
+    def test_gene_name_matches_its_example(self):
+        index = ExampleIndex(self.EXAMPLES)
+        self.assertEqual(index.top_k('plasmids carrying blaCTX-M-15', 1)[0]['output'], 3)
+
+    def test_ties_keep_example_order(self):
+        index = ExampleIndex(self.EXAMPLES)
+        self.assertEqual([example['output'] for example in index.top_k('unrelated words', 4)], [0, 1, 2, 3])
+
+    def test_top_k_bounds(self):
+        self.assertEqual(ExampleIndex(self.EXAMPLES).top_k('genes', 0), [])
+        self.assertEqual(ExampleIndex([]).top_k('genes', 3), [])
+        self.assertEqual(len(ExampleIndex(self.EXAMPLES).top_k('genes', 10)), 4)
+
+
+class FlattenDisplayDocumentTests(SimpleTestCase):
+
+    def reference(self, document, max_length, sep='.'):
+        return views.flatten_dict(views.truncate_string_fields(views.convert_objectids(document), max_length), sep=sep)
+
+    def test_matches_the_three_passes(self):
+        documents = [
+            {},
+            {'_id': ObjectId(), 'locus': 'ABC_00010', 'start': 12, 'score': 0.5, 'partial': None, 'pseudo': False},
+            {'plasmid': {'taxonomy': {'genus': 'Escherichia', 'species': 'coli'}, 'ids': [ObjectId(), ObjectId()]},
+             'empty': {}, 'after': 'x'},
+            {'resistance_info': [{'gene': 'sul1', 'to': ['sulfonamide'], 'ref': {'id': ObjectId()}}, 'loose string'],
+             'nested': [[1, 'two', ObjectId()], [], [{'deep': 'dict'}]], 'numbers': [1, 2.5, None, True]},
+            {'a.b': 'first', 'a': {'b': 'second', 'c': 'third'}, 'z': 'last'},
+            {'a': {'b': 'first'}, 'a.b': 'second'},
+            {'nt_sequence': 'ACGT' * 500, 'aa_sequence': 'M' * 10},
+        ]
+        for document in documents:
+            for max_length in (3, 24, views.MAX_FIELD_LENGTH):
+                with self.subTest(document=document, max_length=max_length):
+                    flat = views.flatten_display_document(document, max_length)
+                    expected = self.reference(document, max_length)
+                    self.assertEqual(flat, expected)
+                    self.assertEqual(list(flat), list(expected))
+
+    def test_separator(self):
+        document = {'plasmid': {'taxonomy': {'genus': 'Escherichia'}}, 'hits': [{'a': {'b': 1}}]}
+        self.assertEqual(views.flatten_display_document(document, sep='/'),
+                         self.reference(document, views.MAX_FIELD_LENGTH, sep='/'))
+
+    def test_input_is_not_modified(self):
+        object_id = ObjectId()
+        document = {'_id': object_id, 'product': 'x' * 50, 'sub': {'ids': [object_id]}}
+        views.flatten_display_document(document, 5)
+        self.assertEqual(document, {'_id': object_id, 'product': 'x' * 50, 'sub': {'ids': [object_id]}})
+
+
+class GetLlmChainTests(SimpleTestCase):
+
+    def setUp(self):
+        for name, value in (('_llmchain', None), ('_llmchain_loaded', False), ('_llmchain_failed_at', None)):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_chain_is_built_once(self):
+        chain = object()
+        with mock.patch.object(views, 'build_llmchain', return_value=chain) as build:
+            self.assertIs(views.get_llmchain(), chain)
+            self.assertIs(views.get_llmchain(), chain)
+        self.assertEqual(build.call_count, 1)
+
+    def test_failed_initialization_is_retried_after_the_backoff(self):
+        chain = object()
+        with mock.patch.object(views, 'build_llmchain', side_effect=[None, chain]) as build, \
+                mock.patch('time.monotonic', return_value=1000.0):
+            self.assertIsNone(views.get_llmchain())
+            self.assertIsNone(views.get_llmchain())
+            self.assertEqual(build.call_count, 1)
+        with mock.patch.object(views, 'build_llmchain', side_effect=[chain]), \
+                mock.patch('time.monotonic', return_value=1000.0 + views.LLM_INIT_RETRY_SECONDS):
+            self.assertIs(views.get_llmchain(), chain)
+
+
+class JsonBackendTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(json_backend.select_backend)
+
+    def backends(self):
+        return [name for name in json_backend.JSON_BACKENDS if name != 'orjson' or json_backend.orjson is not None]
+
+    def test_loads_matches_the_standard_library(self):
+        for name in self.backends():
+            json_backend.select_backend(name)
+            for text in ('{"a": [1, 2.5, null, true], "b": {"c": "\u00e9"}}', '[NaN, Infinity, -Infinity]',
+                         '{"big": 123456789012345678901234567890, "negative": -9223372036854775809}',
+                         '[18446744073709551615, 1.2345678901234567890123]', '"' + 'A' * 1000 + '"'):
+                with self.subTest(backend=name, text=text[:40]):
+                    decoded = json_backend.loads(text)
+                    self.assertEqual(repr(decoded), repr(json.loads(text)))
+                    self.assertEqual(repr(json_backend.load(io.BytesIO(text.encode()))), repr(decoded))
+
+    def test_invalid_documents_raise_the_standard_error(self):
+        for name in self.backends():
+            json_backend.select_backend(name)
+            for text in ('{"a": ', '[1, 2,]', '[NaN'):
+                with self.subTest(backend=name, text=text):
+                    with self.assertRaises(json.JSONDecodeError):
+                        json_backend.loads(text)
+            # json.loads itself raises UnicodeDecodeError on invalid UTF-8
+            with self.assertRaises(UnicodeDecodeError):
+                json_backend.loads(b'"\xff"')
+
+    def test_dumps_is_compact_and_keeps_non_ascii(self):
+        for name in self.backends():
+            json_backend.select_backend(name)
+            for value, text in (({'a': [1, None, True], 'b': 'é'}, '{"a":[1,null,true],"b":"é"}'),
+                                ({1: 'x'}, '{"1":"x"}'),
+                                ([2 ** 70], '[1180591620717411303424]')):
+                with self.subTest(backend=name, value=value):
+                    self.assertEqual(json_backend.dumps(value), text)
+
+    def test_dumps_encodes_the_same_types_with_both_backends(self):
+        @dataclasses.dataclass
+        class Hit:
+            locus: str
+            seen: datetime.date
+
+        class Strand(enum.Enum):
+            FORWARD = '+'
+
+        madrid = datetime.timezone(datetime.timedelta(hours=1))
+        value = {'naive': datetime.datetime(2024, 1, 2, 3, 4, 5, 123),
+                 'aware': datetime.datetime(2024, 1, 2, tzinfo=madrid),
+                 'utc': datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc),
+                 'date': datetime.date(2024, 1, 2), 'time': datetime.time(1, 2, 3),
+                 'uuid': uuid.UUID(int=5), 'strand': Strand.FORWARD, 'hit': Hit('ABC_00010', datetime.date(2024, 1, 1))}
+        expected = ('{"naive":"2024-01-02T03:04:05.000123","aware":"2024-01-02T00:00:00+01:00",'
+                    '"utc":"2024-01-02T00:00:00+00:00","date":"2024-01-02","time":"01:02:03",'
+                    '"uuid":"00000000-0000-0000-0000-000000000005","strand":"+",'
+                    '"hit":{"locus":"ABC_00010","seen":"2024-01-01"}}')
+        for name in self.backends():
+            json_backend.select_backend(name)
+            with self.subTest(backend=name):
+                self.assertEqual(json_backend.dumps(value), expected)
+                # Non-string keys make orjson fall back to json.dumps for the whole value
+                self.assertEqual(json_backend.dumps({1: datetime.date(2024, 1, 2)}), '{"1":"2024-01-02"}')
+                with self.assertRaises(TypeError):
+                    json_backend.dumps({'_id': ObjectId()})
+
+    def test_select_backend(self):
+        self.assertEqual(json_backend.select_backend('json'), 'json')
+        self.assertEqual(json_backend.BACKEND, 'json')
+        self.assertEqual(json_backend.select_backend(), 'orjson' if json_backend.orjson is not None else 'json')
+        with self.assertRaises(ValueError):
+            json_backend.select_backend('ujson')
+        with mock.patch.object(json_backend, 'orjson', None):
+            self.assertEqual(json_backend.select_backend(), 'json')
+            with self.assertRaises(ValueError):
+                json_backend.select_backend('orjson')
+
+
+class NLJobTestMixin:
+    """
+    An NL job queue on a mongomock collection, and a model stand-in that streams two tokens
+    and, once release() is called, returns OUTPUT.
+    """
+
+    OUTPUT = {'collection': 'genes', 'pipeline': [{'$match': {'antibiotic_resistance': True}}]}
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.nl_jobs
+        self.queue = self.make_queue()
+        self.addCleanup(self.queue.shutdown)
+        self.released = threading.Event()
+        self.addCleanup(self.released.set)
+        self.generate = mock.Mock(side_effect=self.fake_generate)
+
+    def make_queue(self):
+        return NLJobQueue(lambda: self.collection, max_workers=2, max_jobs_per_owner=1, flush_interval=0)
+
+    def fake_generate(self, question, on_token):
+        on_token('{"collection": ')
+        on_token('"genes"}')
+        self.released.wait(5)
+        return self.OUTPUT
+
+    def release(self):
+        self.released.set()
+        self.queue.shutdown()
+
+
+class NLJobQueueTests(NLJobTestMixin, SimpleTestCase):
+
+    def test_job_output_is_stored(self):
+        job = self.queue.submit('session:a', 'resistance genes', self.generate)
+        self.assertEqual(job['status'], 'queued')
+        self.release()
+        job = self.queue.get(job['job_id'], 'session:a')
+        self.assertEqual((job['status'], job['error']), ('done', ''))
+        self.assertEqual(job['output'], self.OUTPUT)
+        self.assertEqual(''.join(job['tokens']), '{"collection": "genes"}')
+        self.generate.assert_called_once()
+
+    def test_failures_are_stored(self):
+        for generate, error in ((mock.Mock(return_value=None), FAILED_ERROR),
+                                (mock.Mock(side_effect=RuntimeError('model unavailable')), 'model unavailable')):
+            with self.subTest(error=error):
+                job = self.queue.submit('session:a', 'resistance genes', generate)
+                self.queue.shutdown()
+                job = self.queue.get(job['job_id'], 'session:a')
+                self.assertEqual((job['status'], job['error'], job['output']), ('failed', error, None))
+
+    def test_too_many_jobs_per_owner(self):
+        self.queue.submit('session:a', 'first', self.generate)
+        with self.assertRaises(TooManyJobs):
+            self.queue.submit('session:a', 'second', self.generate)
+        self.assertEqual(self.collection.count_documents({'owner': 'session:a'}), 1)
+        self.queue.submit('session:b', 'other owner', self.generate)
+        self.release()
+        self.queue.submit('session:a', 'after the first finished', mock.Mock(return_value=None))
+
+    def test_jobs_are_only_visible_to_their_owner(self):
+        job = self.queue.submit('session:a', 'resistance genes', self.generate)
+        self.assertIsNone(self.queue.get(job['job_id'], 'session:b'))
+        self.assertIsNone(self.queue.get('missing', 'session:a'))
+
+    def test_state_is_shared_between_processes(self):
+        job = self.queue.submit('session:a', 'resistance genes', self.generate)
+        other_process = self.make_queue()
+        self.assertIn(other_process.get(job['job_id'], 'session:a')['status'], ('queued', 'running'))
+        with self.assertRaises(TooManyJobs):
+            other_process.submit('session:a', 'second', self.generate)
+        self.release()
+        self.assertEqual(other_process.get(job['job_id'], 'session:a')['output'], self.OUTPUT)
+
+    def test_abandoned_jobs_fail_and_free_their_slot(self):
+        started = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        self.collection.insert_one({'_id': 'abandoned', 'owner': 'session:a', 'question': 'resistance genes',
+                                    'status': 'running', 'tokens': ['{'], 'output': None, 'error': '',
+                                    'created_at': started, 'expires_at': started + datetime.timedelta(minutes=10)})
+        job = self.queue.get('abandoned', 'session:a')
+        self.assertEqual((job['status'], job['error']), ('failed', INTERRUPTED_ERROR))
+        self.queue.submit('session:a', 'resistance genes', self.generate)
+
+
+class NLJobViewTests(NLJobTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner = 'session:a'
+        for patcher in (
+            mock.patch.object(views, 'nl_job_queue', self.queue),
+            mock.patch.object(views, 'generate_pipeline', self.generate),
+            mock.patch.object(views, 'get_job_owner', side_effect=lambda request: self.owner),
+            mock.patch.object(views, 'get_cached_pipeline', return_value=None),
+            mock.patch.object(views, 'check_query_cost_once', return_value=''),
+            mock.patch.object(views, 'get_db', return_value=self.collection.database),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def submit(self):
+        response = self.client.post(reverse('natural_language_query'), {'natural_language_query': 'resistance genes'})
+        self.assertEqual(response.status_code, 302)
+        return response.url.split('?job=')[1]
+
+    def wait_for_tokens(self, job_id, count):
+        for _ in range(500):
+            if len(self.queue.get(job_id, self.owner)['tokens']) >= count:
+                return
+            time.sleep(0.01)
+        self.fail("The job did not stream its tokens.")
+
+    def stream(self, job_id, last_event_id=None):
+        headers = {} if last_event_id is None else {'HTTP_LAST_EVENT_ID': str(last_event_id)}
+        response = self.client.get(reverse('nl_job_stream', args=[job_id]), **headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response.content.decode()
+
+    def test_submit_does_not_wait_for_the_model(self):
+        job_id = self.submit()
+        self.assertIn(self.queue.get(job_id, self.owner)['status'], ('queued', 'running'))
+        page = self.client.get(reverse('natural_language_query'), {'job': job_id})
+        self.assertContains(page, f'data-job-id="{job_id}"')
+        self.assertNotContains(page, 'Generated JSON Query')
+
+        response = self.client.post(reverse('submit_nl_job'), {'natural_language_query': 'other question'})
+        self.assertEqual(response.status_code, 429)
+        self.release()
+        response = self.client.post(reverse('submit_nl_job'), {'natural_language_query': 'other question'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+
+    def test_too_many_jobs_on_the_wizard_page(self):
+        self.submit()
+        response = self.client.post(reverse('natural_language_query'), {'natural_language_query': 'second'})
+        self.assertContains(response, 'natural language queries can run at once')
+
+    def test_finished_job_result_is_rendered_without_regenerating(self):
+        job_id = self.submit()
+        self.release()
+        page = self.client.get(reverse('natural_language_query'), {'job': job_id})
+        self.assertContains(page, 'Generated JSON Query')
+        self.assertContains(page, 'antibiotic_resistance')
+        self.assertEqual(page.context['target_collection'], 'genes')
+        self.generate.assert_called_once()
+
+    def test_status(self):
+        job_id = self.submit()
+        self.release()
+        status = self.client.get(reverse('nl_job_status', args=[job_id])).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['partial_response'], '{"collection": "genes"}')
+        self.assertEqual(json.loads(status['json_query']), self.OUTPUT['pipeline'])
+        self.assertEqual(status['target_collection'], 'genes')
+
+    def test_stream_resumes_and_ends_with_the_final_event(self):
+        job_id = self.submit()
+        self.wait_for_tokens(job_id, 2)
+        running = self.stream(job_id)
+        self.assertIn('id: 2\nevent: token\ndata: "\\"genes\\"}"', running)
+        self.assertIn('retry: ', running)
+        self.assertNotIn('event: done', running)
+
+        self.release()
+        finished = self.stream(job_id, last_event_id=1)
+        self.assertNotIn('id: 1\n', finished)
+        self.assertIn('id: 2\n', finished)
+        self.assertIn('event: done', finished)
+        self.assertNotIn('retry: ', finished)
+        self.assertEqual(self.stream(job_id, last_event_id=2).count('event: token'), 0)
+
+    def test_async_stream_follows_the_job_to_the_end(self):
+        class AsyncCollection:
+            def __init__(self, collection):
+                self.collection = collection
+
+            async def find_one(self, *args, **kwargs):
+                return self.collection.find_one(*args, **kwargs)
+
+        async def stream(job_id):
+            response = await async_views.nl_job_stream(RequestFactory().get('/'), job_id)
+            return ''.join([chunk.decode() if isinstance(chunk, bytes) else chunk
+                            async for chunk in response.streaming_content])
+
+        job_id = self.submit()
+        self.wait_for_tokens(job_id, 1)
+        threading.Timer(0.1, self.released.set).start()
+        with mock.patch.object(async_views, 'get_async_db', return_value={'nl_jobs': AsyncCollection(self.collection)}), \
+                mock.patch.object(views, 'NL_JOB_STREAM_POLL_SECONDS', 0.01):
+            events = asyncio.run(stream(job_id))
+        self.assertEqual(events.count('event: token'), 2)
+        self.assertTrue(events.startswith('id: 1\n'))
+        self.assertTrue(events.rstrip().split('\n\n')[-1].startswith('event: done'))
+
+    def test_jobs_of_other_owners_are_not_found(self):
+        job_id = self.submit()
+        self.owner = 'session:b'
+        self.assertEqual(self.client.get(reverse('nl_job_status', args=[job_id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('nl_job_stream', args=[job_id])).status_code, 404)
+        page = self.client.get(reverse('natural_language_query'), {'job': job_id})
+        self.assertContains(page, 'Query generation job not found.')
+
+
+@override_settings(METRICS_ALLOWED_IPS=['127.0.0.1', '198.51.100.5'], METRICS_TOKEN='', TRUSTED_PROXY_IPS=[])
+class OperationalEndpointTests(SimpleTestCase):
+
+    def get(self, view, remote_addr, **headers):
+        return view(RequestFactory().get('/', REMOTE_ADDR=remote_addr, **headers))
+
+    def test_query_cache_stats_is_only_served_to_allowed_addresses(self):
+        response = self.get(views.query_cache_stats, '127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hits', json.loads(response.content))
+        self.assertEqual(self.get(views.query_cache_stats, '203.0.113.7').status_code, 404)
+
+    def test_metrics_is_only_served_to_allowed_addresses(self):
+        response = self.get(views.metrics, '127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE plasmiddb_request_duration_seconds histogram', response.content.decode())
+        self.assertEqual(self.get(views.metrics, '203.0.113.7').status_code, 404)
+
+    def test_client_ip(self):
+        self.assertEqual(views.client_ip(RequestFactory().get('/', REMOTE_ADDR='203.0.113.7')), '203.0.113.7')
+        # Forwarded by an untrusted address: the client is unknown
+        request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.7')
+        self.assertIsNone(views.client_ip(request))
+        with self.settings(TRUSTED_PROXY_IPS=['127.0.0.1', '10.0.0.2']):
+            # Addresses left of the last untrusted hop may be spoofed by the client
+            request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1',
+                                           HTTP_X_FORWARDED_FOR='127.0.0.1, 203.0.113.7, 10.0.0.2')
+            self.assertEqual(views.client_ip(request), '203.0.113.7')
+            request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='10.0.0.2')
+            self.assertEqual(views.client_ip(request), '127.0.0.1')
+
+    def test_behind_a_proxy(self):
+        # A local proxy does not make every client local
+        self.assertEqual(self.get(views.metrics, '127.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.7').status_code, 404)
+        with self.settings(TRUSTED_PROXY_IPS=['127.0.0.1']):
+            self.assertEqual(self.get(views.metrics, '127.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.7').status_code,
+                             404)
+            self.assertEqual(self.get(views.metrics, '127.0.0.1', HTTP_X_FORWARDED_FOR='198.51.100.5').status_code,
+                             200)
+
+    def test_token(self):
+        self.assertEqual(self.get(views.metrics, '203.0.113.7', HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+        with self.settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.get(views.metrics, '203.0.113.7', HTTP_AUTHORIZATION='Bearer s3cret').status_code,
+                             200)
+            self.assertEqual(self.get(views.metrics, '203.0.113.7', HTTP_AUTHORIZATION='Bearer wrong').status_code,
+                             404)
+            self.assertEqual(self.get(views.query_cache_stats, '203.0.113.7',
+                                      HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+
+
+class TimingMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = instrumentation.MetricsRegistry()
+        patcher = mock.patch.object(instrumentation, 'metrics_registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def view(self, request):
+        with instrumentation.span('run_query'):
+            instrumentation.add_count('documents', 3)
+        return HttpResponse('abcd')
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.resolver_match = mock.Mock(url_name='execute_query')
+        return request
+
+    def test_records_the_request(self):
+        with self.settings(SERVER_TIMING_HEADER=False):
+            response = instrumentation.TimingMiddleware(self.view)(self.request())
+        self.assertNotIn('Server-Timing', response)
+        text = self.registry.render()
+        self.assertIn('plasmiddb_request_duration_seconds_count{view="execute_query"} 1', text)
+        self.assertIn('plasmiddb_stage_duration_seconds_count{view="execute_query",stage="run_query"} 1', text)
+        self.assertIn('plasmiddb_result_documents_total{view="execute_query"} 3', text)
+        self.assertIn('plasmiddb_response_bytes_total{view="execute_query"} 4', text)
+
+    def test_server_timing_header(self):
+        with self.settings(SERVER_TIMING_HEADER=True):
+            response = instrumentation.TimingMiddleware(self.view)(self.request())
+        self.assertRegex(response['Server-Timing'], r'^run_query;dur=[0-9.]+, total;dur=[0-9.]+$')
+
+    def test_async_views(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = instrumentation.TimingMiddleware(view)
+        with self.settings(SERVER_TIMING_HEADER=True):
+            response = asyncio.run(middleware(self.request()))
+        self.assertIn('run_query;dur=', response['Server-Timing'])
+        self.assertIn('plasmiddb_request_duration_seconds_count{view="execute_query"} 1', self.registry.render())
+
+    def test_spans_outside_requests_are_not_timed(self):
+        with instrumentation.span('run_query'):
+            instrumentation.add_count('documents', 3)
+        self.assertNotIn('run_query', self.registry.render())
+
+
+class PackedSequenceTests(SimpleTestCase):
+
+    SEQUENCE = 'ACGTNNNNacgtRYACGTTGCA' * 7 + 'GAT'
+
+    def test_round_trip(self):
+        for sequence in ('', 'A', 'ACG', 'ACGT', 'NNNN', 'ACGTA', self.SEQUENCE):
+            with self.subTest(sequence=sequence):
+                packed = PackedSequence.encode(sequence)
+                self.assertEqual(len(packed), len(sequence))
+                self.assertEqual(packed.decode(), sequence)
+                self.assertEqual(packed, sequence)
+
+    def test_exception_runs(self):
+        packed = PackedSequence.encode('ACNNNGTacgT')
+        self.assertEqual(packed.exceptions, [(2, 'NNN'), (7, 'acg')])
+
+    def test_substring_and_slicing(self):
+        packed = PackedSequence.encode(self.SEQUENCE)
+        for start in range(len(self.SEQUENCE) + 1):
+            for stop in range(start, len(self.SEQUENCE) + 2, 5):
+                self.assertEqual(packed.substring(start, stop), self.SEQUENCE[start:stop])
+        self.assertEqual(packed[3:40], self.SEQUENCE[3:40])
+        self.assertEqual(packed[-10:], self.SEQUENCE[-10:])
+        self.assertEqual(packed[::3], self.SEQUENCE[::3])
+        self.assertEqual(packed[4], 'N')
+        self.assertEqual(packed[-1], 'T')
+        with self.assertRaises(IndexError):
+            packed[len(self.SEQUENCE)]
+
+    def test_equal_to_the_string_it_encodes(self):
+        packed = PackedSequence.encode(self.SEQUENCE)
+        self.assertEqual(packed, self.SEQUENCE)
+        self.assertEqual(hash(packed), hash(self.SEQUENCE))
+        self.assertEqual(packed, PackedSequence.encode(self.SEQUENCE))
+        self.assertNotEqual(packed, PackedSequence.encode(self.SEQUENCE.replace('N', 'A')))
+        self.assertEqual({packed, self.SEQUENCE, PackedSequence.encode(self.SEQUENCE)}, {self.SEQUENCE})
+        self.assertEqual({self.SEQUENCE: 1}[packed], 1)
+
+    def test_multi_byte_characters_cannot_be_packed(self):
+        with self.assertRaises(ValueError):
+            PackedSequence.encode('ACGTÅ')
+
+    def test_pack_sequence_keeps_strings_that_do_not_pack(self):
+        self.assertIsInstance(pack_sequence('ACGT' * 100), PackedSequence)
+        for sequence in ('MKKLLPTAAAGLLLLAAQPAMA' * 10, 'ACGTÅ', 'A'):
+            with self.subTest(sequence=sequence):
+                self.assertEqual(pack_sequence(sequence), sequence)
+                self.assertIsInstance(pack_sequence(sequence), str)
+
+
+class PaginationTests(SimpleTestCase):
+
+    def test_keyset_supported(self):
+        self.assertTrue(keyset_supported({'gene_name': 'sul1'}))
+        self.assertTrue(keyset_supported([
+            {'$match': {'antibiotic_resistance': True}},
+            {'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id', 'foreignField': '_id', 'as': 'plasmid'}},
+            {'$project': {'locus': 1, 'plasmid.plasmid_id': 1}},
+            {'$sort': {'_id': 1}},
+        ]))
+
+    def test_keyset_not_supported(self):
+        for pipeline in (
+            [{'$group': {'_id': '$product', 'count': {'$sum': 1}}}],
+            [{'$unwind': '$resistance_info.resistance_to'}],
+            [{'$sort': {'start': 1}}],
+            [{'$sort': {'_id': -1}}],
+            [{'$match': {'$text': {'$search': 'transposase'}}}],
+            [{'$match': {'$and': [{'$text': {'$search': 'transposase'}}, {'strand': '+'}]}}],
+            [{'$project': {'_id': 0, 'locus': 1}}],
+            [{'$set': {'_id': '$locus'}}],
+            [{'$unset': '_id'}],
+            [{'$lookup': {'from': 'plasmids', 'pipeline': [], 'as': '_id'}}],
+            [{'$match': {}, '$limit': 5}],
+        ):
+            with self.subTest(pipeline=pipeline):
+                self.assertFalse(keyset_supported(pipeline))
+
+    def test_text_search_pipeline_keeps_its_first_stage(self):
+        pipeline = [{'$match': {'$text': {'$search': 'transposase'}}}, {'$sort': {'score': {'$meta': 'textScore'}}}]
+        state = first_page_state(pipeline)
+        self.assertEqual(state, {'page': 1, 'skip': 0})
+        self.assertEqual(page_pipeline(pipeline, state, 10), pipeline + [{'$skip': 0}, {'$limit': 11}])
+
+    def test_keyset_page_pipeline(self):
+        pipeline = [{'$match': {'strand': '+'}}]
+        self.assertEqual(page_pipeline(pipeline, {'page': 1}, 10),
+                         [{'$sort': {'_id': 1}}, {'$match': {'strand': '+'}}, {'$limit': 11}])
+        after = ObjectId()
+        self.assertEqual(page_pipeline(pipeline, {'page': 2, 'after': after}, 10),
+                         [{'$match': {'_id': {'$gt': after}}}, {'$sort': {'_id': 1}}, {'$match': {'strand': '+'}},
+                          {'$limit': 11}])
+
+    def test_skip_page_pipeline(self):
+        pipeline = [{'$group': {'_id': '$product'}}]
+        self.assertEqual(page_pipeline(pipeline, {'page': 3, 'skip': 20}, 10),
+                         pipeline + [{'$skip': 20}, {'$limit': 11}])
+
+    def test_page_filter(self):
+        after = ObjectId()
+        self.assertEqual(page_filter({'strand': '+'}, {'page': 1}), {'strand': '+'})
+        self.assertEqual(page_filter({'strand': '+'}, {'page': 2, 'after': after}),
+                         {'$and': [{'strand': '+'}, {'_id': {'$gt': after}}]})
+
+    def test_next_page_state(self):
+        results = [{'_id': index} for index in range(11)]
+        self.assertEqual(next_page_state({'page': 1}, results, 10), {'page': 2, 'after': 9})
+        self.assertEqual(next_page_state({'page': 2, 'after': 4}, results, 10), {'page': 3, 'after': 9, 'previous': [4]})
+        self.assertEqual(next_page_state({'page': 2, 'skip': 10}, results, 10), {'page': 3, 'skip': 20})
+        self.assertIsNone(next_page_state({'page': 1}, results[:10], 10))
+
+    def test_previous_page_state_walks_back_to_the_first_page(self):
+        state, states = {'page': 1}, []
+        for page in range(4):
+            states.append(state)
+            state = next_page_state(state, [{'_id': page * 10 + index} for index in range(11)], 10)
+        for expected in reversed(states):
+            state = previous_page_state(state, 10)
+            self.assertEqual(state, expected)
+        self.assertIsNone(previous_page_state(state, 10))
+        self.assertEqual(previous_page_state({'page': 3, 'skip': 20}, 10), {'page': 2, 'skip': 10})
+
+    def test_previous_page_history_is_bounded(self):
+        state = {'page': 1}
+        for page in range(PAGE_HISTORY_LIMIT + 5):
+            state = next_page_state(state, [{'_id': page * 10 + index} for index in range(11)], 10)
+        self.assertEqual(len(state['previous']), PAGE_HISTORY_LIMIT)
+        for _ in range(PAGE_HISTORY_LIMIT):
+            state = previous_page_state(state, 10)
+        self.assertEqual(state['page'], 6)
+        self.assertIsNone(previous_page_state(state, 10))
+
+    def test_page_token_round_trip(self):
+        key = page_token_key('genes', {'strand': '+'})
+        for state in ({'page': 2, 'after': ObjectId()}, {'page': 4, 'skip': 30}, {'page': 2, 'after': 'NZ_CP000001.1'},
+                      {'page': 4, 'after': 3, 'previous': [1, 2]}):
+            with self.subTest(state=state):
+                token = encode_page_token(state, key)
+                self.assertRegex(token, r'^[A-Za-z0-9_=:-]+$')
+                self.assertEqual(decode_page_token(token, key), state)
+
+    def test_page_tokens_are_bound_to_their_query(self):
+        key = page_token_key('genes', {'strand': '+'})
+        token = encode_page_token({'page': 2, 'after': ObjectId()}, key)
+        for other_key in (page_token_key('genes', {'strand': '-'}), page_token_key('plasmids', {'strand': '+'})):
+            with self.subTest(other_key=other_key), self.assertRaises(ValueError):
+                decode_page_token(token, other_key)
+        signature = token.rsplit(':', 1)[1]
+        edited = encode_page_token({'page': 9, 'skip': 80}, key).rsplit(':', 1)[0]
+        with self.assertRaises(ValueError):
+            decode_page_token(f"{edited}:{signature}", key)
+
+    def test_display_pages_walk_forward_and_back(self):
+        db = mongomock.MongoClient().db
+        db.genes.insert_many([{'_id': index, 'strand': '+' if index % 3 else '-'} for index in range(50)])
+        queries = ({'strand': '+'}, [{'$match': {'strand': '+'}}],
+                   [{'$group': {'_id': {'$mod': ['$_id', 25]}}}, {'$sort': {'_id': 1}}])
+        for query in queries:
+            with self.subTest(query=query), mock.patch.object(views, 'DISPLAY_LIMIT', 10), \
+                    mock.patch.object(views, 'query_result_cache', QueryResultCache()), \
+                    mock.patch.object(views, 'check_query_cost_once', return_value=''), \
+                    mock.patch.object(views, 'truncation_stage', return_value={'$match': {}}):  # mongomock has no $type
+                pages = [views.run_display_query(db, 'genes', query)]
+                while pages[-1]['next_page_token']:
+                    pages.append(views.run_display_query(db, 'genes', query, pages[-1]['next_page_token']))
+                self.assertEqual(pages[0]['previous_page_token'], '')
+                self.assertGreater(len(pages), 2)
+                for page, previous in zip(pages[1:], pages):
+                    previous_again = views.run_display_query(db, 'genes', query, page['previous_page_token'])
+                    self.assertEqual(previous_again['results'], previous['results'])
+                    self.assertEqual(previous_again['page_number'], previous['page_number'])
+                with self.assertRaises(ValueError):
+                    views.run_display_query(db, 'genes', {'strand': '-'}, pages[-1]['previous_page_token'] or 'x')
+
+    def test_malformed_page_tokens_are_rejected(self):
+        key = page_token_key('genes', {})
+        for token in ('not a token', '!!!', encode_page_token({'skip': 10}, key), encode_page_token({'page': '2'}, key),
+                      encode_page_token({'page': 0}, key), encode_page_token({'page': True}, key),
+                      encode_page_token({'page': 3, 'skip': -10}, key), encode_page_token({'page': 3, 'skip': 2 ** 63}, key),
+                      encode_page_token({'page': 2, 'skip': 10, 'after': 4}, key),
+                      encode_page_token({'page': 2}, key),
+                      encode_page_token({'page': 3, 'after': 4, 'previous': [1, 2]}, key),
+                      encode_page_token({'page': 3, 'after': 4, 'previous': 2}, key)):
+            with self.subTest(token=token), self.assertRaises(ValueError):
+                decode_page_token(token, key)
+
+
+class ProjectionTests(SimpleTestCase):
+
+    def test_embedded_fields(self):
+        pipeline = [
+            {'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id', 'foreignField': '_id', 'as': 'plasmid'}},
+            {'$unwind': '$plasmid'},
+            {'$lookup': {'from': 'hosts', 'localField': 'plasmid.host_id', 'foreignField': '_id', 'as': 'plasmid.host'}},
+            {'$graphLookup': {'from': 'genes', 'startWith': '$_id', 'connectFromField': '_id',
+                              'connectToField': 'plasmid_id', 'as': 'related'}},
+            {'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id', 'foreignField': '_id', 'as': 'plasmid'}},
+            {'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id', 'foreignField': '_id', 'as': 'sequence'}},
+        ]
+        self.assertEqual(embedded_fields(pipeline), ['plasmid', 'related'])
+        self.assertEqual(embedded_fields({'strand': '+'}), [])
+
+    def test_truncation_stage_covers_top_level_sequence_fields(self):
+        stage = truncation_stage({'strand': '+'}, 100)
+        self.assertEqual(list(stage['$set']), list(SEQUENCE_FIELDS))
+        self.assertEqual(stage['$set']['nt_sequence'], {'$cond': [
+            {'$eq': [{'$type': '$nt_sequence'}, 'string']},
+            {'$substrCP': ['$nt_sequence', 0, 100]},
+            '$nt_sequence',
+        ]})
+
+    def test_truncation_stage_covers_joined_documents(self):
+        pipeline = [{'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id', 'foreignField': '_id',
+                                 'as': 'plasmid'}}]
+        branches = truncation_stage(pipeline, 100)['$set']['plasmid']['$switch']['branches']
+        array_item = branches[0]['then']['$map']['in']['$cond'][1]
+        self.assertEqual(array_item['$mergeObjects'][0], '$$item')
+        self.assertEqual(list(array_item['$mergeObjects'][1]), list(SEQUENCE_FIELDS))
+        self.assertEqual(branches[1]['then']['$mergeObjects'][0], '$plasmid')
+
+    def test_uses_find_only_operators(self):
+        self.assertTrue(uses_find_only_operators({'$where': 'this.start > 10'}))
+        self.assertTrue(uses_find_only_operators({'$or': [{'strand': '+'}, {'location': {'$near': [0, 0]}}]}))
+        self.assertFalse(uses_find_only_operators({'strand': '+', 'start': {'$gt': 10}}))
+        self.assertFalse(uses_find_only_operators({'product': 'where'}))
+
+
+class QueryGuardTests(SimpleTestCase):
+
+    COLLSCAN_PLAN = {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}}
+    IXSCAN_PLAN = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}}
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.db.genes.insert_many([{'_id': index, 'plasmid_id': index % 10, 'strand': '+' if index % 4 else '-'}
+                                   for index in range(100)])
+        self.db.plasmids.insert_many([{'_id': index} for index in range(10)])
+
+    def explain(self, plan):
+        return mock.patch.object(self.db, 'command', return_value=plan)
+
+    def test_winning_plan_stages(self):
+        explain_output = {
+            'stages': [{'$cursor': {'queryPlanner': {
+                'winningPlan': {'stage': 'PROJECTION', 'inputStage': {'stage': 'IXSCAN'}},
+                'rejectedPlans': [{'stage': 'COLLSCAN'}],
+            }}}],
+        }
+        self.assertEqual(winning_plan_stages(explain_output), {'PROJECTION', 'IXSCAN'})
+
+    def test_collection_scan_reads_the_whole_collection(self):
+        with self.explain(self.COLLSCAN_PLAN):
+            cost = estimate_query_cost(self.db, 'genes', {'strand': '-'})
+        self.assertEqual(cost, {'scanned_docs': 100, 'uses_index': False, 'plan_stages': ['COLLSCAN']})
+
+    def test_index_scan_reads_the_matched_documents(self):
+        with self.explain(self.IXSCAN_PLAN):
+            cost = estimate_query_cost(self.db, 'genes', [{'$match': {'strand': '-'}}])
+        self.assertEqual(cost['scanned_docs'], 25)
+        self.assertTrue(cost['uses_index'])
+
+    def test_lookup_cost(self):
+        indexed = [{'$limit': 20}, {'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id',
+                                                'foreignField': '_id', 'as': 'plasmid'}}]
+        unindexed = [{'$limit': 20}, {'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id',
+                                                  'foreignField': 'plasmid_id', 'as': 'plasmid'}}]
+        with self.explain(self.COLLSCAN_PLAN):
+            self.assertEqual(estimate_query_cost(self.db, 'genes', indexed)['scanned_docs'], 100 + 20)
+            self.assertEqual(estimate_query_cost(self.db, 'genes', unindexed)['scanned_docs'], 100 + 20 * 10)
+
+    def test_foreign_field_indexed(self):
+        self.db.plasmids.create_index('host_id')
+        self.assertTrue(foreign_field_indexed(self.db.plasmids, '_id'))
+        self.assertTrue(foreign_field_indexed(self.db.plasmids, 'host_id'))
+        self.assertFalse(foreign_field_indexed(self.db.plasmids, 'environment_id'))
+        self.assertFalse(foreign_field_indexed(self.db.plasmids, None))
+
+    @override_settings(QUERY_SCAN_WARN_DOCS=50, QUERY_SCAN_MAX_DOCS=150)
+    def test_check_query_cost(self):
+        with self.explain(self.IXSCAN_PLAN):
+            self.assertEqual(check_query_cost(self.db, 'genes', {'strand': '-'}), '')
+        with self.explain(self.COLLSCAN_PLAN):
+            self.assertIn('about 100 documents without using an index',
+                          check_query_cost(self.db, 'genes', {'strand': '-'}))
+            with self.assertRaises(QueryRejected):
+                check_query_cost(self.db, 'genes', [{'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id',
+                                                                 'foreignField': 'plasmid_id', 'as': 'plasmid'}}])
+
+    @override_settings(QUERY_SCAN_WARN_DOCS=None, QUERY_SCAN_MAX_DOCS=None)
+    def test_checks_can_be_disabled(self):
+        with self.explain(self.COLLSCAN_PLAN):
+            self.assertEqual(check_query_cost(self.db, 'genes', {}), '')
+
+    @override_settings(QUERY_SCAN_WARN_DOCS=50, QUERY_SCAN_MAX_DOCS=150)
+    def test_preflight_runs_once_per_query(self):
+        rejected = [{'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id',
+                                 'foreignField': 'plasmid_id', 'as': 'plasmid'}}]
+        with mock.patch.object(views, 'query_result_cache', QueryResultCache()), \
+                mock.patch.object(views, 'get_build_generation', return_value=1) as generation, \
+                self.explain(self.COLLSCAN_PLAN) as explain:
+            warnings = [views.check_query_cost_once(self.db, 'genes', {'strand': '-'}) for _ in range(3)]
+            self.assertEqual(explain.call_count, 1)
+            self.assertEqual(len(set(warnings)), 1)
+            self.assertIn('about 100 documents', warnings[0])
+
+            for _ in range(2):
+                with self.assertRaises(QueryRejected):
+                    views.check_query_cost_once(self.db, 'genes', rejected)
+            self.assertEqual(explain.call_count, 2)
+
+            # A rebuild drops the verdicts with the rest of the cache
+            generation.return_value = 2
+            views.check_query_cost_once(self.db, 'genes', {'strand': '-'})
+            self.assertEqual(explain.call_count, 3)
+
+    @override_settings(QUERY_LOOKUP_MAX_TIME_MS=1234)
+    def test_small_reads_have_a_time_limit(self):
+        db = mock.MagicMock()
+        find = db.__getitem__.return_value.find
+        find.return_value = []
+        db.__getitem__.return_value.find_one.return_value = None
+        with mock.patch.object(views, 'get_db', return_value=db):
+            views.premade_queries(RequestFactory().get('/', {'search': 'host'}))
+            views.premade_queries(RequestFactory().get('/'))
+            views.sequence_fasta(RequestFactory().get('/'), str(ObjectId()))
+            with mock.patch.object(views, 'nl_cache_key', return_value='key'):
+                views.get_cached_pipeline('plasmids from soil')
+        self.assertEqual(find.call_count, 3)
+        for call in find.call_args_list + db.__getitem__.return_value.find_one.call_args_list:
+            self.assertEqual(call.kwargs['max_time_ms'], 1234)
+
+    def test_disk_use_option_is_only_sent_when_configured(self):
+        self.assertEqual(views.disk_use_option(None), {})
+        self.assertEqual(views.disk_use_option(False), {'allowDiskUse': False})
+        self.assertEqual(views.disk_use_option(True), {'allowDiskUse': True})
+
+
+class QueryResultCacheTests(SimpleTestCase):
+
+    def test_key_keeps_sort_order(self):
+        ascending_first = QueryResultCache.make_key('genes', [{'$sort': {'a': 1, 'b': -1}}], 50)
+        descending_first = QueryResultCache.make_key('genes', [{'$sort': {'b': -1, 'a': 1}}], 50)
+        self.assertNotEqual(ascending_first, descending_first)
+
+    def test_key_keeps_project_order(self):
+        self.assertNotEqual(
+            QueryResultCache.make_key('genes', [{'$project': {'locus': 1, 'product': 1}}], 50),
+            QueryResultCache.make_key('genes', [{'$project': {'product': 1, 'locus': 1}}], 50),
+        )
+
+    def test_key_distinguishes_objectid_from_string(self):
+        object_id = ObjectId()
+        self.assertNotEqual(
+            QueryResultCache.make_key('genes', {'plasmid_id': object_id}, 50),
+            QueryResultCache.make_key('genes', {'plasmid_id': str(object_id)}, 50),
+        )
+
+    def test_key_includes_limit_and_page_token(self):
+        query = {'gene_name': 'sul1'}
+        key = QueryResultCache.make_key('genes', query, 50)
+        self.assertEqual(key, QueryResultCache.make_key('genes', dict(query), 50))
+        self.assertNotEqual(key, QueryResultCache.make_key('genes', query, 100))
+        self.assertNotEqual(key, QueryResultCache.make_key('genes', query, 50, 'token'))
+        self.assertNotEqual(key, QueryResultCache.make_key('plasmids', query, 50))
+
+    def test_get_and_set(self):
+        cache = QueryResultCache()
+        self.assertIsNone(cache.get('key', 1))
+        cache.set('key', 'page', 1)
+        self.assertEqual(cache.get('key', 1), 'page')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QueryResultCache(max_entries=2)
+        cache.set('a', 1, None)
+        cache.set('b', 2, None)
+        cache.get('a', None)
+        cache.set('c', 3, None)
+        self.assertIsNone(cache.get('b', None))
+        self.assertEqual(cache.get('a', None), 1)
+        self.assertEqual(cache.get('c', None), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_entries_expire(self):
+        cache = QueryResultCache(ttl_seconds=10)
+        with mock.patch('time.monotonic', return_value=100.0):
+            cache.set('key', 'page', None)
+        with mock.patch('time.monotonic', return_value=109.0):
+            self.assertEqual(cache.get('key', None), 'page')
+        with mock.patch('time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('key', None))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_new_generation_drops_entries(self):
+        cache = QueryResultCache()
+        cache.set('key', 'page', 'build-1')
+        self.assertIsNone(cache.get('key', 'build-2'))
+        self.assertEqual(cache.stats()['generation'], 'build-2')
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+class SequenceStoreTests(SimpleTestCase):
+
+    NUCLEOTIDES = 'ACGTTGCA' * 50 + 'NNNN' + 'GATTACA' * 20
+    PROTEIN = 'MKKLLPTAAAGLLLLAAQPAMA' * 10
+
+    def test_round_trip(self):
+        for codec in sequence_store.SEQUENCE_CODECS:
+            for sequence in (self.NUCLEOTIDES, self.PROTEIN, ''):
+                with self.subTest(codec=codec, sequence=sequence[:10]):
+                    blob = sequence_store.encode_sequence(sequence, codec)
+                    self.assertEqual(blob['length'], len(sequence))
+                    self.assertEqual(sequence_store.decode_sequence(blob), sequence)
+                    self.assertEqual(sequence_store.decode_sequence_prefix(blob, 30), sequence[:30])
+
+    def test_2bit_falls_back_to_zlib_for_proteins(self):
+        self.assertEqual(sequence_store.encode_sequence(self.NUCLEOTIDES, '2bit')['codec'], '2bit')
+        self.assertEqual(sequence_store.encode_sequence(self.PROTEIN, '2bit')['codec'], 'zlib')
+
+    def test_packed_sequences_are_stored_as_they_are(self):
+        packed = PackedSequence.encode(self.NUCLEOTIDES)
+        blob = sequence_store.encode_sequence(packed, '2bit')
+        self.assertEqual(sequence_store.unpack_blob(blob), packed)
+        self.assertEqual(sequence_store.decode_sequence(sequence_store.encode_sequence(packed, 'zlib')),
+                         self.NUCLEOTIDES)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            sequence_store.encode_sequence(self.NUCLEOTIDES, 'gzip')
+
+
+class SequenceStorageSchemaTests(SimpleTestCase):
+
+    SEQUENCE_QUERY = [{'$match': {'nt_sequence': {'$regex': '^ATG'}}}, {'$project': {'locus': 1}}]
+
+    def setUp(self):
+        for name in ('_few_shot_examples', '_prompt_fingerprint'):
+            patcher = mock.patch.object(views, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_prompt_describes_the_stored_fields(self):
+        embedded = views.get_prompt_template()
+        embedded_fingerprint = views.get_prompt_fingerprint()
+        self.assertIn('`sequence`: String', embedded)
+        self.assertNotIn('sequence_ref', embedded)
+        with override_settings(SEQUENCE_STORAGE='blob'), mock.patch.object(views, '_few_shot_examples', None), \
+                mock.patch.object(views, '_prompt_fingerprint', None):
+            blob = views.get_prompt_template()
+            self.assertNotEqual(views.get_prompt_fingerprint(), embedded_fingerprint)
+            self.assertFalse(any(views.references_inline_sequences(example['output'])
+                                 for example in views.get_few_shot_examples()))
+        for field in SEQUENCE_FIELDS:
+            self.assertNotRegex(blob, rf"- `{field}`:")
+            self.assertIn(f"- `{field}_ref`: ObjectId", blob)
+        self.assertIn('`sequence_length`: Int32', blob)
+
+    def test_examples_are_adapted_or_dropped(self):
+        example = {'input': 'Plasmids and their sequences', 'output': {'collection': 'plasmids', 'pipeline': [
+            {'$project': {'_id': 0, 'plasmid_id': 1, 'sequence': {'$substr': ['$sequence', 0, 50]}}},
+        ]}}
+        adapted = views.blob_storage_example(example)
+        self.assertEqual(adapted['output']['pipeline'], [{'$project': {'_id': 0, 'plasmid_id': 1, 'sequence_ref': 1}}])
+        self.assertEqual(example['output']['pipeline'][0]['$project']['sequence'], {'$substr': ['$sequence', 0, 50]})
+        excluded = {'input': 'Genes', 'output': {'collection': 'genes', 'pipeline': [{'$project': {'host.aa_sequence': 0}}]}}
+        self.assertEqual(views.blob_storage_example(excluded)['output']['pipeline'],
+                         [{'$project': {'host.aa_sequence_ref': 0}}])
+        matched = {'input': 'Genes starting with ATG', 'output': {'collection': 'genes', 'pipeline': self.SEQUENCE_QUERY}}
+        self.assertIsNone(views.blob_storage_example(matched))
+        self.assertFalse(views.references_inline_sequences([{'$sort': {'sequence_length': -1}}]))
+
+    def test_schema_page_and_premade_queries(self):
+        db = mock.MagicMock()
+        db.__getitem__.return_value.find.return_value = [
+            {'_id': ObjectId(), 'natural_language_query': 'Genes starting with ATG', 'json_query': self.SEQUENCE_QUERY,
+             'target_collection': 'genes'},
+        ]
+        note = 'stored separately in this database'
+        with mock.patch.object(views, 'get_db', return_value=db):
+            self.assertNotContains(self.client.get(reverse('premade_queries')), note)
+            self.assertNotContains(self.client.get(reverse('database_schema')), 'sequence_ref')
+            with override_settings(SEQUENCE_STORAGE='blob'):
+                self.assertContains(self.client.get(reverse('premade_queries')), note)
+                schema = self.client.get(reverse('database_schema')).context['schema']
+        self.assertEqual(schema['plasmids']['sequence_ref'], 'ObjectId')
+        self.assertNotIn('sequence', schema['plasmids'])
+        self.assertEqual({'nt_sequence_ref', 'aa_sequence_ref'} - set(schema['genes']), set())
+        self.assertNotIn('nt_sequence', schema['genes'])
+        self.assertIn(sequence_store.SEQUENCES_COLLECTION, schema)
+
+
+class SummaryCollectionTests(SimpleTestCase):
+    """
+    The summary collections must hold what the multi-$lookup aggregations they replace return.
+    """
+
+    # Columns of each summary, and the raw aggregation over the base collections it materializes
+    RAW_AGGREGATIONS = {
+        'resistance_genes_by_genus': (('genus', 'gene_name', 'gene_count', 'plasmid_count'), 'genes', [
+            {'$match': {'antibiotic_resistance': True}},
+            {'$lookup': {'from': 'plasmids', 'localField': 'plasmid_id', 'foreignField': '_id', 'as': 'plasmid'}},
+            {'$unwind': '$plasmid'},
+            {'$lookup': {'from': 'hosts', 'localField': 'plasmid.host_id', 'foreignField': '_id', 'as': 'host'}},
+            {'$unwind': '$host'},
+            {'$group': {'_id': {'genus': '$host.genus', 'gene_name': '$resistance_info.gene_name'},
+                        'gene_count': {'$sum': 1}, 'plasmids': {'$addToSet': '$plasmid._id'}}},
+            {'$project': {'genus': '$_id.genus', 'gene_name': '$_id.gene_name', 'gene_count': 1,
+                          'plasmid_count': {'$size': '$plasmids'}}},
+        ]),
+        'replicon_types_by_host': (('host_id', 'genus', 'species', 'replicon_type', 'plasmid_count'), 'plasmids', [
+            {'$lookup': {'from': 'hosts', 'localField': 'host_id', 'foreignField': '_id', 'as': 'host'}},
+            {'$unwind': {'path': '$host', 'preserveNullAndEmptyArrays': True}},
+            {'$group': {'_id': {'host_id': '$host_id', 'replicon_type': '$replicon_type'},
+                        'genus': {'$first': '$host.genus'}, 'species': {'$first': '$host.species'},
+                        'plasmid_count': {'$sum': 1}}},
+            {'$project': {'host_id': '$_id.host_id', 'genus': 1, 'species': 1,
+                          'replicon_type': '$_id.replicon_type', 'plasmid_count': 1}},
+        ]),
+        'mobility_by_environment': (('environment_id', 'environment', 'mobility', 'plasmid_count'), 'plasmids', [
+            {'$lookup': {'from': 'environments', 'localField': 'environment_id', 'foreignField': '_id',
+                         'as': 'environment'}},
+            {'$unwind': {'path': '$environment', 'preserveNullAndEmptyArrays': True}},
+            {'$group': {'_id': {'environment_id': '$environment_id', 'mobility': '$mobility'},
+                        'environment': {'$first': '$environment.name'}, 'plasmid_count': {'$sum': 1}}},
+            {'$project': {'environment_id': '$_id.environment_id', 'environment': 1,
+                          'mobility': '$_id.mobility', 'plasmid_count': 1}},
+        ]),
+    }
+
+    def setUp(self):
+        patch_mongomock_summary_stages(self)
+        self.db = mongomock.MongoClient().db
+        self.db.environments.insert_many([{'_id': 'env-soil', 'name': 'Soil'}, {'_id': 'env-gut', 'name': 'Gut'}])
+        self.db.hosts.insert_many([
+            {'_id': 'host-ec', 'genus': 'Escherichia', 'species': 'coli'},
+            {'_id': 'host-ef', 'genus': 'Escherichia', 'species': 'fergusonii'},
+            {'_id': 'host-kp', 'genus': 'Klebsiella', 'species': 'pneumoniae'},
+        ])
+        self.plasmids = {}
+        self.add_plasmid('p1', 'host-ec', 'env-gut', 'IncF', 'conjugative', ['blaTEM', 'tetA'], ['repA'])
+        self.add_plasmid('p2', 'host-ef', 'env-gut', 'IncF', 'mobilizable', ['blaTEM'], [])
+        self.add_plasmid('p3', 'host-kp', 'env-soil', 'IncX', 'conjugative', ['blaKPC', 'blaTEM'], ['traA'])
+        self.add_plasmid('p4', None, None, 'IncX', 'non-mobilizable', ['tetA'], [])  # No host or environment
+        self.add_plasmid('p5', 'host-kp', 'env-soil', 'IncF', 'conjugative', [], ['repA'])
+
+    def add_plasmid(self, plasmid_id, host_id, environment_id, replicon_type, mobility, resistance_genes, other_genes):
+        object_id = self.db.plasmids.insert_one({
+            'plasmid_id': plasmid_id, 'host_id': host_id, 'environment_id': environment_id,
+            'replicon_type': replicon_type, 'mobility': mobility,
+        }).inserted_id
+        self.plasmids[plasmid_id] = object_id
+        genes = [{'plasmid_id': object_id, 'gene_name': name, 'antibiotic_resistance': True,
+                  'resistance_info': {'gene_name': name}} for name in resistance_genes]
+        genes += [{'plasmid_id': object_id, 'gene_name': name, 'antibiotic_resistance': False}
+                  for name in other_genes]
+        if genes:
+            self.db.genes.insert_many(genes)
+
+    def rows(self, documents, columns):
+        return sorted((tuple(doc.get(column) for column in columns) for doc in documents), key=repr)
+
+    def assert_summaries_match(self):
+        for name, (columns, source, pipeline) in self.RAW_AGGREGATIONS.items():
+            with self.subTest(summary=name):
+                self.assertEqual(self.rows(self.db[name].find(), columns),
+                                 self.rows(self.db[source].aggregate(pipeline), columns))
+
+    def test_full_refresh_matches_raw_aggregations(self):
+        database_build.refresh_summary_collections(self.db)
+        self.assertEqual(self.db.resistance_genes_by_genus.find_one({'genus': 'Escherichia', 'gene_name': 'blaTEM'},
+                                                                    {'_id': 0, 'gene_count': 1, 'plasmid_count': 1}),
+                         {'gene_count': 2, 'plasmid_count': 2})
+        self.assert_summaries_match()
+
+    def test_scoped_refresh_matches_raw_aggregations(self):
+        database_build.refresh_summary_collections(self.db)
+
+        # An incremental build that moves p2 to a new host and environment, drops p3 and adds p6
+        self.db.hosts.insert_one({'_id': 'host-sa', 'genus': 'Salmonella', 'species': 'enterica'})
+        self.db.environments.insert_one({'_id': 'env-water', 'name': 'Water'})
+        self.db.plasmids.update_one({'plasmid_id': 'p2'}, {'$set': {'host_id': 'host-sa',
+                                                                    'environment_id': 'env-water'}})
+        self.db.genes.delete_many({'plasmid_id': self.plasmids['p3']})
+        self.db.plasmids.delete_one({'plasmid_id': 'p3'})
+        self.add_plasmid('p6', 'host-ec', 'env-gut', 'IncI', 'conjugative', ['blaCTX-M'], [])
+        scopes = {'host_id': {'host-ef', 'host-sa', 'host-kp', 'host-ec'},
+                  'environment_id': {'env-gut', 'env-water', 'env-soil'}}
+        database_build.refresh_summary_collections(self.db, scopes)
+
+        self.assert_summaries_match()
+
+    def test_scoped_refresh_only_touches_its_scope(self):
+        database_build.refresh_summary_collections(self.db)
+        self.db.plasmids.update_one({'plasmid_id': 'p1'}, {'$set': {'replicon_type': 'IncI'}})
+        database_build.refresh_summary_collections(self.db, {'host_id': {'host-kp'}, 'environment_id': set()})
+        stored = self.db.replicon_types_by_host.find_one({'host_id': 'host-ec'}, {'_id': 0, 'replicon_type': 1})
+        self.assertEqual(stored, {'replicon_type': 'IncF'})
+
+    def test_servers_without_merge_are_skipped(self):
+        with mock.patch.object(mongomock.MongoClient, 'server_info', return_value={'versionArray': [4, 0, 28, 0]}):
+            database_build.refresh_summary_collections(self.db)
+        self.assertFalse(set(self.RAW_AGGREGATIONS) & set(self.db.list_collection_names()))
@@ -1,16 +1,32 @@
 from django.shortcuts import render, redirect
+from django.conf import settings
 from pymongo import MongoClient
 from datetime import datetime
+import atexit
+import hashlib
+import hmac
+import itertools
 import json
 import logging
+import os
+import threading
+import time
 import csv
 from bson import ObjectId
-from django.http import JsonResponse, HttpResponse
-from langchain_ollama import OllamaLLM
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain  # Corrected import
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 import re
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_protect
+import json_backend
+import sequence_store
+from .example_retrieval import ExampleIndex
+from .instrumentation import add_count, metrics_registry, mongo_command_timer, span
+from .nl_jobs import FAILED_ERROR, NLJobQueue, TooManyJobs, job_finished
+from .pagination import (decode_page_token, encode_page_token, first_page_state, next_page_state, page_filter, page_pipeline,
+                         page_token_key, previous_page_state)
+from .query_cache import QueryResultCache
+from .projection import SEQUENCE_FIELDS, truncation_stage, uses_find_only_operators
+from .query_guard import QueryRejected, check_query_cost
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -35,27 +51,87 @@ logger.addHandler(file_handler)
 DISPLAY_LIMIT = 10          # Limit query results displayed to 10
 MAX_FIELD_LENGTH = 100      # Maximum characters per field in results
 MAX_QUERY_LENGTH = 500      # Maximum characters for display-only query fields
+CSV_BATCH_SIZE = 1000       # Documents per cursor batch in CSV exports
+CSV_HEADER_PROBE_DOCUMENTS = 10000  # Documents read before the CSV header is sent; it has every field they contain
+BUILD_GENERATION_CHECK_SECONDS = 5  # How often the build generation is re-read to invalidate cached results
+NL_CACHE_COLLECTION = 'nl_pipeline_cache'  # Persistent cache of generated pipelines, keyed by question and prompt
+NL_JOBS_COLLECTION = 'nl_jobs'  # State of natural language query jobs, shared by every worker process
+FASTA_LINE_WIDTH = 80       # Residues per line in sequence downloads
+
+# Results of recently executed queries, dropped when database_build.py records a new build
+query_result_cache = QueryResultCache(
+    max_entries=settings.QUERY_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.QUERY_CACHE_TTL_SECONDS,
+)
+_build_generation = (None, float('-inf'))  # (generation, monotonic time it was read)
+
+# Natural language queries run as background jobs on a bounded pool, isolated from query execution
+nl_job_queue = NLJobQueue(
+    lambda: get_db()[NL_JOBS_COLLECTION],
+    max_workers=settings.NL_JOB_WORKERS,
+    max_jobs_per_owner=settings.NL_JOBS_PER_USER,
+    job_ttl_seconds=settings.NL_JOB_TTL_SECONDS,
+)
+NL_JOB_STREAM_RETRY_MS = 1000  # How soon browsers reconnect to the synchronous NL job event stream
+NL_JOB_STREAM_POLL_SECONDS = 0.5  # How often the async NL job event stream re-reads the job
+NL_JOB_STREAM_HEARTBEAT_SECONDS = 15  # Keep-alive interval for the async NL job event stream
 
 # --- MongoDB Connection Utility ---
+# One pooled client per process, created on first use and closed at interpreter exit.
+_mongo_client = None
+_mongo_client_pid = None
+_mongo_client_lock = threading.Lock()
+
 def get_mongo_client():
     """
-    Establishes and returns a MongoDB client.
+    Returns the process-wide MongoDB client, creating it on first use.
+    The client owns a bounded connection pool shared by all requests and threads.
+    A new client is created after a fork, since pymongo clients are not fork-safe.
     """
-    try:
-        client = MongoClient("mongodb://localhost:27017/")  # Adjust URI as needed
-        logger.info("Connected to MongoDB successfully.")
-        return client
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {e}")
-        raise
+    global _mongo_client, _mongo_client_pid
+    if _mongo_client is not None and _mongo_client_pid == os.getpid():
+        return _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is None or _mongo_client_pid != os.getpid():
+            try:
+                _mongo_client = MongoClient(
+                    settings.MONGO_URI,
+                    maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                    serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS,
+                    waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    event_listeners=[mongo_command_timer],
+                )
+                _mongo_client_pid = os.getpid()
+                logger.info(f"Created MongoDB client with a pool of up to {settings.MONGO_MAX_POOL_SIZE} connections.")
+            except Exception as e:
+                logger.error(f"Failed to connect to MongoDB: {e}")
+                raise
+    return _mongo_client
+
+def close_mongo_client():
+    """
+    Closes the process-wide MongoDB client and its connection pool, if one was created.
+    """
+    global _mongo_client, _mongo_client_pid
+    with _mongo_client_lock:
+        if _mongo_client is not None and _mongo_client_pid == os.getpid():
+            _mongo_client.close()
+            logger.info("Closed MongoDB client.")
+        _mongo_client = None
+        _mongo_client_pid = None
+
+atexit.register(close_mongo_client)
 
 def get_db():
     """
     Returns the MongoDB database instance.
     """
     client = get_mongo_client()
-    db = client['PruebaTFMallplasmids']
-    logger.debug("Accessed MongoDB database: PruebaTFMallplasmids")
+    db = client[settings.MONGO_DB_NAME]
+    logger.debug(f"Accessed MongoDB database: {settings.MONGO_DB_NAME}")
     return db
 
 # --- Helper Functions ---
@@ -109,15 +185,58 @@ def database_schema(request):
         "environments": {
             "_id": "ObjectId",
             "name": "String"
+        },
+        "resistance_genes_by_genus": {
+            "_id": "Object",
+            "genus": "String",
+            "gene_name": "String",
+            "gene_count": "Int32",
+            "plasmid_count": "Int32"
+        },
+        "replicon_types_by_host": {
+            "_id": "Object",
+            "host_id": "ObjectId",
+            "genus": "String",
+            "species": "String",
+            "replicon_type": "String",
+            "plasmid_count": "Int32"
+        },
+        "mobility_by_environment": {
+            "_id": "Object",
+            "environment_id": "ObjectId",
+            "environment": "String",
+            "mobility": "String",
+            "plasmid_count": "Int32"
         }
     }
 
     explanatory_text = (
         "This is the database schema (i.e., what is in the database and how it is related). "
         "This may come in handy if you're trying to make complex queries. Feel free to use it as a prompt "
-        "if you are using a Large Language Model (LLM) to help you make queries."
+        "if you are using a Large Language Model (LLM) to help you make queries. "
+        "The resistance_genes_by_genus, replicon_types_by_host and mobility_by_environment collections are "
+        "summaries precomputed on every database build; they answer counts per genus, host and environment "
+        "without any $lookup."
     )
 
+    if uses_blob_sequence_storage():
+        for collection, fields in sequence_store.SEQUENCE_FIELDS.items():
+            schema[collection] = {(f"{key}_ref" if key in fields else key): ("ObjectId" if key in fields else value)
+                                  for key, value in schema[collection].items()}
+        schema[sequence_store.SEQUENCES_COLLECTION] = {
+            "_id": "ObjectId",
+            "name": "String",
+            "field": "String",
+            "codec": "String",
+            "length": "Int32",
+            "data": "Binary"
+        }
+        explanatory_text += (
+            " Sequences are stored compressed in the sequences collection: plasmids and genes only hold "
+            "sequence_ref, nt_sequence_ref and aa_sequence_ref, so queries cannot match or search sequence "
+            "content. Include a _ref field to show the beginning of its sequence in the results."
+        )
+
     context = {
         'schema': schema,
         'explanatory_text': explanatory_text
@@ -227,6 +346,48 @@ def flatten_dict(d, parent_key='', sep='.'):
             items.append((new_key, v))
     return dict(items)
 
+def flatten_display_document(document, max_length=MAX_FIELD_LENGTH, sep='.'):
+    """
+    Converts ObjectIds to strings, truncates string fields and flattens one document in a single pass.
+    Gives the same result as flatten_dict(truncate_string_fields(convert_objectids(document), max_length), sep=sep)
+    without building the two intermediate copies of the document.
+    """
+    flat = {}
+    # Sub-documents are walked with a stack of item iterators instead of recursion
+    stack = [('', iter(document.items()))]
+    while stack:
+        parent_key, items = stack[-1]
+        for k, v in items:
+            new_key = f"{parent_key}{sep}{k}" if parent_key else k
+            if isinstance(v, str):
+                flat[new_key] = v[:max_length]
+            elif isinstance(v, dict):
+                stack.append((new_key, iter(v.items())))
+                break
+            elif isinstance(v, list):
+                flat[new_key] = ', '.join([display_list_item(item, max_length) for item in v])
+            elif isinstance(v, ObjectId):
+                flat[new_key] = str(v)[:max_length]
+            else:
+                flat[new_key] = v
+        else:
+            stack.pop()
+    return flat
+
+def display_list_item(item, max_length=MAX_FIELD_LENGTH):
+    """
+    Formats one list element as flatten_dict joins it, after ObjectId conversion and truncation.
+    """
+    if isinstance(item, str):
+        return item[:max_length]
+    if isinstance(item, dict):
+        return json.dumps(flatten_display_document(item, max_length))
+    if isinstance(item, ObjectId):
+        return str(item)[:max_length]
+    if isinstance(item, list):
+        return str(truncate_string_fields(convert_objectids(item), max_length))
+    return str(item)
+
 
 # -------------------- Define the Table Schema --------------------
 TABLE_SCHEMA = '''
@@ -275,6 +436,28 @@ Collections and Their Fields:
     - `replicon_type`: String
     - `sequence`: String
     - `sequence_length`: Int32
+
+5. **resistance_genes_by_genus** (precomputed summary)
+    - `_id`: Object
+    - `gene_count`: Int32
+    - `gene_name`: String
+    - `genus`: String
+    - `plasmid_count`: Int32
+
+6. **replicon_types_by_host** (precomputed summary)
+    - `_id`: Object
+    - `genus`: String
+    - `host_id`: ObjectId
+    - `plasmid_count`: Int32
+    - `replicon_type`: String
+    - `species`: String
+
+7. **mobility_by_environment** (precomputed summary)
+    - `_id`: Object
+    - `environment`: String
+    - `environment_id`: ObjectId
+    - `mobility`: String
+    - `plasmid_count`: Int32
 '''
 # ------------------------------------------------------------------------
 
@@ -327,8 +510,112 @@ Detailed Descriptions of Collections and Their Fields:
     - `replicon_type`: Type of replicon.
     - `sequence`: DNA sequence of the plasmid.
     - `sequence_length`: Length of the plasmid sequence (Int32).
+
+Summary collections, precomputed when the database is built. They already hold the counts that
+would otherwise need several $lookup stages, so **always query them instead of joining genes,
+plasmids, hosts and environments** when the question asks for these counts:
+
+5. **resistance_genes_by_genus**: one document per host genus and resistance gene.
+    - `genus`: Host genus.
+    - `gene_name`: Name of the resistance gene (`resistance_info.gene_name` in `genes`).
+    - `gene_count`: Number of resistance gene hits of this gene in plasmids of this genus.
+    - `plasmid_count`: Number of plasmids of this genus carrying the gene.
+
+6. **replicon_types_by_host**: one document per host and replicon type.
+    - `host_id`: Reference to the host (`_id` from the `hosts` collection).
+    - `genus`: Genus of the host.
+    - `species`: Species of the host.
+    - `replicon_type`: Replicon type, as in `plasmids`.
+    - `plasmid_count`: Number of plasmids of this host with this replicon type.
+
+7. **mobility_by_environment**: one document per environment and mobility.
+    - `environment_id`: Reference to the environment (`_id` from the `environments` collection).
+    - `environment`: Name of the environment.
+    - `mobility`: Mobility, as in `plasmids`.
+    - `plasmid_count`: Number of plasmids from this environment with this mobility.
 '''
 # ------------------------------------------------------------------------
+
+# -------------------- Blob Sequence Storage --------------------
+# With SEQUENCE_STORAGE 'blob', plasmid and gene documents hold '<field>_ref' references into the
+# sequences collection instead of their sequences (see sequence_store.py). The schema text, the
+# few-shot examples and the schema page are adapted so they only name fields that exist.
+BLOB_SEQUENCE_DESCRIPTIONS = {
+    'sequence': "Reference to the DNA sequence of the plasmid (`_id` in the `sequences` collection).",
+    'nt_sequence': "Reference to the nucleotide sequence of the gene (`_id` in the `sequences` collection).",
+    'aa_sequence': "Reference to the amino acid sequence of the gene (`_id` in the `sequences` collection).",
+}
+
+BLOB_SEQUENCE_NOTE = '''
+Sequences are stored compressed in the `sequences` collection, not in the plasmid and gene documents.
+`sequence`, `nt_sequence` and `aa_sequence` do not exist: never match, search, compare or $substr them.
+To show a sequence, include its `sequence_ref`, `nt_sequence_ref` or `aa_sequence_ref` field; the
+application displays the beginning of the sequence. Use `sequence_length` for plasmid lengths.
+'''
+
+
+def describe_blob_sequence_fields(text, describe):
+    """
+    Replaces the sequence field lines of schema text with their '<field>_ref' counterparts.
+    Args:
+        text (str): TABLE_SCHEMA or SCHEMA_DESCRIPTION.
+        describe (callable): Returns the description of a field's reference.
+    """
+    for field in SEQUENCE_FIELDS:
+        text = re.sub(rf"^(\s*- )`{field}`: .*$",
+                      lambda match, field=field: f"{match.group(1)}`{field}_ref`: {describe(field)}",
+                      text, flags=re.MULTILINE)
+    return text
+
+
+BLOB_TABLE_SCHEMA = describe_blob_sequence_fields(TABLE_SCHEMA, lambda field: "ObjectId")
+BLOB_SCHEMA_DESCRIPTION = (describe_blob_sequence_fields(SCHEMA_DESCRIPTION, BLOB_SEQUENCE_DESCRIPTIONS.get)
+                           + BLOB_SEQUENCE_NOTE)
+
+
+def is_sequence_path(path):
+    """
+    Returns True if a field path ('sequence', 'plasmid.sequence', '$nt_sequence') names an
+    inline sequence field.
+    """
+    return path.lstrip('$').split('.')[-1] in SEQUENCE_FIELDS
+
+
+def references_inline_sequences(value):
+    """
+    Returns True if a query (pipeline, stage or expression) uses an inline sequence field,
+    as a key or as a '$field' path, which blob storage does not have.
+    """
+    if isinstance(value, dict):
+        return any(is_sequence_path(key) or references_inline_sequences(item) for key, item in value.items())
+    if isinstance(value, list):
+        return any(references_inline_sequences(item) for item in value)
+    return isinstance(value, str) and value.startswith('$') and is_sequence_path(value)
+
+
+def blob_storage_example(example):
+    """
+    Adapts a few-shot example to blob sequence storage: sequence fields in $project stages are
+    replaced by their '<field>_ref' (kept as an inclusion or exclusion). Returns None if the example still needs sequence content
+    (e.g. it matches on a sequence).
+    """
+    output = example['output']
+    pipeline = []
+    for stage in output.get('pipeline', []):
+        if isinstance(stage, dict) and isinstance(stage.get('$project'), dict):
+            stage = {'$project': {
+                (f"{key}_ref" if is_sequence_path(key) else key): ((item if item in (0, False) else 1) if is_sequence_path(key) else item)
+                for key, item in stage['$project'].items()
+            }}
+        pipeline.append(stage)
+    if references_inline_sequences(pipeline):
+        return None
+    return {**example, 'output': {**output, 'pipeline': pipeline}}
+
+
+def uses_blob_sequence_storage():
+    return settings.SEQUENCE_STORAGE == 'blob'
+# ------------------------------------------------------------------------
 FEW_SHOT_EXAMPLES = [
     # Example 1: Retrieve specific fields with $project
     {
@@ -625,6 +912,86 @@ FEW_SHOT_EXAMPLES = [
                 }
             ]
         }
+    },
+    # Example 13: Counts per genus come from the resistance_genes_by_genus summary
+    {
+        "input": "What are the 10 most common resistance genes in Salmonella?",
+        "output": {
+            "collection": "resistance_genes_by_genus",
+            "pipeline": [
+                {
+                    "$match": {
+                        "genus": "Salmonella"
+                    }
+                },
+                {
+                    "$sort": {
+                        "gene_count": -1
+                    }
+                },
+                {
+                    "$limit": 10
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "gene_name": 1,
+                        "gene_count": 1,
+                        "plasmid_count": 1
+                    }
+                }
+            ]
+        }
+    },
+    # Example 14: Replicon types per host come from the replicon_types_by_host summary
+    {
+        "input": "Which replicon types are most frequent in Escherichia coli plasmids?",
+        "output": {
+            "collection": "replicon_types_by_host",
+            "pipeline": [
+                {
+                    "$match": {
+                        "genus": "Escherichia",
+                        "species": "coli"
+                    }
+                },
+                {
+                    "$sort": {
+                        "plasmid_count": -1
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "replicon_type": 1,
+                        "plasmid_count": 1
+                    }
+                }
+            ]
+        }
+    },
+    # Example 15: Mobility per environment comes from the mobility_by_environment summary
+    {
+        "input": "Show the distribution of plasmid mobility in each environment.",
+        "output": {
+            "collection": "mobility_by_environment",
+            "pipeline": [
+                {
+                    "$sort": {
+                        "environment": 1,
+                        "plasmid_count": -1
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "environment": 1,
+                        "mobility": 1,
+                        "plasmid_count": 1
+                    }
+                }
+            ]
+        }
     }
 ]
 
@@ -634,7 +1001,7 @@ def load_additional_examples(file_path):
     examples = []
     with open(file_path, 'r', encoding='utf-8') as f:
         content = f.read()
-        data_list = json.loads(content)
+        data_list = json_backend.loads(content)
 
     for data in data_list:
         examples.append({
@@ -643,21 +1010,28 @@ def load_additional_examples(file_path):
         })
     return examples
 
-
-# Assuming your dataset is in 'fine_tune_data.jsonl'
-additional_examples = load_additional_examples('/home/nacho/TFM/mongodb/queriesfortraining/few_shot_examples.json')
-
-# Combine with existing examples
-FEW_SHOT_EXAMPLES.extend(additional_examples)
 # ------------------------------------------------------------------------
 
 
 # -------------------- Construct the Prompt Template --------------------
-# Convert the few-shot examples to a formatted string with escaped curly braces
-few_shot_examples = "\n".join([
-    f"Input: {example['input']}\nOutput:\n```json\n{json.dumps(example['output'], indent=4).replace('{', '{{').replace('}', '}}')}\n```\n"
-    for example in FEW_SHOT_EXAMPLES
-])
+FEW_SHOT_TOP_K = 8  # Number of most relevant examples injected into each prompt
+
+
+def format_few_shot_examples(examples):
+    """
+    Formats few-shot examples for the prompt's {examples} slot.
+    """
+    return "\n".join([
+        f"Input: {example['input']}\nOutput:\n```json\n{json.dumps(example['output'], indent=4)}\n```\n"
+        for example in examples
+    ])
+
+
+def select_few_shot_examples(user_question, k=FEW_SHOT_TOP_K):
+    """
+    Returns the formatted k few-shot examples most similar to the user's question.
+    """
+    return format_few_shot_examples(get_example_index().top_k(user_question, k))
 
 prompt_template_for_creating_query =prompt_template_for_creating_query = f"""
 You are an expert in crafting NoSQL queries for MongoDB with 10 years of experience.
@@ -705,7 +1079,7 @@ Schema Description:
 {SCHEMA_DESCRIPTION}
 
 Here are some examples:
-{few_shot_examples}
+{{examples}}
 
 ### User Question
 
@@ -721,33 +1095,169 @@ Note:
 Input: {{user_question}}
 """
 
+# The same prompt for databases built with --sequence-storage blob
+blob_storage_prompt_template = (prompt_template_for_creating_query
+                                .replace(TABLE_SCHEMA, BLOB_TABLE_SCHEMA)
+                                .replace(SCHEMA_DESCRIPTION, BLOB_SCHEMA_DESCRIPTION))
+
+
+def get_prompt_template():
+    """
+    Returns the prompt template describing the database as stored (settings.SEQUENCE_STORAGE).
+    """
+    return blob_storage_prompt_template if uses_blob_sequence_storage() else prompt_template_for_creating_query
 
 
 # ------------------------------------------------------------------------
 
-# -------------------- Initialize the Prompt and LLMChain --------------------
-query_creation_prompt = PromptTemplate(
-    input_variables=["user_question"],
-    template=prompt_template_for_creating_query,
-)
+# -------------------- Lazily Initialize the Prompt and LLMChain --------------------
+LLM_MODEL_NAME = "codellama"
+LLM_TEMPERATURE = 0.2
+LLM_INIT_RETRY_SECONDS = 30  # Wait before retrying after the LLM chain failed to initialize
+
+# The examples, their retrieval index and the LLM chain are loaded on first use, once per
+# process, so pages and management commands that never generate pipelines do not pay for
+# the LangChain imports, the examples file or the model setup.
+_nl_lock = threading.RLock()
+_few_shot_examples = None
+_example_index = None
+_prompt_fingerprint = None
+_llmchain = None
+_llmchain_loaded = False
+_llmchain_failed_at = None
+
+
+def get_few_shot_examples():
+    """
+    Returns the built-in few-shot examples plus those in settings.FEW_SHOT_EXAMPLES_FILE,
+    adapted with blob_storage_example under blob sequence storage.
+    """
+    global _few_shot_examples
+    with _nl_lock:
+        if _few_shot_examples is None:
+            examples = list(FEW_SHOT_EXAMPLES)
+            try:
+                examples.extend(load_additional_examples(settings.FEW_SHOT_EXAMPLES_FILE))
+            except Exception as e:
+                logger.error(f"Failed to load few-shot examples from {settings.FEW_SHOT_EXAMPLES_FILE}: {e}")
+            if uses_blob_sequence_storage():
+                # Examples must not teach the model fields that blob storage does not have
+                examples = [adapted for adapted in map(blob_storage_example, examples) if adapted is not None]
+            _few_shot_examples = examples
+        return _few_shot_examples
+
+
+def get_example_index():
+    """
+    Returns the retrieval index over the few-shot examples, building it on first use.
+    """
+    global _example_index
+    with _nl_lock:
+        if _example_index is None:
+            # Index the examples so each prompt only carries the ones relevant to the question
+            _example_index = ExampleIndex(get_few_shot_examples())
+        return _example_index
+
+
+def get_prompt_fingerprint():
+    """
+    Identifies the prompt (template, schema text, few-shot example library) and model that
+    produce pipelines, so editing any of them invalidates the NL pipeline cache.
+    """
+    global _prompt_fingerprint
+    with _nl_lock:
+        if _prompt_fingerprint is None:
+            _prompt_fingerprint = hashlib.sha256(
+                f"{LLM_MODEL_NAME}\n{LLM_TEMPERATURE}\n{FEW_SHOT_TOP_K}\n{get_prompt_template()}\n"
+                f"{json.dumps(get_few_shot_examples(), sort_keys=True)}".encode('utf-8')
+            ).hexdigest()
+        return _prompt_fingerprint
+
+
+def get_llmchain():
+    """
+    Returns the LLMChain used to generate pipelines, initializing it on first use.
+    Returns None if the model or chain could not be initialized; initialization is
+    retried on a later call, once LLM_INIT_RETRY_SECONDS have passed since the failure.
+    """
+    global _llmchain, _llmchain_loaded, _llmchain_failed_at
+    with _nl_lock:
+        if _llmchain_loaded:
+            return _llmchain
+        if _llmchain_failed_at is not None and time.monotonic() - _llmchain_failed_at < LLM_INIT_RETRY_SECONDS:
+            return None
 
-# Initialize the Language Model
-try:
-    llm = OllamaLLM(model="codellama", temperature=0.2)  # Ensure 'codellama' is the correct model name
-    logger.info("Initialized OllamaLLM with CodeLlama model successfully.")
-except Exception as e:
-    logger.error(f"Failed to initialize OllamaLLM: {e}")
-    print(f"Failed to initialize OllamaLLM: {e}")
-    exit(1)
-
-# Initialize the LLMChain
-try:
-    llmchain = LLMChain(llm=llm, prompt=query_creation_prompt, verbose=True)
-    logger.info("Initialized LLMChain successfully.")
-except Exception as e:
-    logger.error(f"Failed to initialize LLMChain: {e}")
-    print(f"Failed to initialize LLMChain: {e}")
-    exit(1)
+        llmchain = build_llmchain()
+        if llmchain is None:
+            _llmchain_failed_at = time.monotonic()
+            return None
+        _llmchain = llmchain
+        _llmchain_loaded = True
+        _llmchain_failed_at = None
+        return _llmchain
+
+
+def build_llmchain():
+    """
+    Builds the LLMChain used to generate pipelines. Returns None if the model or chain
+    could not be initialized.
+    """
+    try:
+        from langchain_ollama import OllamaLLM
+        from langchain.prompts import PromptTemplate
+        from langchain.chains import LLMChain  # Corrected import
+    except ImportError as e:
+        logger.error(f"Failed to import the LLM libraries: {e}")
+        return None
+
+    query_creation_prompt = PromptTemplate(
+        input_variables=["user_question", "examples"],
+        template=get_prompt_template(),
+    )
+
+    # Initialize the Language Model
+    try:
+        llm = OllamaLLM(model=LLM_MODEL_NAME, temperature=LLM_TEMPERATURE)  # Ensure 'codellama' is the correct model name
+        logger.info("Initialized OllamaLLM with CodeLlama model successfully.")
+    except Exception as e:
+        logger.error(f"Failed to initialize OllamaLLM: {e}")
+        return None
+
+    # Initialize the LLMChain
+    try:
+        llmchain = LLMChain(llm=llm, prompt=query_creation_prompt, verbose=True)
+        logger.info("Initialized LLMChain successfully.")
+    except Exception as e:
+        logger.error(f"Failed to initialize LLMChain: {e}")
+        return None
+    return llmchain
+
+
+def warm_up_nl_subsystem(load_model=False):
+    """
+    Loads the few-shot examples, retrieval index and LLM chain ahead of the first request.
+    With load_model, also sends a trivial prompt so Ollama loads the model weights.
+    """
+    start = time.perf_counter()
+    get_example_index()
+    get_prompt_fingerprint()
+    llmchain = get_llmchain()
+    if load_model and llmchain is not None:
+        try:
+            llmchain.llm.invoke("ping")
+        except Exception as e:
+            logger.warning(f"Model warm-up request failed: {e}")
+    logger.info(f"NL subsystem warmed up in {time.perf_counter() - start:.2f}s.")
+
+
+def start_nl_warm_up():
+    """
+    Warm-up hook for server entry points: when settings.NL_WARM_UP is set, warms the NL
+    subsystem in a background thread so worker start-up is not blocked.
+    """
+    if settings.NL_WARM_UP:
+        threading.Thread(target=warm_up_nl_subsystem, kwargs={'load_model': True},
+                         name='nl-warm-up', daemon=True).start()
 
 # ------------------------------------------------------------------------
 
@@ -796,24 +1306,132 @@ def strip_keys(obj):
         return obj
 
 
-def generate_pipeline(user_question):
+def normalize_question(user_question):
+    """
+    Normalizes a natural language question for cache lookups by collapsing whitespace.
+    Case is kept, since quoted values such as genus names are case-sensitive in queries.
+    """
+    return ' '.join(user_question.split())
+
+
+def nl_cache_key(user_question):
+    """
+    Returns the NL pipeline cache key for a question under the current prompt and model.
+    """
+    return hashlib.sha256(f"{get_prompt_fingerprint()}\n{normalize_question(user_question)}".encode('utf-8')).hexdigest()
+
+
+def get_cached_pipeline(user_question):
+    """
+    Returns the previously generated output for this question, or None if there is none.
+    """
+    try:
+        cached = get_db()[NL_CACHE_COLLECTION].find_one({'_id': nl_cache_key(user_question)},
+                                                        max_time_ms=settings.QUERY_LOOKUP_MAX_TIME_MS)
+    except Exception as e:
+        logger.warning(f"NL pipeline cache lookup failed: {e}")
+        return None
+    if cached:
+        logger.debug("Serving pipeline from the NL pipeline cache.")
+        return json_backend.loads(cached['output'])
+    return None
+
+
+def store_cached_pipeline(user_question, output):
+    """
+    Persists a validated model output for this question in the NL pipeline cache.
+    The first store in a process also purges entries left over from older prompts.
+    """
+    global _pipeline_cache_purged
+    if not _pipeline_cache_purged:
+        _pipeline_cache_purged = True
+        purge_stale_pipeline_cache()
+    try:
+        get_db()[NL_CACHE_COLLECTION].update_one(
+            {'_id': nl_cache_key(user_question)},
+            {'$set': {
+                'question': normalize_question(user_question),
+                'prompt_fingerprint': get_prompt_fingerprint(),
+                'model': LLM_MODEL_NAME,
+                'output': json_backend.dumps(output),  # Stored as text: pipeline stages have $-prefixed keys
+                'created_at': datetime.utcnow()
+            }},
+            upsert=True
+        )
+    except Exception as e:
+        logger.warning(f"Failed to store pipeline in the NL pipeline cache: {e}")
+
+
+_pipeline_cache_purged = False
+
+
+def purge_stale_pipeline_cache():
+    """
+    Deletes cached pipelines generated with a different prompt or model.
+    """
+    try:
+        result = get_db()[NL_CACHE_COLLECTION].delete_many({'prompt_fingerprint': {'$ne': get_prompt_fingerprint()}})
+        if result.deleted_count:
+            logger.info(f"Purged {result.deleted_count} stale entries from the NL pipeline cache.")
+    except Exception as e:
+        logger.warning(f"Failed to purge the NL pipeline cache: {e}")
+
+
+def generate_pipeline(user_question, on_token=None):
     """
     Generates a MongoDB aggregation pipeline based on the user's natural language question.
+    Questions answered before under the same prompt and model are served from the
+    persistent NL pipeline cache without calling the model.
 
     Parameters:
         user_question (str): The natural language question.
+        on_token (callable): Optional callback receiving each chunk of the model response as it streams.
 
     Returns:
         dict: A dictionary containing the 'collection' and 'pipeline' as returned by the model.
     """
+    cached_output = get_cached_pipeline(user_question)
+    if cached_output is not None:
+        return cached_output
+
+    output = generate_pipeline_uncached(user_question, on_token)
+    if output is not None:
+        store_cached_pipeline(user_question, output)
+    return output
+
+
+def generate_pipeline_uncached(user_question, on_token=None):
+    """
+    Asks the model for a pipeline answering the question and validates its output.
+
+    Parameters:
+        user_question (str): The natural language question.
+        on_token (callable): Optional callback receiving each chunk of the model response as it streams.
+
+    Returns:
+        dict: A dictionary containing the 'collection' and 'pipeline', or None if generation failed.
+    """
+    llmchain = get_llmchain()
     if not llmchain:
         logger.error("LLMChain is not initialized.")
         return None
 
     response = None  # Initialize response to avoid UnboundLocalError
     try:
-        # Send the user question to the LLMChain
-        response = llmchain.run({"user_question": user_question})
+        inputs = {
+            "user_question": user_question,
+            "examples": select_few_shot_examples(user_question)
+        }
+        if on_token is None:
+            # Send the user question to the LLMChain
+            response = llmchain.run(inputs)
+        else:
+            # Stream the response so partial output can be reported while the model runs
+            chunks = []
+            for chunk in llmchain.llm.stream(llmchain.prompt.format(**inputs)):
+                chunks.append(chunk)
+                on_token(chunk)
+            response = ''.join(chunks)
 
         # Log the raw response for debugging
         logger.debug("Raw response from model:")
@@ -841,7 +1459,7 @@ def generate_pipeline(user_question):
         logger.debug(f"JSON after regex replacement: {cleaned_response}")
 
         # Parse the JSON response
-        output = json.loads(cleaned_response)
+        output = json_backend.loads(cleaned_response)
         logger.debug(f"Parsed output: {output}")
 
         # Validate the output
@@ -892,52 +1510,202 @@ def generate_pipeline(user_question):
 
 # -------------------- Define Views --------------------
 
+def get_job_owner(request):
+    """
+    Identifies who an NL job belongs to, for per-user concurrency limits:
+    the logged-in user, else the session, else the client address.
+    """
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    if not request.session.session_key:
+        request.session.save()
+    if request.session.session_key:
+        return f"session:{request.session.session_key}"
+    return f"ip:{client_ip(request) or request.META.get('REMOTE_ADDR', '')}"
+
+
 @csrf_protect  # Use this decorator to enable CSRF protection
 def natural_language_query(request):
+    """
+    The query wizard. A posted question is answered from the NL pipeline cache when it can be;
+    otherwise it is queued as a background job and the browser is redirected to ?job=<job ID>,
+    which shows the job's progress and renders its result once done. No request waits for the model.
+    """
     if request.method == 'POST':
         natural_language_query = request.POST.get('natural_language_query', '').strip()
 
         logger.debug(f"Received Natural Language Query: {natural_language_query}")
 
-        # Generate the pipeline using the LLM
-        output = generate_pipeline(natural_language_query)
-
-        if output:
-            json_query_str = json.dumps(output['pipeline'], indent=4)
-            target_collection = output['collection']
-
-            context = {
-                'natural_language_query': natural_language_query,
-                'json_query': json_query_str,
-                'target_collection': target_collection,
-                'error': '',
-                'raw_response': output  # Include the raw output from the LLM
-            }
+        output = get_cached_pipeline(natural_language_query)
+        if output is not None:
+            return render_nl_result(request, natural_language_query, output)
 
-            logger.debug("Rendering natural_language_query.html with generated pipeline.")
-            return render(request, 'natural_language_query.html', context)
-        else:
-            error = "Failed to generate a valid pipeline. Please check your query and try again."
-            logger.error(error)
-            context = {
-                'natural_language_query': natural_language_query,
-                'json_query': '',
-                'target_collection': '',
-                'error': error,
-                'raw_response': ''  # Provide a default value to prevent template errors
-            }
-            return render(request, 'natural_language_query.html', context)
-    else:
-        # For GET requests, display an empty form
+        # Generate the pipeline using the LLM, on the bounded NL job pool
+        try:
+            job = nl_job_queue.submit(get_job_owner(request), natural_language_query, generate_pipeline)
+        except TooManyJobs as e:
+            return render_nl_result(request, natural_language_query, None, str(e))
+        logger.debug(f"Queued NL job {job['job_id']} for: {natural_language_query}")
+        return redirect(f"{reverse('natural_language_query')}?job={job['job_id']}")
+
+    job_id = request.GET.get('job', '').strip()
+    if job_id:
+        job = nl_job_queue.get(job_id, get_job_owner(request))
+        if job is None:
+            return render_nl_result(request, '', None, "Query generation job not found.")
+        if job_finished(job):
+            # The pipeline the job generated, without asking the model again
+            return render_nl_result(request, job['question'], job['output'], job['error'])
+        # Still running: the page follows the job and reloads itself once it is done
         context = {
-            'natural_language_query': '',
+            'natural_language_query': job['question'],
             'json_query': '',
             'target_collection': '',
             'error': '',
-            'raw_response': ''  # Provide a default value
+            'raw_response': '',
+            'job_id': job_id,
         }
         return render(request, 'natural_language_query.html', context)
 
+    # For GET requests, display an empty form
+    context = {
+        'natural_language_query': '',
+        'json_query': '',
+        'target_collection': '',
+        'error': '',
+        'raw_response': ''  # Provide a default value
+    }
+    return render(request, 'natural_language_query.html', context)
+
+
+def render_nl_result(request, natural_language_query, output, error=''):
+    """
+    Renders the query wizard with a generated pipeline (pre-flighted so expensive ones are
+    flagged before they are run) or, when output is None, the error.
+    """
+    if output:
+        json_query_str = json.dumps(output['pipeline'], indent=4)
+        target_collection = output['collection']
+
+        try:
+            warning = check_query_cost_once(get_db(), target_collection, output['pipeline'])
+            error = ''
+        except QueryRejected as e:
+            warning = ''
+            error = str(e)
+
+        context = {
+            'natural_language_query': natural_language_query,
+            'json_query': json_query_str,
+            'target_collection': target_collection,
+            'error': error,
+            'warning': warning,
+            'raw_response': output  # Include the raw output from the LLM
+        }
+
+        logger.debug("Rendering natural_language_query.html with generated pipeline.")
+        return render(request, 'natural_language_query.html', context)
+
+    error = error or FAILED_ERROR
+    logger.error(error)
+    context = {
+        'natural_language_query': natural_language_query,
+        'json_query': '',
+        'target_collection': '',
+        'error': error,
+        'raw_response': ''  # Provide a default value to prevent template errors
+    }
+    return render(request, 'natural_language_query.html', context)
+
+
+@csrf_protect
+def submit_nl_job(request):
+    """
+    Queues pipeline generation for a natural language question and returns the job ID.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method.'}, status=405)
+
+    natural_language_query = request.POST.get('natural_language_query', '').strip()
+    if not natural_language_query:
+        return JsonResponse({'error': 'Missing natural_language_query.'}, status=400)
+
+    try:
+        job = nl_job_queue.submit(get_job_owner(request), natural_language_query, generate_pipeline)
+    except TooManyJobs as e:
+        return JsonResponse({'error': str(e)}, status=429)
+
+    logger.debug(f"Queued NL job {job['job_id']} for: {natural_language_query}")
+    return JsonResponse({'job_id': job['job_id'], 'status': job['status']}, status=202)
+
+
+def nl_job_status(request, job_id):
+    """
+    Returns the status, partial model response and, once done, the generated query of an NL job.
+    """
+    job = nl_job_queue.get(job_id, get_job_owner(request))
+    if job is None:
+        return JsonResponse({'error': 'Job not found.'}, status=404)
+    return JsonResponse(nl_job_payload(job))
+
+
+def nl_job_stream(request, job_id):
+    """
+    Streams an NL job's progress as server-sent events: one 'token' event per model chunk,
+    then a final 'done' or 'failed' event with the same payload as nl_job_status.
+
+    The response only carries the events available now, then asks the browser to reconnect
+    after NL_JOB_STREAM_RETRY_MS; EventSource resumes from the Last-Event-ID it was sent. So
+    no worker thread is held while the model runs. Clients close the stream on the final
+    event. Under ASGI, async_views.nl_job_stream keeps one connection open instead.
+    """
+    job = nl_job_queue.get(job_id, get_job_owner(request))
+    if job is None:
+        return JsonResponse({'error': 'Job not found.'}, status=404)
+
+    body = ''.join(nl_job_events(job, last_event_id(request)))
+    if not job_finished(job):
+        body += f"retry: {NL_JOB_STREAM_RETRY_MS}\n\n"
+    response = HttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def last_event_id(request):
+    """
+    Returns the number of NL job tokens a reconnecting event stream client already received.
+    """
+    try:
+        return max(int(request.headers.get('Last-Event-ID', 0)), 0)
+    except ValueError:
+        return 0
+
+
+def nl_job_events(job, sent):
+    """
+    Yields the server-sent events for an NL job's tokens after the first sent ones, each with
+    its token count as event ID, then the final event once the job has finished.
+    """
+    for count, token in enumerate(job['tokens'][sent:], start=sent + 1):
+        yield f"id: {count}\nevent: token\ndata: {json_backend.dumps(token)}\n\n"
+    if job_finished(job):
+        yield f"event: {job['status']}\ndata: {json_backend.dumps(nl_job_payload(job))}\n\n"
+
+
+def nl_job_payload(job):
+    """
+    Builds the JSON payload describing an NL job.
+    """
+    output = job['output']
+    return {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'partial_response': ''.join(job['tokens']),
+        'error': job['error'],
+        'json_query': json.dumps(output['pipeline'], indent=4) if output else '',
+        'target_collection': output['collection'] if output else '',
+    }
+
 
 
 def home_view(request):
@@ -956,10 +1724,13 @@ def premade_queries(request):
         premade_queries_cursor = queries_collection.find({
             'is_premade': True,
             'natural_language_query': {'$regex': search_query, '$options': 'i'}
-        })
+        }, max_time_ms=settings.QUERY_LOOKUP_MAX_TIME_MS)
     else:
-        premade_queries_cursor = queries_collection.find({'is_premade': True})
+        premade_queries_cursor = queries_collection.find({'is_premade': True},
+                                                         max_time_ms=settings.QUERY_LOOKUP_MAX_TIME_MS)
 
+    # Premade queries written for embedded sequences find nothing in sequence fields under blob storage
+    blob_storage = uses_blob_sequence_storage()
     premade_queries = []
     for q in premade_queries_cursor:
         premade_queries.append({
@@ -967,7 +1738,8 @@ def premade_queries(request):
             'natural_language_query': (q['natural_language_query'][:MAX_QUERY_LENGTH] 
                                         if 'natural_language_query' in q else ''),
             'json_query': json.dumps(q['json_query'], indent=4),  # Proper formatting with indentation
-            'target_collection': q.get('target_collection')  # Include only if set
+            'target_collection': q.get('target_collection'),  # Include only if set
+            'uses_inline_sequences': blob_storage and references_inline_sequences(q['json_query'])
         })
 
     context = {
@@ -999,7 +1771,7 @@ def save_queries(request):
 
         # Parse JSON query string
         try:
-            json_query = json.loads(json_query_str)
+            json_query = json_backend.loads(json_query_str)
             logger.debug("JSON query successfully parsed.")
         except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON query: {e}")
@@ -1054,18 +1826,225 @@ def save_queries(request):
 def save_success(request):
     return render(request, 'save_success.html')
 
+def get_build_generation(db):
+    """
+    Returns the build generation recorded by database_build.py, so cached results
+    can be dropped after a rebuild. Re-read at most every BUILD_GENERATION_CHECK_SECONDS.
+    """
+    global _build_generation
+    generation, checked_at = _build_generation
+    now = time.monotonic()
+    if now - checked_at >= BUILD_GENERATION_CHECK_SECONDS:
+        try:
+            build_info = db['build_info'].find_one({'_id': 'build'}) or {}
+            generation = build_info.get('generation')
+        except Exception as e:
+            logger.warning(f"Could not read the build generation: {e}")
+        _build_generation = (generation, now)
+    return generation
+
+def check_query_cost_once(db, target_collection, json_query):
+    """
+    Runs the query_guard pre-flight (see check_query_cost) once per query and build generation.
+    The verdict, a warning or a rejection, is kept in the query result cache, so later pages and
+    the CSV export of the same query do not explain and count it again.
+
+    Raises:
+        QueryRejected: If the query is over the scan budget.
+    """
+    # No display limit or page token: the entry holds the verdict, not a page
+    cache_key = query_result_cache.make_key(target_collection, json_query, None, 'preflight')
+    generation = get_build_generation(db)
+    verdict = query_result_cache.get(cache_key, generation)
+    if verdict is None:
+        try:
+            verdict = {'warning': check_query_cost(db, target_collection, json_query)}
+        except QueryRejected as e:
+            verdict = {'rejected': str(e)}
+        query_result_cache.set(cache_key, verdict, generation)
+    if 'rejected' in verdict:
+        raise QueryRejected(verdict['rejected'])
+    return verdict['warning']
+
+def run_display_query(db, target_collection, json_query, page_token=''):
+    """
+    Runs a find query or aggregation pipeline for display and returns one page of
+    DISPLAY_LIMIT documents, converted, truncated and flattened. Pages are fetched by
+    _id range when the query allows it, in _id order, otherwise with $skip; see pagination.py.
+    Results are served from the query result cache when the same page was fetched recently.
+
+    Returns:
+        dict: 'results', 'page_number', 'next_page_token' and 'previous_page_token' (empty
+        when there is no such page) and the query cost 'warning'.
+
+    Raises:
+        QueryRejected: If the query is over the scan budget (see query_guard.py).
+        ValueError: If page_token is invalid or was issued for another query.
+    """
+    cache_key = query_result_cache.make_key(target_collection, json_query, DISPLAY_LIMIT, page_token)
+    generation = get_build_generation(db)
+    cached_page = query_result_cache.get(cache_key, generation)
+    if cached_page is not None:
+        logger.debug(f"Serving query on {target_collection} from the result cache.")
+        return cached_page
+
+    query_key = page_token_key(target_collection, json_query)
+    state = decode_page_token(page_token, query_key) if page_token else first_page_state(json_query)
+    # Raises QueryRejected when the query is over the scan budget
+    with span('preflight'):
+        warning = check_query_cost_once(db, target_collection, json_query)
+
+    # Sequence fields are cut to MAX_FIELD_LENGTH on the server instead of after transfer
+    truncation = truncation_stage(json_query, MAX_FIELD_LENGTH)
+    collection = db[target_collection]
+    if isinstance(json_query, list):
+        logger.debug(f"Executing aggregation pipeline on collection: {target_collection} (page {state['page']})")
+        results_cursor = collection.aggregate(page_pipeline(json_query, state, DISPLAY_LIMIT) + [truncation],
+                                              maxTimeMS=settings.QUERY_MAX_TIME_MS,
+                                              **disk_use_option(settings.QUERY_ALLOW_DISK_USE))
+    elif uses_find_only_operators(json_query):
+        logger.debug(f"Executing find query on collection: {target_collection} with query: {json_query} (page {state['page']})")
+        results_cursor = collection.find(page_filter(json_query, state),
+                                         max_time_ms=settings.QUERY_MAX_TIME_MS,
+                                         allow_disk_use=settings.QUERY_ALLOW_DISK_USE).sort('_id', 1).limit(DISPLAY_LIMIT + 1)
+    else:
+        logger.debug(f"Executing find query as a pipeline on collection: {target_collection} with query: {json_query} (page {state['page']})")
+        results_cursor = collection.aggregate([
+            {'$match': page_filter(json_query, state)},
+            {'$sort': {'_id': 1}},
+            {'$limit': DISPLAY_LIMIT + 1},
+            truncation,
+        ], maxTimeMS=settings.QUERY_MAX_TIME_MS, **disk_use_option(settings.QUERY_ALLOW_DISK_USE))
+
+    with span('fetch'):
+        results = list(results_cursor)
+        add_display_sequences(db, results)
+    add_count('documents', len(results))
+    page = make_display_page(results, state, query_key, warning)
+
+    query_result_cache.set(cache_key, page, generation)
+    return page
+
+def disk_use_option(allow_disk_use):
+    """
+    Returns the allowDiskUse aggregate option for a setting, or no option for None so the
+    server default applies.
+    """
+    if allow_disk_use is None:
+        return {}
+    return {'allowDiskUse': allow_disk_use}
+
+def add_display_sequences(db, results):
+    """
+    For databases built with blob sequence storage, adds the first MAX_FIELD_LENGTH characters
+    of each referenced sequence to the results, decoding only that prefix of each blob.
+    """
+    refs = sequence_store.collect_sequence_refs(results)
+    if refs:
+        blobs = db[sequence_store.SEQUENCES_COLLECTION].find({'_id': {'$in': refs}},
+                                                            max_time_ms=settings.QUERY_LOOKUP_MAX_TIME_MS)
+        sequence_store.add_sequence_prefixes(results, blobs, MAX_FIELD_LENGTH)
+
+def make_display_page(results, state, query_key, warning=''):
+    """
+    Builds the page returned by run_display_query from the raw results (up to DISPLAY_LIMIT + 1
+    documents) fetched for the page state, the page token key of the query and the query cost warning.
+    """
+    next_state = next_page_state(state, results, DISPLAY_LIMIT)
+    previous_state = previous_page_state(state, DISPLAY_LIMIT)
+    return {
+        'results': format_display_results(results[:DISPLAY_LIMIT]),
+        'page_number': state['page'],
+        'next_page_token': encode_page_token(next_state, query_key) if next_state else '',
+        'previous_page_token': encode_page_token(previous_state, query_key) if previous_state else '',
+        'warning': warning,
+    }
+
+def format_display_results(results):
+    """
+    Converts ObjectIds to strings, truncates string fields and flattens the documents for display.
+    """
+    with span('format_results'):
+        return [flatten_display_document(result, MAX_FIELD_LENGTH) for result in results]
+
+def sequence_fasta(request, sequence_ref):
+    """
+    Returns one full sequence from the sequences collection as FASTA. Databases built with
+    --sequence-storage blob only keep a '<field>_ref' in plasmid and gene documents, so
+    sequences are fetched and decompressed only when requested here.
+    """
+    if not ObjectId.is_valid(sequence_ref):
+        return HttpResponse("Invalid sequence reference.", content_type='text/plain', status=404)
+
+    sequences = sequence_store.fetch_sequences(get_db(), [ObjectId(sequence_ref)],
+                                               max_time_ms=settings.QUERY_LOOKUP_MAX_TIME_MS)
+    if not sequences:
+        return HttpResponse("Sequence not found.", content_type='text/plain', status=404)
+
+    name, field, sequence = sequences[ObjectId(sequence_ref)]
+    lines = [f">{name} {field}"] + [sequence[i:i + FASTA_LINE_WIDTH] for i in range(0, len(sequence), FASTA_LINE_WIDTH)]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain')
+
+def client_ip(request):
+    """
+    Returns the client address, read from X-Forwarded-For when the request comes from one of
+    settings.TRUSTED_PROXY_IPS: the last forwarded address not itself a trusted proxy.
+    Returns None for forwarded requests from any other address, whose client is unknown.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR', '')
+    forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if forwarded_for is None:
+        return remote_addr
+    if remote_addr not in settings.TRUSTED_PROXY_IPS:
+        return None
+    for address in reversed([address.strip() for address in forwarded_for.split(',')]):
+        if address not in settings.TRUSTED_PROXY_IPS:
+            return address
+    return remote_addr
+
+def metrics_access_allowed(request):
+    """
+    Whether the client may read the operational endpoints (/metrics/ and the cache counters):
+    it sends the settings.METRICS_TOKEN bearer token, or its address is in settings.METRICS_ALLOWED_IPS.
+    """
+    if settings.METRICS_TOKEN:
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if hmac.compare_digest(authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()):
+            return True
+    return client_ip(request) in settings.METRICS_ALLOWED_IPS
+
+def metrics(request):
+    """
+    Returns the request, stage and MongoDB command metrics in the Prometheus text format.
+    Only served to the clients allowed by metrics_access_allowed.
+    """
+    if not metrics_access_allowed(request):
+        return HttpResponse(status=404)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def query_cache_stats(request):
+    """
+    Returns the query result cache counters as JSON.
+    Only served to the clients allowed by metrics_access_allowed.
+    """
+    if not metrics_access_allowed(request):
+        return HttpResponse(status=404)
+    return JsonResponse(query_result_cache.stats())
+
 def execute_query(request):
     if request.method == 'POST':
         json_query_str = request.POST.get('json_query', '').strip()
         natural_language_query = request.POST.get('natural_language_query', '').strip()
         target_collection = request.POST.get('target_collection', '').strip()
+        page_token = request.POST.get('page_token', '').strip()
 
         logger.debug(f"Received JSON Query String: {json_query_str}")
         logger.debug(f"Natural Language Query: {natural_language_query}")
         logger.debug(f"Target Collection: {target_collection}")
 
         try:
-            json_query = json.loads(json_query_str)
+            with span('parse_json'):
+                json_query = json_backend.loads(json_query_str)
             logger.debug(f"Parsed JSON Query: {json_query}")
         except json.JSONDecodeError as e:
             error = f'Invalid JSON query format: {str(e)}'
@@ -1093,16 +2072,6 @@ def execute_query(request):
                         'results': [],
                         'target_collection': target_collection
                     })
-                collection = db[target_collection]
-                logger.debug(f"Executing aggregation pipeline on collection: {target_collection}")
-                
-                # Remove existing $limit stages if any to control pagination separately
-                json_query_cleaned = [stage for stage in json_query if not ('$limit' in stage)]
-                
-                # Append $limit for display
-                json_query_display = json_query_cleaned + [{"$limit": DISPLAY_LIMIT}]
-                
-                results_cursor = collection.aggregate(json_query_display)
             else:
                 if not target_collection:
                     error = 'Target collection must be specified for single-field queries.'
@@ -1114,19 +2083,11 @@ def execute_query(request):
                         'results': [],
                         'target_collection': target_collection
                     })
-                collection = db[target_collection]
-                logger.debug(f"Executing find query on collection: {target_collection} with query: {json_query}")
-                results_cursor = collection.find(json_query).limit(DISPLAY_LIMIT)
-
-            results = list(results_cursor)
 
-            # Convert ObjectId to string and truncate string fields
-            truncated_results = [truncate_string_fields(convert_objectids(result), MAX_FIELD_LENGTH) for result in results]
+            page = run_display_query(db, target_collection, json_query, page_token)
+            flattened_results = page['results']
 
-            # Flatten the results for display
-            flattened_results = [flatten_dict(result) for result in truncated_results]
-
-            logger.debug(f"Query returned {len(flattened_results)} results (showing first {DISPLAY_LIMIT}): {flattened_results[:3]}")
+            logger.debug(f"Query returned {len(flattened_results)} results (page {page['page_number']}): {flattened_results[:3]}")
 
             if not flattened_results:
                 error = 'No results found.'
@@ -1139,6 +2100,17 @@ def execute_query(request):
                 'target_collection': target_collection
             }
 
+        except QueryRejected as e:
+            error = str(e)
+            logger.warning(f"Query Rejected: {e}")
+            return render(request, 'query_result.html', {
+                'error': error,
+                'json_query': json_query_str,
+                'natural_language_query': natural_language_query,
+                'results': [],
+                'target_collection': target_collection
+            })
+
         except Exception as e:
             error = f"An error occurred while executing the query: {str(e)}"
             logger.error(f"Query Execution Error: {e}")
@@ -1155,9 +2127,14 @@ def execute_query(request):
             'json_query': json_query_str,
             'natural_language_query': natural_language_query,
             'error': error,
-            'target_collection': target_collection
+            'target_collection': target_collection,
+            'page_number': page['page_number'],
+            'next_page_token': page['next_page_token'],
+            'previous_page_token': page['previous_page_token'],
+            'warning': page['warning']
         }
-        return render(request, 'query_result.html', context)
+        with span('render'):
+            return render(request, 'query_result.html', context)
 
     return redirect('queries_home')
 
@@ -1166,13 +2143,15 @@ def new_query(request):
         natural_language_query = request.POST.get('natural_language_query', '').strip()
         json_query_str = request.POST.get('json_query', '').strip()
         target_collection = request.POST.get('target_collection', '').strip()
+        page_token = request.POST.get('page_token', '').strip()
 
         logger.debug(f"Received JSON Query String: {json_query_str}")
         logger.debug(f"Natural Language Query: {natural_language_query}")
         logger.debug(f"Target Collection: {target_collection}")
 
         try:
-            json_query = json.loads(json_query_str)
+            with span('parse_json'):
+                json_query = json_backend.loads(json_query_str)
             logger.debug(f"Parsed JSON Query: {json_query}")
         except json.JSONDecodeError as e:
             error = f'Invalid JSON query format: {str(e)}'
@@ -1198,16 +2177,6 @@ def new_query(request):
                         'json_query': json_query_str,
                         'results': []
                     })
-                collection = db[target_collection]
-                logger.debug(f"Executing aggregation pipeline on collection: {target_collection}")
-                
-                # Remove existing $limit stages if any to control pagination separately
-                json_query_cleaned = [stage for stage in json_query if not ('$limit' in stage)]
-                
-                # Append $limit for display
-                json_query_display = json_query_cleaned + [{"$limit": DISPLAY_LIMIT}]
-                
-                results_cursor = collection.aggregate(json_query_display)
             else:
                 if not target_collection:
                     error = 'Target collection must be specified for single-field queries.'
@@ -1218,19 +2187,11 @@ def new_query(request):
                         'json_query': json_query_str,
                         'results': []
                     })
-                collection = db[target_collection]
-                logger.debug(f"Executing find query on collection: {target_collection} with query: {json_query}")
-                results_cursor = collection.find(json_query).limit(DISPLAY_LIMIT)
 
-            results = list(results_cursor)
+            page = run_display_query(db, target_collection, json_query, page_token)
+            flattened_results = page['results']
 
-            # Convert ObjectId to string and truncate string fields
-            truncated_results = [truncate_string_fields(convert_objectids(result), MAX_FIELD_LENGTH) for result in results]
-
-            # Flatten the results for display
-            flattened_results = [flatten_dict(result) for result in truncated_results]
-
-            logger.debug(f"Query returned {len(flattened_results)} results (showing first {DISPLAY_LIMIT}): {flattened_results[:3]}")
+            logger.debug(f"Query returned {len(flattened_results)} results (page {page['page_number']}): {flattened_results[:3]}")
 
             if not flattened_results:
                 error = 'No results found.'
@@ -1243,6 +2204,16 @@ def new_query(request):
                 'target_collection': target_collection
             }
 
+        except QueryRejected as e:
+            error = str(e)
+            logger.warning(f"Query Rejected: {e}")
+            return render(request, 'new_query.html', {
+                'error': error,
+                'natural_language_query': natural_language_query,
+                'json_query': json_query_str,
+                'results': []
+            })
+
         except Exception as e:
             error = f"An error occurred while executing the query: {str(e)}"
             logger.error(f"Query Execution Error: {e}")
@@ -1258,9 +2229,14 @@ def new_query(request):
             'json_query': json_query_str,
             'natural_language_query': natural_language_query,
             'error': error,
-            'target_collection': target_collection
+            'target_collection': target_collection,
+            'page_number': page['page_number'],
+            'next_page_token': page['next_page_token'],
+            'previous_page_token': page['previous_page_token'],
+            'warning': page['warning']
         }
-        return render(request, 'query_result.html', context)
+        with span('render'):
+            return render(request, 'query_result.html', context)
 
     return render(request, 'new_query.html', {
         'error': '',
@@ -1287,7 +2263,7 @@ def download_csv(request):
     logger.debug(f"Downloading CSV for Query: {json_query_str} on Collection: {target_collection}")
 
     try:
-        json_query = json.loads(json_query_str)
+        json_query = json_backend.loads(json_query_str)
         logger.debug(f"Parsed JSON Query for CSV: {json_query}")
     except json.JSONDecodeError as e:
         error = f'Invalid JSON query format: {str(e)}'
@@ -1304,93 +2280,165 @@ def download_csv(request):
                 logger.error(error)
                 return HttpResponse(error, content_type='text/plain')
             collection = db[target_collection]
+            check_query_cost_once(db, target_collection, json_query)
             logger.debug(f"Executing aggregation pipeline on collection: {target_collection} for CSV download")
-            results_cursor = collection.aggregate(json_query)
+            results_cursor = collection.aggregate(json_query + [truncation_stage(json_query, MAX_FIELD_LENGTH)],
+                                                  batchSize=CSV_BATCH_SIZE,
+                                                  maxTimeMS=settings.QUERY_CSV_MAX_TIME_MS,
+                                                  allowDiskUse=settings.QUERY_CSV_ALLOW_DISK_USE)
         else:
             if not target_collection:
                 error = 'Target collection must be specified for single-field queries.'
                 logger.error(error)
                 return HttpResponse(error, content_type='text/plain')
             collection = db[target_collection]
+            check_query_cost_once(db, target_collection, json_query)
             logger.debug(f"Executing find query on collection: {target_collection} with query: {json_query}")
-            results_cursor = collection.find(json_query)
+            if uses_find_only_operators(json_query):
+                results_cursor = collection.find(json_query, max_time_ms=settings.QUERY_CSV_MAX_TIME_MS,
+                                                 allow_disk_use=settings.QUERY_CSV_ALLOW_DISK_USE).batch_size(CSV_BATCH_SIZE)
+            else:
+                # As a pipeline, so sequence fields are cut on the server
+                results_cursor = collection.aggregate([{'$match': json_query}, truncation_stage(json_query, MAX_FIELD_LENGTH)],
+                                                      batchSize=CSV_BATCH_SIZE,
+                                                      maxTimeMS=settings.QUERY_CSV_MAX_TIME_MS,
+                                                      allowDiskUse=settings.QUERY_CSV_ALLOW_DISK_USE)
 
-        results = list(results_cursor)
+        # Only the first documents are read up front, to discover the CSV header
+        rows = flatten_csv_documents(db, results_cursor)
+        first_results = list(itertools.islice(rows, CSV_HEADER_PROBE_DOCUMENTS))
 
-        if not results:
+        if not first_results:
             error_message = "No results found for the current query."
             logger.warning(error_message)
             return HttpResponse(error_message, content_type='text/plain')
 
-        # Convert all ObjectId instances to strings and flatten the results
-        flattened_results = [flatten_dict(truncate_string_fields(convert_objectids(result))) for result in results]
+        headers = list(dict.fromkeys(key for result in first_results for key in result))
 
-        # Create the HttpResponse object with CSV headers
-        response = HttpResponse(content_type='text/csv')
+        # Stream the rows as the cursor yields them instead of building the file in memory
+        response = StreamingHttpResponse(stream_csv_rows(headers, first_results, rows, results_cursor),
+                                         content_type='text/csv')
         timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
         response['Content-Disposition'] = f'attachment; filename="query_results_{timestamp}.csv"'
 
-        writer = csv.writer(response)
-
-        # Write CSV Header based on keys of the first result
-        headers = flattened_results[0].keys()
-        writer.writerow(headers)
-
-        # Write data rows
-        for result in flattened_results:
-            row = []
-            for key in headers:
-                value = result.get(key, '')
-                value = str(value)
-                row.append(value)
-            writer.writerow(row)
-
-        logger.info(f"CSV download successful with {len(results)} records.")
-
         # Do not clear the current_query from session to allow repeated downloads
         return response
 
+    except QueryRejected as e:
+        logger.warning(f"Query Rejected: {e}")
+        return HttpResponse(str(e), content_type='text/plain')
+
     except Exception as e:
         error = f"An error occurred while generating the CSV: {str(e)}"
         logger.error(f"CSV Generation Error: {e}")
         return HttpResponse(error, content_type='text/plain')
 
 
-def examples(request):
-    sample_queries = [
-        {
-            'natural_language': 'Find plasmids with mobilizable mobility.',
-            'json_query': '{"mobility": "mobilizable"}',
-            'collection': 'plasmids',
-            'difficulty': 20  
-        },
-        {
-            'natural_language': 'Find plasmids with size greater than 10000 bp.',
-            'json_query': '{"size": {"$gt": 10000}}',
-            'collection': 'plasmids',
-            'difficulty': 20  
-        },
-        {
-            'natural_language': 'Find the 10 most common resistance genes in Salmonella.',
-            'json_query': '[{"$lookup":{"from":"plasmids","localField":"plasmid_id","foreignField":"_id","as":"plasmid_info"}},{"$unwind":"$plasmid_info"},{"$lookup":{"from":"hosts","localField":"plasmid_info.host_id","foreignField":"_id","as":"host_info"}},{"$unwind":"$host_info"},{"$match":{"host_info.genus":"Salmonella","gene_name":{"$ne":null},"antibiotic_resistance":true}},{"$group":{"_id":"$resistance_info.gene_name","count":{"$sum":1}}},{"$sort":{"count":-1}},{"$limit":10}]',
-            'collection': 'genes',
-            'difficulty': 60
-        },
-        {
-            'natural_language': 'How many times do plasmids that include "IncQ" in the replicon type, but NOT a comma, appear in Escherichia?.',
-            'json_query': '[{ "$match": { "$and": [ { "replicon_type": { "$regex": "IncQ", "$options": "i" } }, { "replicon_type": { "$not": { "$regex": "," } } } ] } },'
-                          '{ "$lookup": { "from": "hosts", "localField": "host_id", "foreignField": "_id", "as": "host_info" } },'
-                          '{ "$unwind": "$host_info" },'
-                          '{ "$match": { "host_info.genus": "Escherichia" } },'
-                          '{ "$count": "num_plasmids_with_IncQ_and_no_comma_in_Escherichia" }]',
-            'collection': 'plasmids',
-            'difficulty': 90  
-        }
-    ]
+def csv_omitted_fields_message(probed_count, omitted_keys):
+    """
+    Warning for a CSV export that left out fields first seen after the documents the header was built from.
+    """
+    return (f"CSV export left out fields first seen after the first {probed_count} documents: "
+            f"{', '.join(map(str, omitted_keys))}")
 
+
+class Echo:
+    """
+    File-like object whose write() hands the value back, so csv.writer output can be streamed.
+    """
+    def write(self, value):
+        return value
+
+
+def flatten_csv_documents(db, results_cursor):
+    """
+    Yields the documents of a CSV export flattened as on the results page, reading the cursor
+    CSV_BATCH_SIZE documents at a time so the sequence prefixes of each batch (blob sequence
+    storage) are fetched with one query.
+    """
+    while True:
+        batch = list(itertools.islice(results_cursor, CSV_BATCH_SIZE))
+        if not batch:
+            return
+        add_display_sequences(db, batch)
+        for document in batch:
+            yield flatten_display_document(document)
+
+
+def stream_csv_rows(headers, first_results, rows, results_cursor):
+    """
+    Yields CSV lines: the header, the first rows (already read to build it), then the remaining
+    rows (see flatten_csv_documents), closing results_cursor at the end.
+    The header is sent before the rest of the cursor is read, so fields that only appear in later
+    documents are left out of the export; they are logged in a warning at the end.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+
+    record_count = 0
+    header_keys = set(headers)
+    omitted_keys = {}
+    try:
+        for result in first_results:
+            yield writer.writerow([str(result.get(key, '')) for key in headers])
+            record_count += 1
+        for result in rows:
+            omitted_keys.update(dict.fromkeys(key for key in result if key not in header_keys))
+            yield writer.writerow([str(result.get(key, '')) for key in headers])
+            record_count += 1
+        if omitted_keys:
+            logger.warning(csv_omitted_fields_message(len(first_results), omitted_keys))
+        logger.info(f"CSV download successful with {record_count} records.")
+    except Exception as e:
+        logger.error(f"CSV Generation Error after {record_count} records: {e}")
+        raise
+    finally:
+        results_cursor.close()
+
+
+# Example queries shown on the examples page
+SAMPLE_QUERIES = [
+    {
+        'natural_language': 'Find plasmids with mobilizable mobility.',
+        'json_query': '{"mobility": "mobilizable"}',
+        'collection': 'plasmids',
+        'difficulty': 20  
+    },
+    {
+        'natural_language': 'Find plasmids with size greater than 10000 bp.',
+        'json_query': '{"size": {"$gt": 10000}}',
+        'collection': 'plasmids',
+        'difficulty': 20  
+    },
+    {
+        'natural_language': 'Find the 10 most common resistance genes in Salmonella.',
+        'json_query': '[{"$lookup":{"from":"plasmids","localField":"plasmid_id","foreignField":"_id","as":"plasmid_info"}},{"$unwind":"$plasmid_info"},{"$lookup":{"from":"hosts","localField":"plasmid_info.host_id","foreignField":"_id","as":"host_info"}},{"$unwind":"$host_info"},{"$match":{"host_info.genus":"Salmonella","gene_name":{"$ne":null},"antibiotic_resistance":true}},{"$group":{"_id":"$resistance_info.gene_name","count":{"$sum":1}}},{"$sort":{"count":-1}},{"$limit":10}]',
+        'collection': 'genes',
+        'difficulty': 60
+    },
+    {
+        'natural_language': 'Find the 10 most common resistance genes in Salmonella, from the precomputed summary.',
+        'json_query': '[{"$match":{"genus":"Salmonella"}},{"$sort":{"gene_count":-1}},{"$limit":10}]',
+        'collection': 'resistance_genes_by_genus',
+        'difficulty': 30
+    },
+    {
+        'natural_language': 'How many times do plasmids that include "IncQ" in the replicon type, but NOT a comma, appear in Escherichia?.',
+        'json_query': '[{ "$match": { "$and": [ { "replicon_type": { "$regex": "IncQ", "$options": "i" } }, { "replicon_type": { "$not": { "$regex": "," } } } ] } },'
+                      '{ "$lookup": { "from": "hosts", "localField": "host_id", "foreignField": "_id", "as": "host_info" } },'
+                      '{ "$unwind": "$host_info" },'
+                      '{ "$match": { "host_info.genus": "Escherichia" } },'
+                      '{ "$count": "num_plasmids_with_IncQ_and_no_comma_in_Escherichia" }]',
+        'collection': 'plasmids',
+        'difficulty': 90  
+    }
+]
+
+
+def examples(request):
     # Truncate natural_language_query for display purposes only
     truncated_sample_queries = []
-    for query in sample_queries:
+    for query in SAMPLE_QUERIES:
         truncated_query = {
             'natural_language': (query['natural_language'][:MAX_QUERY_LENGTH] 
                                  if 'natural_language' in query else ''),
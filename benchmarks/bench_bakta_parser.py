@@ -0,0 +1,94 @@
+"""
+Benchmark the 'full' and 'streaming' Bakta parsers of database_build.parse_bakta_file.
+
+Builds multi-contig Bakta annotations by merging the per-plasmid files generated by
+synthetic_plsdb.py (all contig features in one features array, followed by the contig
+sequences, as Bakta writes them), checks that both parsers return the same genes, and
+reports for each the best wall time and the peak Python memory (tracemalloc) of parsing
+one file. The streaming parser needs ijson.
+
+Usage:
+    python benchmarks/bench_bakta_parser.py [--contigs 1 20 100] [--sequence-length 100000] [--repeat 3] [--seed 0]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database_build  # noqa: E402
+from synthetic_plsdb import generate_dataset  # noqa: E402
+
+
+def make_annotation(out_dir, contigs, sequence_length, seed):
+    """
+    Write one Bakta JSON annotation of `contigs` contigs and return its path.
+    """
+    dataset = generate_dataset(os.path.join(out_dir, f"input_{contigs}"), plasmids=contigs,
+                               genes_per_plasmid=max(1, sequence_length // 1000), sequence_length=sequence_length,
+                               seed=seed)
+    annotation = {'genome': {'genus': None, 'species': None}, 'stats': {}, 'features': [], 'sequences': []}
+    for path in sorted(glob.glob(os.path.join(dataset['bakta_folder'], '*', '*.json'))):
+        with open(path) as f:
+            data = json.load(f)
+        annotation['features'].extend(data['features'])
+        annotation['sequences'].extend(data['sequences'])
+    annotation['stats'] = {'size': sum(sequence['length'] for sequence in annotation['sequences']),
+                           'no_sequences': len(annotation['sequences'])}
+    annotation['run'] = {'start': '2024-01-01 00:00:00', 'duration': '1.00 min'}
+    annotation['version'] = {'bakta': '1.9.4', 'db': {'version': '5.1', 'type': 'full'}}
+    path = os.path.join(out_dir, f"annotation_{contigs}.json")
+    with open(path, 'w') as f:
+        json.dump(annotation, f)
+    return path
+
+
+def measure(path, bakta_parser, repeat):
+    """
+    Best wall time and peak traced memory of parsing the file with the given parser.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        database_build.parse_bakta_file(path, 'bench', bakta_parser)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    database_build.parse_bakta_file(path, 'bench', bakta_parser)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--contigs', type=int, nargs='+', default=[1, 20, 100])
+    parser.add_argument('--sequence-length', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if database_build.ijson is None:
+        sys.exit("The streaming parser needs ijson.")
+    logging.disable(logging.INFO)
+    print(f"{'contigs':>8} {'file (MB)':>10} {'genes':>7} {'full (ms)':>10} {'full peak (MB)':>15} "
+          f"{'streaming (ms)':>15} {'streaming peak (MB)':>20}")
+    with tempfile.TemporaryDirectory() as out_dir:
+        for contigs in args.contigs:
+            path = make_annotation(out_dir, contigs, args.sequence_length, args.seed)
+            full_genes = database_build.parse_bakta_file(path, 'bench', 'full')[1]
+            if database_build.parse_bakta_file(path, 'bench', 'streaming')[1] != full_genes:
+                sys.exit(f"Parsers disagree on {path}")
+
+            full_time, full_peak = measure(path, 'full', args.repeat)
+            streaming_time, streaming_peak = measure(path, 'streaming', args.repeat)
+            print(f"{contigs:>8} {os.path.getsize(path) / 1e6:>10.2f} {len(full_genes):>7} {full_time * 1e3:>10.1f} "
+                  f"{full_peak / 1e6:>15.1f} {streaming_time * 1e3:>15.1f} {streaming_peak / 1e6:>20.1f}")
+
+
+if __name__ == '__main__':
+    main()
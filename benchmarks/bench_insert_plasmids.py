@@ -0,0 +1,95 @@
+"""
+Benchmark the metadata join performed by database_build.insert_plasmids.
+
+Builds synthetic plasmid sequences and a PLSDB-shaped metadata DataFrame at
+1k, 10k and 50k plasmids and times insert_plasmids against a database stub
+that discards the documents, so only the parsing/join work is measured.
+With --compare-scan the previous per-plasmid boolean-mask lookup is timed too.
+
+Usage:
+    python benchmarks/bench_insert_plasmids.py [--sizes 1000 10000 50000] [--compare-scan]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database_build  # noqa: E402
+
+
+class _InsertResult:
+    def __init__(self, count):
+        self.inserted_ids = list(range(count))
+
+
+class _NullCollection:
+    def insert_many(self, documents):
+        return _InsertResult(len(documents))
+
+
+class _NullDatabase:
+    plasmids = _NullCollection()
+
+
+def make_inputs(size):
+    """
+    Build synthetic sequences, mobility data and metadata for `size` plasmids.
+    """
+    plasmid_ids = [f"NZ_CP{idx:06d}.1" for idx in range(size)]
+    plasmid_sequences = {plasmid_id: 'ACGT' * 25 for plasmid_id in plasmid_ids}
+    plasmid_mobility = {plasmid_id: {'mobility': 'conjugative', 'replicon_type': 'IncFII'} for plasmid_id in plasmid_ids}
+    metadata_df = pd.DataFrame({
+        'NUCCORE_ACC': plasmid_ids,
+        'Categorized_Environment': ['Animal Host'] * size,
+        'TAXONOMY_genus': ['Escherichia'] * size,
+        'TAXONOMY_species': ['Escherichia_coli'] * size,
+        'ASSEMBLY_Status': ['Complete Genome'] * size,
+        'ASSEMBLY_ACC': [f"GCF_{idx:09d}.1" for idx in range(size)],
+    })
+    return plasmid_sequences, plasmid_mobility, metadata_df
+
+
+def scan_lookup(plasmid_sequences, metadata_df):
+    """
+    Reference implementation of the previous per-plasmid DataFrame scan.
+    """
+    for plasmid_id in plasmid_sequences:
+        plasmid_metadata = metadata_df[metadata_df['NUCCORE_ACC'] == plasmid_id]
+        if not plasmid_metadata.empty:
+            plasmid_metadata['Categorized_Environment'].values[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--compare-scan', action='store_true')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    host_id_map = {'Escherichia Escherichia coli': 1}
+    environment_id_map = {'Animal Host': 1}
+
+    print(f"{'plasmids':>10} {'indexed (s)':>12} {'scan (s)':>10}")
+    for size in args.sizes:
+        plasmid_sequences, plasmid_mobility, metadata_df = make_inputs(size)
+
+        start = time.perf_counter()
+        database_build.insert_plasmids(plasmid_sequences, plasmid_mobility, metadata_df,
+                                       host_id_map, environment_id_map, _NullDatabase())
+        indexed = time.perf_counter() - start
+
+        scan = ''
+        if args.compare_scan:
+            start = time.perf_counter()
+            scan_lookup(plasmid_sequences, metadata_df)
+            scan = f"{time.perf_counter() - start:.3f}"
+
+        print(f"{size:>10} {indexed:>12.3f} {scan:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark the JSON backends of json_backend.py on Bakta annotation files and query pipelines.
+
+Generates Bakta JSON files with synthetic_plsdb.py at typical plasmid sizes (about one
+CDS per kb, so a 2 Mb megaplasmid gives a file of several MB) and times, per file, the
+standard library json.load, json_backend.load with each available backend and
+database_build.parse_bakta_file. Then times decoding and encoding the pipelines of
+few_shot_examples.json, as the web application does for user and model pipelines.
+
+Usage:
+    python benchmarks/bench_json_backend.py [--sizes 50000 300000 2000000] [--repeat 5] [--seed 0]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database_build  # noqa: E402
+import json_backend  # noqa: E402
+from synthetic_plsdb import generate_dataset  # noqa: E402
+
+FEW_SHOT_EXAMPLES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      'few_shot_examples.json')
+
+
+def best_time(function, repeat):
+    """
+    Best wall time of `repeat` calls of function.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def stdlib_load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def backend_load(path):
+    with open(path, 'rb') as f:
+        return json_backend.load(f)
+
+
+def available_backends():
+    return [name for name in json_backend.JSON_BACKENDS if name != 'orjson' or json_backend.orjson is not None]
+
+
+def bench_bakta(sizes, repeat, seed, out_dir):
+    backends = available_backends()
+    print(f"{'plasmid (bp)':>12} {'file (MB)':>10} {'json.load (ms)':>15} "
+          + ' '.join(f"{name + ' (ms)':>12}" for name in backends)
+          + f" {'parse_bakta_file (ms)':>22}")
+    for size in sizes:
+        dataset = generate_dataset(os.path.join(out_dir, str(size)), plasmids=1, genes_per_plasmid=max(1, size // 1000),
+                                   sequence_length=size, seed=seed)
+        path = glob.glob(os.path.join(dataset['bakta_folder'], '*', '*.json'))[0]
+        plasmid_id = os.path.basename(path)[:-len('.json')]
+        assert backend_load(path) == stdlib_load(path)
+
+        stdlib = best_time(lambda: stdlib_load(path), repeat)
+        backend_times = []
+        for name in backends:
+            json_backend.select_backend(name)
+            backend_times.append(best_time(lambda: backend_load(path), repeat))
+        json_backend.select_backend()
+        parse = best_time(lambda: database_build.parse_bakta_file(path, plasmid_id), repeat)
+
+        print(f"{size:>12} {os.path.getsize(path) / 1e6:>10.2f} {stdlib * 1e3:>15.2f} "
+              + ' '.join(f"{seconds * 1e3:>12.2f}" for seconds in backend_times)
+              + f" {parse * 1e3:>22.2f}")
+
+
+def bench_pipelines(repeat):
+    with open(FEW_SHOT_EXAMPLES_FILE, 'r', encoding='utf-8') as f:
+        pipelines = [example['output'] for example in json.load(f)]
+    texts = [json.dumps(pipeline) for pipeline in pipelines]
+    rounds = 1000
+
+    def decode():
+        for _ in range(rounds):
+            for text in texts:
+                json_backend.loads(text)
+
+    def encode():
+        for _ in range(rounds):
+            for pipeline in pipelines:
+                json_backend.dumps(pipeline)
+
+    print(f"\n{len(pipelines)} example pipelines, x{rounds}")
+    print(f"{'backend':>8} {'loads (us/pipeline)':>20} {'dumps (us/pipeline)':>20}")
+    for name in available_backends():
+        json_backend.select_backend(name)
+        count = rounds * len(pipelines)
+        print(f"{name:>8} {best_time(decode, repeat) / count * 1e6:>20.2f} "
+              f"{best_time(encode, repeat) / count * 1e6:>20.2f}")
+    json_backend.select_backend()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50000, 300000, 2000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as out_dir:
+        bench_bakta(args.sizes, args.repeat, args.seed, out_dir)
+    bench_pipelines(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
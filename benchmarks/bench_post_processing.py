@@ -0,0 +1,137 @@
+"""
+Benchmark the per-document post-processing of query results in the web application.
+
+Builds gene documents shaped like the results of the example queries (ObjectIds,
+full nucleotide and protein sequences, ResFinder hits, and optionally the joined
+plasmid as in the $lookup examples), checks that views.flatten_display_document
+gives exactly the output of the previous three passes
+(convert_objectids -> truncate_string_fields -> flatten_dict), then times both.
+
+Usage:
+    python benchmarks/bench_post_processing.py [--documents 10000] [--repeat 5] [--joined] [--seed 0]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from bson import ObjectId
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'Database_files'))
+from synthetic_plsdb import AMINO_ACIDS, PRODUCTS, RESISTANCE_GENES, random_sequence  # noqa: E402
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BasededatosPLS.settings')
+    import django
+    django.setup()
+
+
+def make_documents(count, joined=False, seed=0):
+    """
+    Build `count` gene documents; with joined, each carries its plasmid in a 'plasmid_info' array.
+    """
+    rng = np.random.default_rng(seed)
+    documents = []
+    for index in range(count):
+        aa_length = int(rng.integers(60, 500))
+        start = int(rng.integers(1, 100000))
+        plasmid_id = ObjectId()
+        document = {
+            '_id': ObjectId(),
+            'plasmid_id': plasmid_id,
+            'locus': f"P{index // 50:06d}_{index % 50 + 1:05d}",
+            'gene_id': f"NZ_CP{index // 50:06d}.1_{index % 50}",
+            'gene_name': f"gene{int(rng.integers(0, 2000))}" if rng.random() < 0.6 else None,
+            'product': PRODUCTS[int(rng.integers(0, len(PRODUCTS)))],
+            'start': start,
+            'stop': start + 3 * aa_length + 2,
+            'strand': '+' if rng.random() < 0.5 else '-',
+            'contig': f"NZ_CP{index // 50:06d}.1",
+            'nt_sequence': random_sequence(rng, 3 * aa_length + 3),
+            'aa_sequence': 'M' + random_sequence(rng, aa_length - 1, AMINO_ACIDS),
+            'antibiotic_resistance': False,
+            'resistance_info': {},
+        }
+        if rng.random() < 0.3:
+            gene, phenotype = RESISTANCE_GENES[int(rng.integers(0, len(RESISTANCE_GENES)))]
+            document['antibiotic_resistance'] = True
+            document['resistance_info'] = {
+                'gene_name': gene,
+                'resistance_to': phenotype.split(', '),
+                'identity': round(float(rng.uniform(90, 100)), 2),
+                'coverage': round(float(rng.uniform(80, 100)), 2),
+                'alignment_length': f"{3 * aa_length}/{3 * aa_length}",
+            }
+        if joined:
+            length = int(rng.integers(2000, 20000))
+            document['plasmid_info'] = [{
+                '_id': plasmid_id,
+                'plasmid_id': document['contig'],
+                'sequence': random_sequence(rng, length),
+                'length': length,
+                'host_id': int(rng.integers(1, 200)),
+                'environment_id': int(rng.integers(1, 20)),
+                'mobility': 'conjugative',
+                'replicon_type': ['IncFII', 'IncFIB'],
+            }]
+        documents.append(document)
+    return documents
+
+
+def best_time(function, documents, repeat):
+    """
+    Best wall time of `repeat` runs of function over all documents.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for document in documents:
+            function(document)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--joined', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    from miapBBDDpls.views import (  # noqa: E402
+        MAX_FIELD_LENGTH,
+        convert_objectids,
+        flatten_dict,
+        flatten_display_document,
+        truncate_string_fields,
+    )
+
+    def three_pass(document):
+        return flatten_dict(truncate_string_fields(convert_objectids(document), MAX_FIELD_LENGTH))
+
+    def single_pass(document):
+        return flatten_display_document(document, MAX_FIELD_LENGTH)
+
+    documents = make_documents(args.documents, args.joined, args.seed)
+    for document in documents:
+        expected = three_pass(document)
+        actual = single_pass(document)
+        if actual != expected or list(actual) != list(expected):
+            sys.exit(f"Output differs for document {document['_id']}:\n{expected}\n{actual}")
+
+    before = best_time(three_pass, documents, args.repeat)
+    after = best_time(single_pass, documents, args.repeat)
+    print(f"{'documents':>10} {'3 passes (us/doc)':>18} {'1 pass (us/doc)':>16} {'speedup':>8}")
+    print(f"{args.documents:>10} {before / args.documents * 1e6:>18.2f} {after / args.documents * 1e6:>16.2f} "
+          f"{before / after:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Load-test the query execution view under the WSGI and the ASGI deployment.
+
+Sends concurrent POSTs to /queries/execute/ and reports throughput and latency
+for each base URL given. Every request gets a no-op $match with a fresh value
+prepended, so the per-process query result cache never answers it and each
+request runs the aggregation on MongoDB.
+
+Start the two servers against the same database first, for example:
+
+    cd Database_files
+    gunicorn BasededatosPLS.wsgi -w 1 --threads 8 -b 127.0.0.1:8000
+    ASYNC_QUERY_VIEWS=1 uvicorn BasededatosPLS.asgi:application --workers 1 --port 8001
+
+Usage:
+    python benchmarks/load_test_query_views.py --wsgi-url http://127.0.0.1:8000 \\
+        --asgi-url http://127.0.0.1:8001 [--concurrency 8 32 128] [--requests 256]
+"""
+import argparse
+import http.cookiejar
+import json
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# The slowest of the examples page queries: two $lookups over the genes collection
+DEFAULT_COLLECTION = 'genes'
+DEFAULT_PIPELINE = [
+    {"$lookup": {"from": "plasmids", "localField": "plasmid_id", "foreignField": "_id", "as": "plasmid_info"}},
+    {"$unwind": "$plasmid_info"},
+    {"$lookup": {"from": "hosts", "localField": "plasmid_info.host_id", "foreignField": "_id", "as": "host_info"}},
+    {"$unwind": "$host_info"},
+    {"$match": {"host_info.genus": "Salmonella", "gene_name": {"$ne": None}, "antibiotic_resistance": True}},
+    {"$group": {"_id": "$resistance_info.gene_name", "count": {"$sum": 1}}},
+    {"$sort": {"count": -1}},
+]
+
+
+def make_opener(base_url):
+    """
+    Build a cookie-keeping opener and fetch the CSRF token from the new query page.
+    """
+    cookies = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+    opener.open(f"{base_url}/queries/new/").read()
+    csrf_token = next(cookie.value for cookie in cookies if cookie.name == 'csrftoken')
+    return opener, csrf_token
+
+
+def run_request(base_url, opener, csrf_token, collection, pipeline):
+    """
+    POST one uncached query and return (latency in seconds, succeeded).
+    """
+    nonce_stage = {"$match": {"_load_test_nonce": {"$ne": uuid.uuid4().hex}}}
+    body = urllib.parse.urlencode({
+        'json_query': json.dumps([nonce_stage] + pipeline),
+        'target_collection': collection,
+        'csrfmiddlewaretoken': csrf_token,
+    }).encode()
+    request = urllib.request.Request(f"{base_url}/queries/execute/", data=body,
+                                     headers={'Referer': f"{base_url}/queries/new/"})
+    start = time.perf_counter()
+    try:
+        with opener.open(request, timeout=600) as response:
+            content = response.read()
+            ok = response.status == 200 and b'An error occurred' not in content
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def load_test(base_url, concurrency, total_requests, collection, pipeline):
+    """
+    Run total_requests requests with `concurrency` in flight and summarize them.
+    """
+    opener, csrf_token = make_opener(base_url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda _: run_request(base_url, opener, csrf_token, collection, pipeline),
+            range(total_requests)
+        ))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    errors = sum(1 for _, ok in results if not ok)
+    if not latencies:
+        return {'throughput': 0.0, 'p50': float('nan'), 'p95': float('nan'), 'errors': errors}
+    return {
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wsgi-url')
+    parser.add_argument('--asgi-url')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--requests', type=int, default=256)
+    parser.add_argument('--collection', default=DEFAULT_COLLECTION)
+    parser.add_argument('--pipeline', type=json.loads, default=DEFAULT_PIPELINE,
+                        help="Aggregation pipeline to run, as JSON.")
+    args = parser.parse_args()
+
+    targets = [(name, url.rstrip('/')) for name, url in (('wsgi', args.wsgi_url), ('asgi', args.asgi_url)) if url]
+    if not targets:
+        parser.error("Give at least one of --wsgi-url and --asgi-url.")
+
+    print(f"{'server':>6} {'concurrency':>11} {'req/s':>8} {'p50 (s)':>8} {'p95 (s)':>8} {'errors':>6}")
+    for concurrency in args.concurrency:
+        for name, url in targets:
+            summary = load_test(url, concurrency, max(args.requests, concurrency), args.collection, args.pipeline)
+            print(f"{name:>6} {concurrency:>11} {summary['throughput']:>8.2f} "
+                  f"{summary['p50']:>8.3f} {summary['p95']:>8.3f} {summary['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
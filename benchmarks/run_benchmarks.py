@@ -0,0 +1,377 @@
+"""
+Benchmark the database build and the query views against a local mongod.
+
+Generates a synthetic PLSDB-shaped input set (see synthetic_plsdb.py), then:
+
+  * times every stage of a full database_build run (parsing, inserts, indexes,
+    summary collections), a streaming build and an incremental re-run with no changes;
+  * times the query views through the Django test client: execute_query (cold and
+    from the result cache), download_csv and natural_language_query, the latter with
+    a stub model that answers instantly, so prompt building, example retrieval,
+    response parsing, the background job round trip and the query pre-flight are
+    measured without Ollama.
+
+Results are written as JSON, to track them across versions. The benchmark database
+is dropped before and after the run.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--plasmids 1000] [--genes-per-plasmid 50] [--repeat 5]
+        [--mongo-uri mongodb://localhost:27017/] [--db plasmid_benchmark] [--output results.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager, redirect_stdout
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'Database_files'))
+
+from pymongo import MongoClient  # noqa: E402
+
+import database_build  # noqa: E402
+from synthetic_plsdb import generate_dataset  # noqa: E402
+
+# Queries run through the views: (name, collection, JSON query)
+VIEW_QUERIES = [
+    ('find_mobility', 'plasmids', {"mobility": "conjugative"}),
+    ('resistance_genes_in_genus', 'genes', [
+        {"$lookup": {"from": "plasmids", "localField": "plasmid_id", "foreignField": "_id", "as": "plasmid_info"}},
+        {"$unwind": "$plasmid_info"},
+        {"$lookup": {"from": "hosts", "localField": "plasmid_info.host_id", "foreignField": "_id", "as": "host_info"}},
+        {"$unwind": "$host_info"},
+        {"$match": {"host_info.genus": "Salmonella", "antibiotic_resistance": True}},
+        {"$group": {"_id": "$resistance_info.gene_name", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": 10},
+    ]),
+    ('resistance_genes_in_genus_summary', 'resistance_genes_by_genus', [
+        {"$match": {"genus": "Salmonella"}},
+        {"$sort": {"gene_count": -1}},
+        {"$limit": 10},
+    ]),
+    ('genes_with_sequences', 'genes', [
+        {"$match": {"antibiotic_resistance": True}},
+        {"$lookup": {"from": "plasmids", "localField": "plasmid_id", "foreignField": "_id", "as": "plasmid_info"}},
+    ]),
+]
+
+# Question and canned answer for the natural language view
+NL_QUESTION = "What are the 10 most common resistance genes in Salmonella?"
+
+
+class StubLLM:
+    """
+    Stands in for OllamaLLM: answers every prompt with a fixed pipeline.
+    """
+
+    def __init__(self, collection, pipeline):
+        self.response = f"```json\n{json.dumps({'collection': collection, 'pipeline': pipeline}, indent=4)}\n```"
+
+    def invoke(self, prompt):
+        return self.response
+
+    def stream(self, prompt):
+        yield self.response
+
+
+class StubChain:
+    """
+    Stands in for the LLMChain built by views.get_llmchain. The prompt is still formatted,
+    so the cost of building it is part of the measurement.
+    """
+
+    def __init__(self, prompt, llm):
+        self.prompt = prompt
+        self.llm = llm
+
+    def run(self, inputs):
+        return self.llm.invoke(self.prompt.format(**inputs))
+
+
+class StageTimer:
+    """
+    Collects wall-clock durations of named stages, in seconds.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(time.perf_counter() - start, 6)
+
+
+def summarize(durations):
+    """
+    Summary statistics of repeated measurements, in seconds.
+    """
+    return {
+        'runs': len(durations),
+        'median': round(statistics.median(durations), 6),
+        'mean': round(statistics.fmean(durations), 6),
+        'min': round(min(durations), 6),
+        'max': round(max(durations), 6),
+    }
+
+
+def benchmark_full_build(dataset, db, workers, sequence_storage):
+    """
+    Run every stage of a full build, timing each one.
+    """
+    timer = StageTimer()
+    with timer.stage('parse_mobtyper'):
+        plasmid_mobility = database_build.parse_mobtyper(dataset['mobtyper_folder'])
+    with timer.stage('parse_plsdb_metadata'):
+        metadata_df = database_build.parse_plsdb_metadata(dataset['metadata_file'])
+    with timer.stage('parse_resfinder_tab'):
+        resistance_genes = database_build.parse_resfinder_tab(dataset['resfinder_tab_file'])
+    with timer.stage('parse_fasta'):
+        plasmid_sequences = database_build.parse_fasta(dataset['fasta_folder'])
+    with timer.stage('parse_bakta'):
+        plasmid_genes = database_build.parse_bakta(dataset['bakta_folder'], workers)
+    with timer.stage('integrate_resistance_data'):
+        plasmid_genes = database_build.integrate_resistance_data(plasmid_genes, resistance_genes)
+    with timer.stage('insert_environments'):
+        environment_id_map = database_build.insert_environments(metadata_df, db)
+    with timer.stage('insert_hosts'):
+        host_id_map = database_build.insert_hosts(metadata_df, environment_id_map, db)
+    with timer.stage('insert_plasmids'):
+        plasmid_id_map = database_build.insert_plasmids(plasmid_sequences, plasmid_mobility, metadata_df, host_id_map,
+                                                        environment_id_map, db, sequence_storage=sequence_storage)
+    with timer.stage('insert_genes'):
+        database_build.insert_genes(plasmid_genes, plasmid_id_map, db, sequence_storage=sequence_storage)
+    with timer.stage('ensure_indexes'):
+        database_build.ensure_indexes(db)
+    with timer.stage('refresh_summary_collections'):
+        database_build.refresh_summary_collections(db)
+    with timer.stage('mark_build_complete'):
+        database_build.mark_build_complete(db)
+    timer.timings['total'] = round(sum(timer.timings.values()), 6)
+    return timer.timings, metadata_df, plasmid_mobility, resistance_genes
+
+
+def benchmark_streaming_build(dataset, db, workers, sequence_storage, metadata_df, plasmid_mobility,
+                              resistance_genes):
+    """
+    Time a streaming build of the plasmids and genes into an empty database.
+    """
+    timer = StageTimer()
+    environment_id_map = database_build.insert_environments(metadata_df, db)
+    host_id_map = database_build.insert_hosts(metadata_df, environment_id_map, db)
+    with timer.stage('insert_plasmids_streaming'):
+        database_build.insert_plasmids_streaming(dataset['fasta_folder'], dataset['bakta_folder'], plasmid_mobility,
+                                                 metadata_df, resistance_genes, host_id_map, environment_id_map, db,
+                                                 workers=workers, sequence_storage=sequence_storage)
+    return timer.timings
+
+
+def benchmark_incremental_build(dataset, db, workers, sequence_storage, metadata_df, plasmid_mobility,
+                                resistance_genes):
+    """
+    Time an incremental build into an empty database, then a re-run with unchanged inputs.
+    """
+    timer = StageTimer()
+    environment_id_map = database_build.insert_environments(metadata_df, db)
+    host_id_map = database_build.insert_hosts(metadata_df, environment_id_map, db)
+    for name in ('initial', 'unchanged'):
+        summary_scopes = {'host_id': set(), 'environment_id': set()}
+        with timer.stage(f"{name}_update"):
+            database_build.update_plasmids_incremental(
+                dataset['fasta_folder'], dataset['bakta_folder'], dataset['mobtyper_folder'], plasmid_mobility,
+                metadata_df, resistance_genes, host_id_map, environment_id_map, db, workers=workers,
+                sequence_storage=sequence_storage, summary_scopes=summary_scopes)
+        with timer.stage(f"{name}_summary_refresh"):
+            database_build.refresh_summary_collections(db, summary_scopes)
+    return timer.timings
+
+
+def setup_django(mongo_uri, db_name):
+    """
+    Configure the web application for the benchmark database. Sessions are kept in signed
+    cookies so no SQL database is needed.
+    """
+    os.environ['MONGO_URI'] = mongo_uri
+    os.environ['MONGO_DB_NAME'] = db_name
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BasededatosPLS.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    settings.SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
+
+def install_stub_llm(views, collection, pipeline):
+    """
+    Make views.get_llmchain return a StubChain over the real prompt template.
+    """
+    from langchain.prompts import PromptTemplate
+    prompt = PromptTemplate(input_variables=["user_question", "examples"],
+                            template=views.get_prompt_template())
+    with views._nl_lock:
+        views._llmchain = StubChain(prompt, StubLLM(collection, pipeline))
+        views._llmchain_loaded = True
+
+
+def time_request(send, repeat, before=None):
+    """
+    Time `repeat` calls of send(), calling before() untimed ahead of each one.
+    Raises if a response is not a 200.
+    """
+    durations = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        response = send()
+        if getattr(response, 'streaming', False):
+            for _chunk in response.streaming_content:
+                pass
+        durations.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"Request failed with status {response.status_code}")
+    return summarize(durations)
+
+
+def ask_nl_question(client, question):
+    """
+    Post a question to the query wizard and, when it is queued as a background job, wait
+    for the job and load its result page, as the wizard page does. Returns the last response.
+    """
+    response = client.post('/natural_language_query/', {'natural_language_query': question})
+    if response.status_code != 302:
+        return response
+    job_id = response.url.split('?job=')[1]
+    while client.get(f'/natural_language_query/jobs/{job_id}/').json()['status'] not in ('done', 'failed'):
+        time.sleep(0.005)
+    return client.get(response.url)
+
+
+def benchmark_views(repeat):
+    """
+    Time the query views through the Django test client.
+    """
+    from django.test import Client
+    from miapBBDDpls import views
+
+    client = Client()
+    results = {'execute_query_cold': {}, 'execute_query_cached': {}, 'download_csv': {}}
+
+    for name, collection, json_query in VIEW_QUERIES:
+        form = {'json_query': json.dumps(json_query), 'target_collection': collection}
+
+        def execute():
+            return client.post('/queries/execute/', form)
+
+        results['execute_query_cold'][name] = time_request(execute, repeat, before=views.query_result_cache.clear)
+        results['execute_query_cached'][name] = time_request(execute, repeat)
+        # download_csv exports the query execute_query last stored in the session
+        results['download_csv'][name] = time_request(lambda: client.get('/download-csv/'), repeat)
+
+    _, nl_collection, nl_pipeline = VIEW_QUERIES[1]
+    install_stub_llm(views, nl_collection, nl_pipeline)
+    # A new question each time so the NL pipeline cache never answers
+    results['natural_language_query'] = time_request(
+        lambda: ask_nl_question(client, f"{NL_QUESTION} ({uuid.uuid4().hex[:8]})"), repeat)
+    results['natural_language_query_cached'] = time_request(lambda: ask_nl_question(client, NL_QUESTION), repeat)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plasmids', type=int, default=1000)
+    parser.add_argument('--genes-per-plasmid', type=int, default=50)
+    parser.add_argument('--sequence-length', type=int, default=50000)
+    parser.add_argument('--resistance-rate', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help="Timed requests per view and query.")
+    parser.add_argument('--workers', type=int, default=database_build.BAKTA_WORKERS)
+    parser.add_argument('--sequence-storage', choices=database_build.SEQUENCE_STORAGE_MODES, default='embedded')
+    parser.add_argument('--data-dir', help="Reuse or keep the generated inputs here instead of a temporary directory.")
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='plasmid_benchmark', help="Benchmark database, dropped before and after.")
+    parser.add_argument('--skip-views', action='store_true')
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    client = MongoClient(args.mongo_uri)
+    scratch_db = f"{args.db}_scratch"
+    results = {
+        'git_commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'mongodb': client.server_info()['version'],
+        'config': {key: getattr(args, key) for key in ('plasmids', 'genes_per_plasmid', 'sequence_length',
+                                                       'resistance_rate', 'seed', 'repeat', 'workers',
+                                                       'sequence_storage')},
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir or temp_dir
+        start = time.perf_counter()
+        dataset = generate_dataset(data_dir, args.plasmids, args.genes_per_plasmid, args.sequence_length,
+                                   args.resistance_rate, args.seed)
+        results['dataset'] = {
+            'generation_seconds': round(time.perf_counter() - start, 6),
+            'plasmids': dataset['plasmids'],
+            'genes': dataset['genes'],
+            'resistance_hits': dataset['resistance_hits'],
+        }
+
+        try:
+            build_args = (args.workers, args.sequence_storage)
+            client.drop_database(scratch_db)
+            client.drop_database(args.db)
+            full, metadata_df, plasmid_mobility, resistance_genes = benchmark_full_build(dataset, client[args.db],
+                                                                                        *build_args)
+            parsed = (metadata_df, plasmid_mobility, resistance_genes)
+            results['build'] = {'full': full}
+            results['build']['streaming'] = benchmark_streaming_build(dataset, client[scratch_db], *build_args,
+                                                                      *parsed)
+            client.drop_database(scratch_db)
+            results['build']['incremental'] = benchmark_incremental_build(dataset, client[scratch_db], *build_args,
+                                                                          *parsed)
+            client.drop_database(scratch_db)
+
+            if not args.skip_views:
+                setup_django(args.mongo_uri, args.db)
+                # The views print model responses; keep stdout for the results
+                with redirect_stdout(sys.stderr):
+                    results['views'] = benchmark_views(args.repeat)
+        finally:
+            client.drop_database(scratch_db)
+            client.drop_database(args.db)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+Generate a synthetic PLSDB-shaped input set for benchmarking database_build.py.
+
+Writes the five inputs the build reads, in the layouts it expects:
+
+    <out>/fasta/<plasmid_id>.fna                          one record per plasmid
+    <out>/bakta/<plasmid_id>_baktaresult/<plasmid_id>.json   CDS features (plus a tRNA per plasmid)
+    <out>/mobtyper/<plasmid_id>_mobtyper.fasta            MobTyper report (TSV)
+    <out>/metadata.tsv                                    PLSDB metadata
+    <out>/resfinder.tab                                   ResFinder hits
+
+Output is deterministic for a given seed and scale. Sequence lengths, gene counts,
+taxonomy, isolation sources and resistance hits are drawn from fixed distributions
+loosely modelled on PLSDB, so the build, the summaries and the example queries all
+have realistic work to do.
+
+Usage:
+    python benchmarks/synthetic_plsdb.py OUT_DIR [--plasmids 1000] [--genes-per-plasmid 50]
+        [--sequence-length 50000] [--resistance-rate 0.02] [--seed 0]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+FASTA_LINE_WIDTH = 80
+
+# (genus, PLSDB species string, family)
+TAXA = [
+    ('Escherichia', 'Escherichia_coli', 'Enterobacteriaceae'),
+    ('Klebsiella', 'Klebsiella_pneumoniae', 'Enterobacteriaceae'),
+    ('Salmonella', 'Salmonella_enterica', 'Enterobacteriaceae'),
+    ('Enterobacter', 'Enterobacter_hormaechei', 'Enterobacteriaceae'),
+    ('Acinetobacter', 'Acinetobacter_baumannii', 'Moraxellaceae'),
+    ('Pseudomonas', 'Pseudomonas_aeruginosa', 'Pseudomonadaceae'),
+    ('Staphylococcus', 'Staphylococcus_aureus', 'Staphylococcaceae'),
+    ('Enterococcus', 'Enterococcus_faecium', 'Enterococcaceae'),
+]
+TAXA_WEIGHTS = [0.3, 0.2, 0.12, 0.1, 0.08, 0.08, 0.07, 0.05]
+
+ISOLATION_SOURCES = [
+    'human gut', 'blood', 'urine', 'feces', 'hospital sewage', 'wastewater treatment plant',
+    'river water', 'seawater', 'agricultural soil', 'sediment', 'plant root', 'leaf surface',
+    'chicken meat', 'bioreactor', 'missing', 'not available',
+]
+
+MOBILITIES = ['conjugative', 'mobilizable', 'non-mobilizable']
+MOBILITY_WEIGHTS = [0.35, 0.3, 0.35]
+REPLICON_TYPES = ['IncFII', 'IncFIB', 'IncI1', 'IncN', 'IncX4', 'IncHI2', 'IncQ1', 'IncP', 'Col440I', 'rep_cluster_1088']
+
+# (gene, phenotype) pairs reported by ResFinder
+RESISTANCE_GENES = [
+    ('blaCTX-M-15', 'ampicillin, cefotaxime, ceftazidime'),
+    ('blaTEM-1B', 'ampicillin, piperacillin'),
+    ('blaKPC-2', 'ampicillin, meropenem, imipenem'),
+    ('blaNDM-1', 'meropenem, imipenem'),
+    ('blaOXA-48', 'ampicillin, meropenem'),
+    ('aac(6\')-Ib-cr', 'amikacin, ciprofloxacin'),
+    ('qnrS1', 'ciprofloxacin, nalidixic acid'),
+    ('sul1', 'sulfamethoxazole'),
+    ('sul2', 'sulfamethoxazole'),
+    ('tet(A)', 'tetracycline, doxycycline'),
+    ('mcr-1.1', 'colistin'),
+    ('dfrA17', 'trimethoprim'),
+]
+
+PRODUCTS = [
+    'hypothetical protein', 'IS6 family transposase', 'plasmid replication protein', 'conjugal transfer protein TraA',
+    'type IV secretion system protein', 'DNA-binding protein', 'toxin-antitoxin system antitoxin',
+    'class A beta-lactamase', 'aminoglycoside N-acetyltransferase', 'integrase',
+]
+
+AMINO_ACIDS = b'ACDEFGHIKLMNPQRSTVWY'
+
+
+def random_sequence(rng, length, alphabet=b'ACGT'):
+    """
+    Random sequence of the given length over alphabet, as a str.
+    """
+    symbols = np.frombuffer(alphabet, dtype=np.uint8)
+    return symbols[rng.integers(0, len(symbols), length)].tobytes().decode('ascii')
+
+
+def add_ambiguity_runs(rng, sequence):
+    """
+    Replace a few stretches of the sequence with N and other IUPAC codes, as in assembly gaps.
+    """
+    chars = bytearray(sequence, 'ascii')
+    for _ in range(rng.poisson(1.5)):
+        start = int(rng.integers(0, max(1, len(chars) - 100)))
+        run = int(rng.integers(1, 100))
+        chars[start:start + run] = rng.choice(list(b'NNNNRYKM'), size=len(chars[start:start + run])).tobytes()
+    return chars.decode('ascii')
+
+
+def write_fasta(path, name, sequence):
+    with open(path, 'w') as f:
+        f.write(f">{name}\n")
+        for start in range(0, len(sequence), FASTA_LINE_WIDTH):
+            f.write(sequence[start:start + FASTA_LINE_WIDTH])
+            f.write('\n')
+
+
+def generate_dataset(out_dir, plasmids=1000, genes_per_plasmid=50, sequence_length=50000, resistance_rate=0.02,
+                     seed=0):
+    """
+    Write a synthetic input set.
+    Args:
+        out_dir (str): Output directory, created if needed.
+        plasmids (int): Number of plasmids.
+        genes_per_plasmid (int): Mean number of CDS features per plasmid.
+        sequence_length (int): Mean plasmid length in bases.
+        resistance_rate (float): Fraction of genes with a ResFinder hit.
+        seed (int): Random seed.
+    Returns:
+        dict: Paths of the generated inputs ('fasta_folder', 'bakta_folder', 'mobtyper_folder',
+        'metadata_file', 'resfinder_tab_file') and the counts generated ('plasmids', 'genes', 'resistance_hits').
+    """
+    rng = np.random.default_rng(seed)
+    paths = {
+        'fasta_folder': os.path.join(out_dir, 'fasta'),
+        'bakta_folder': os.path.join(out_dir, 'bakta'),
+        'mobtyper_folder': os.path.join(out_dir, 'mobtyper'),
+        'metadata_file': os.path.join(out_dir, 'metadata.tsv'),
+        'resfinder_tab_file': os.path.join(out_dir, 'resfinder.tab'),
+    }
+    for key in ('fasta_folder', 'bakta_folder', 'mobtyper_folder'):
+        os.makedirs(paths[key], exist_ok=True)
+
+    metadata_rows = ['\t'.join(['NUCCORE_ACC', 'BIOSAMPLE_IsolationSource', 'TAXONOMY_genus', 'TAXONOMY_species',
+                                'TAXONOMY_family', 'ASSEMBLY_Status', 'ASSEMBLY_ACC'])]
+    resfinder_rows = ['\t'.join(['Resistance gene', 'Identity', 'Alignment Length/Gene Length', 'Coverage',
+                                 'Position in reference', 'Contig', 'Position in contig', 'Phenotype',
+                                 'Accession no.'])]
+    gene_count = 0
+
+    for index in range(plasmids):
+        plasmid_id = f"NZ_CP{index:06d}.1"
+        # Plasmid sizes are heavily right-skewed: many small plasmids, a few megaplasmids
+        length = int(np.clip(rng.lognormal(np.log(sequence_length) - 0.5, 1.0), 1000, 40 * sequence_length))
+        sequence = add_ambiguity_runs(rng, random_sequence(rng, length))
+        write_fasta(os.path.join(paths['fasta_folder'], f"{plasmid_id}.fna"), plasmid_id, sequence)
+
+        features = []
+        n_genes = max(1, int(rng.poisson(genes_per_plasmid * length / sequence_length)))
+        for gene_index in range(n_genes):
+            locus = f"P{index:06d}_{gene_index + 1:05d}"
+            start = int(rng.integers(1, max(2, length - 1500)))
+            aa_length = int(rng.integers(60, 500))
+            features.append({
+                'type': 'cds',
+                'contig': plasmid_id,
+                'start': start,
+                'stop': start + 3 * aa_length + 2,
+                'strand': '+' if rng.random() < 0.5 else '-',
+                'gene': f"gene{int(rng.integers(0, 2000))}" if rng.random() < 0.6 else None,
+                'product': PRODUCTS[int(rng.integers(0, len(PRODUCTS)))],
+                'locus': locus,
+                'id': f"{plasmid_id}_{gene_index}",
+                'db_xrefs': [f"UniRef:UniRef90_{int(rng.integers(0, 10 ** 8)):08d}"],
+                'nt': random_sequence(rng, 3 * aa_length + 3),
+                'aa': 'M' + random_sequence(rng, aa_length - 1, AMINO_ACIDS),
+            })
+            if rng.random() < resistance_rate:
+                gene, phenotype = RESISTANCE_GENES[int(rng.integers(0, len(RESISTANCE_GENES)))]
+                identity = round(float(rng.uniform(90, 100)), 2)
+                coverage = round(float(rng.uniform(80, 100)), 2)
+                resfinder_rows.append('\t'.join([
+                    gene, str(identity), f"{3 * aa_length}/{3 * aa_length}", str(coverage), f"1..{3 * aa_length}",
+                    f"{plasmid_id}|{locus} len={length}", f"{start}..{start + 3 * aa_length}", phenotype,
+                    f"AB{int(rng.integers(0, 10 ** 6)):06d}",
+                ]))
+        features.append({'type': 'tRNA', 'contig': plasmid_id, 'locus': f"P{index:06d}_t1"})
+        gene_count += n_genes
+
+        bakta_dir = os.path.join(paths['bakta_folder'], f"{plasmid_id}_baktaresult")
+        os.makedirs(bakta_dir, exist_ok=True)
+        with open(os.path.join(bakta_dir, f"{plasmid_id}.json"), 'w') as f:
+            json.dump({
+                'genome': {'genus': None, 'species': None},
+                'stats': {'size': length, 'no_sequences': 1},
+                'features': features,
+                'sequences': [{'id': plasmid_id, 'length': length, 'nt': sequence}],
+            }, f)
+
+        mobility = MOBILITIES[rng.choice(len(MOBILITIES), p=MOBILITY_WEIGHTS)]
+        replicons = sorted(set(rng.choice(REPLICON_TYPES, size=int(rng.integers(1, 4))).tolist()))
+        with open(os.path.join(paths['mobtyper_folder'], f"{plasmid_id}_mobtyper.fasta"), 'w') as f:
+            f.write('sample_id\tnum_contigs\tsize\trep_type(s)\trelaxase_type(s)\tpredicted_mobility\n')
+            f.write(f"{plasmid_id}\t1\t{length}\t{','.join(replicons)}\tMOBF\t{mobility}\n")
+
+        genus, species, family = TAXA[rng.choice(len(TAXA), p=TAXA_WEIGHTS)]
+        source = ISOLATION_SOURCES[int(rng.integers(0, len(ISOLATION_SOURCES)))]
+        status = 'Complete Genome' if rng.random() < 0.8 else 'Contig'
+        metadata_rows.append('\t'.join([plasmid_id, source, genus, species, family, status,
+                                        f"GCF_{index:09d}.1"]))
+
+    with open(paths['metadata_file'], 'w') as f:
+        f.write('\n'.join(metadata_rows) + '\n')
+    with open(paths['resfinder_tab_file'], 'w') as f:
+        f.write('\n'.join(resfinder_rows) + '\n')
+
+    return {**paths, 'plasmids': plasmids, 'genes': gene_count, 'resistance_hits': len(resfinder_rows) - 1}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir')
+    parser.add_argument('--plasmids', type=int, default=1000)
+    parser.add_argument('--genes-per-plasmid', type=int, default=50)
+    parser.add_argument('--sequence-length', type=int, default=50000)
+    parser.add_argument('--resistance-rate', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    dataset = generate_dataset(args.out_dir, args.plasmids, args.genes_per_plasmid, args.sequence_length,
+                               args.resistance_rate, args.seed)
+    print(f"Wrote {dataset['plasmids']} plasmids, {dataset['genes']} genes and "
+          f"{dataset['resistance_hits']} resistance hits to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,20 @@
 import os
-from pymongo import MongoClient, InsertOne
+import argparse
+from pymongo import MongoClient, ASCENDING, InsertOne, ReplaceOne, UpdateOne
 import pandas as pd
 from Bio import SeqIO
 import json
 import logging
 import csv
+from datetime import datetime, timezone
+import hashlib
+import itertools
+import re
+from concurrent.futures import ProcessPoolExecutor
+import json_backend
+from sequence_codec import pack_sequence
+from sequence_store import (DEFAULT_CODEC, SEQUENCE_CODECS, SEQUENCE_FIELDS, SEQUENCE_STORAGE_MODES,
+                            SEQUENCES_COLLECTION, delete_sequences, detach_sequences, embed_sequences, sequence_refs)
 
 # Categories for environment classification based on isolation sources
 ENVIRONMENT_CATEGORIES = {
@@ -16,10 +26,181 @@ ENVIRONMENT_CATEGORIES = {
     "Unknown": ["unknown", "n/a", "none", "not available"]
 }
 
+# One compiled keyword alternation per category, kept in ENVIRONMENT_CATEGORIES order
+ENVIRONMENT_PATTERNS = {
+    category: re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+    for category, keywords in ENVIRONMENT_CATEGORIES.items()
+}
+
+# Number of worker processes used to parse Bakta JSON files
+BAKTA_WORKERS = os.cpu_count() or 1
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# 'full' decodes each Bakta file whole, 'streaming' walks its features array with ijson
+BAKTA_PARSERS = ('full', 'streaming')
+# Read size of the streaming parser: yajl re-buffers long strings, so small reads are slow on whole-contig sequences
+BAKTA_STREAM_BUFFER_SIZE = 1024 * 1024
+BAKTA_DECODE_ERRORS = (json.JSONDecodeError,) + ((ijson.JSONError,) if ijson is not None else ())
+
+# Plasmids per batch in streaming builds and genes per bulk write
+BUILD_BATCH_SIZE = 500
+GENE_BATCH_SIZE = 10000
+
+# Curated indexes for the $lookup joins and common filters, per collection
+INDEX_SPECS = {
+    'genes': [
+        [('plasmid_id', ASCENDING)],
+        [('antibiotic_resistance', ASCENDING), ('resistance_info.gene_name', ASCENDING)],
+        [('resistance_info.gene_name', ASCENDING)],
+        [('resistance_info.resistance_to', ASCENDING)],
+        [('gene_name', ASCENDING)],
+    ],
+    'plasmids': [
+        [('plasmid_id', ASCENDING)],
+        [('host_id', ASCENDING)],
+        [('environment_id', ASCENDING)],
+        [('replicon_type', ASCENDING)],
+        [('mobility', ASCENDING)],
+        [('sequence_length', ASCENDING)],
+    ],
+    'hosts': [
+        [('genus', ASCENDING), ('species', ASCENDING)],
+        [('environment_ids', ASCENDING)],
+    ],
+    'environments': [
+        [('name', ASCENDING)],
+    ],
+    'resistance_genes_by_genus': [
+        [('genus', ASCENDING), ('gene_count', ASCENDING)],
+        [('gene_name', ASCENDING)],
+    ],
+    'replicon_types_by_host': [
+        [('host_id', ASCENDING)],
+        [('genus', ASCENDING), ('species', ASCENDING)],
+        [('replicon_type', ASCENDING)],
+    ],
+    'mobility_by_environment': [
+        [('environment_id', ASCENDING)],
+        [('environment', ASCENDING)],
+    ],
+}
+
+# Indexes created by earlier builds that are no longer wanted, dropped by ensure_indexes
+# (hosts never store a family, so its index only cost writes)
+OBSOLETE_INDEXES = {
+    'hosts': ['family_1'],
+}
+
+# Materialized summaries of the most common multi-$lookup aggregations, rebuilt with $merge.
+# Each is grouped by a scope field that identifies the rows an incremental build has to refresh.
+# $merge needs MongoDB 4.2 or later (SUMMARY_MIN_SERVER_VERSION); the sub-pipeline lookups use the
+# let/$expr form rather than localField with pipeline, which would need 5.0.
+SUMMARY_MIN_SERVER_VERSION = (4, 2)
+SUMMARY_COLLECTIONS = {
+    'resistance_genes_by_genus': {
+        'source': 'hosts',
+        'scope_field': 'genus',
+        'pipeline': [
+            {'$lookup': {'from': 'plasmids', 'let': {'host_id': '$_id'}, 'as': 'plasmid',
+                         'pipeline': [{'$match': {'$expr': {'$eq': ['$host_id', '$$host_id']}}},
+                                      {'$project': {'_id': 1}}]}},
+            {'$unwind': '$plasmid'},
+            {'$lookup': {'from': 'genes', 'let': {'plasmid_id': '$plasmid._id'}, 'as': 'gene',
+                         'pipeline': [{'$match': {'antibiotic_resistance': True,
+                                                  '$expr': {'$eq': ['$plasmid_id', '$$plasmid_id']}}},
+                                      {'$project': {'_id': 0, 'resistance_info.gene_name': 1}}]}},
+            {'$unwind': '$gene'},
+            {'$group': {'_id': {'genus': '$genus', 'gene_name': '$gene.resistance_info.gene_name'},
+                        'gene_count': {'$sum': 1}, 'plasmids': {'$addToSet': '$plasmid._id'}}},
+            {'$project': {'_id': 1, 'genus': '$_id.genus', 'gene_name': '$_id.gene_name', 'gene_count': 1,
+                          'plasmid_count': {'$size': '$plasmids'}}},
+        ],
+    },
+    'replicon_types_by_host': {
+        'source': 'plasmids',
+        'scope_field': 'host_id',
+        'pipeline': [
+            {'$group': {'_id': {'host_id': '$host_id', 'replicon_type': '$replicon_type'}, 'plasmid_count': {'$sum': 1}}},
+            {'$lookup': {'from': 'hosts', 'localField': '_id.host_id', 'foreignField': '_id', 'as': 'host'}},
+            {'$unwind': {'path': '$host', 'preserveNullAndEmptyArrays': True}},
+            {'$project': {'_id': 1, 'host_id': '$_id.host_id', 'genus': '$host.genus', 'species': '$host.species',
+                          'replicon_type': '$_id.replicon_type', 'plasmid_count': 1}},
+        ],
+    },
+    'mobility_by_environment': {
+        'source': 'plasmids',
+        'scope_field': 'environment_id',
+        'pipeline': [
+            {'$group': {'_id': {'environment_id': '$environment_id', 'mobility': '$mobility'},
+                        'plasmid_count': {'$sum': 1}}},
+            {'$lookup': {'from': 'environments', 'localField': '_id.environment_id', 'foreignField': '_id',
+                         'as': 'environment'}},
+            {'$unwind': {'path': '$environment', 'preserveNullAndEmptyArrays': True}},
+            {'$project': {'_id': 1, 'environment_id': '$_id.environment_id', 'environment': '$environment.name',
+                          'mobility': '$_id.mobility', 'plasmid_count': 1}},
+        ],
+    },
+}
+
 # Setup logging for debugging and tracking execution
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Parsing Functions
+def list_fasta_files(fasta_folder):
+    """
+    List the FASTA files in a folder.
+    Args:
+        fasta_folder (str): Path to the folder containing FASTA files.
+    Returns:
+        list: Sorted (filepath, plasmid_id) tuples, one per plasmid ID. When several files
+        give the same ID (e.g. X.fa and X.fasta), the last one in filename order is kept.
+    """
+    fasta_files = {}
+    for filename in sorted(os.listdir(fasta_folder)):
+        if filename.endswith(('.fasta', '.fa', '.fna')):  # Match common FASTA extensions
+            plasmid_id = os.path.splitext(filename)[0]  # Use filename as plasmid ID
+            if plasmid_id in fasta_files:
+                logging.warning(f"Several FASTA files for {plasmid_id}; using {filename}.")
+            fasta_files[plasmid_id] = os.path.join(fasta_folder, filename)
+    return sorted((filepath, plasmid_id) for plasmid_id, filepath in fasta_files.items())
+
+def read_fasta_files(fasta_files):
+    """
+    Lazily yield plasmid sequences from the given FASTA files.
+    Sequences are held 2-bit packed (sequence_codec.PackedSequence) while the build runs.
+    All records of a file share its plasmid ID, so each file gives one sequence: its last
+    record, the one a dict keyed by plasmid ID keeps. Batches built from these pairs then
+    never hold a plasmid ID that an earlier batch already inserted.
+    Args:
+        fasta_files (list): (filepath, plasmid_id) tuples, as returned by list_fasta_files.
+    Yields:
+        tuple: (plasmid_id, sequence) for every file with at least one record.
+    """
+    for filepath, plasmid_id in fasta_files:
+        sequence = None
+        try:
+            # Parse each FASTA file and extract sequences
+            for record in SeqIO.parse(filepath, 'fasta'):
+                sequence = record.seq
+        except Exception as e:
+            logging.error(f"Error processing {os.path.basename(filepath)}: {e}")
+        if sequence is not None:
+            yield plasmid_id, pack_sequence(str(sequence))
+
+def iter_fasta(fasta_folder):
+    """
+    Lazily yield plasmid sequences from the FASTA files in a folder.
+    Args:
+        fasta_folder (str): Path to the folder containing FASTA files.
+    Yields:
+        tuple: (plasmid_id, sequence) for every file, in filename order.
+    """
+    yield from read_fasta_files(list_fasta_files(fasta_folder))
+
 def parse_fasta(fasta_folder):
     """
     Parse FASTA files in a folder and extract plasmid sequences.
@@ -28,62 +209,139 @@ def parse_fasta(fasta_folder):
     Returns:
         dict: A dictionary with plasmid IDs as keys and sequences as values.
     """
-    plasmid_sequences = {}
-    for filename in os.listdir(fasta_folder):
-        if filename.endswith(('.fasta', '.fa', '.fna')):  # Match common FASTA extensions
-            filepath = os.path.join(fasta_folder, filename)
-            try:
-                # Parse each FASTA file and extract sequences
-                for record in SeqIO.parse(filepath, 'fasta'):
-                    plasmid_id = os.path.splitext(filename)[0]  # Use filename as plasmid ID
-                    plasmid_sequences[plasmid_id] = str(record.seq)
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
+    plasmid_sequences = dict(iter_fasta(fasta_folder))
     logging.info(f"Total plasmid sequences parsed: {len(plasmid_sequences)}")
     return plasmid_sequences
 
-def parse_bakta(bakta_folder):
+def parse_bakta_file(json_file, plasmid_id, bakta_parser='full'):
     """
-    Parse Bakta annotation JSON files to extract gene data.
+    Parse a single Bakta annotation JSON file and extract its CDS features.
+    Args:
+        json_file (str): Path to the Bakta JSON file.
+        plasmid_id (str): Plasmid ID the annotation belongs to.
+        bakta_parser (str): 'full' or 'streaming' (see iter_bakta_features).
+    Returns:
+        tuple: (plasmid_id, gene list or None, error message or None).
+    """
+    try:
+        with open(json_file, 'rb') as f:
+            # Extract CDS features from JSON
+            genes = [
+                {
+                    'locus': feature.get('locus', ''),
+                    'id': feature.get('id', ''),
+                    'gene': feature.get('gene', ''),
+                    'product': feature.get('product', ''),
+                    'start': feature.get('start', 0),
+                    'stop': feature.get('stop', 0),
+                    'strand': feature.get('strand', ''),
+                    'contig': feature.get('contig', ''),
+                    'db_xrefs': feature.get('db_xrefs', []),
+                    'nt_sequence': feature.get('nt', ''),
+                    'aa_sequence': feature.get('aa', ''),
+                }
+                for feature in iter_bakta_features(f, bakta_parser)
+                if feature.get('type', '').lower() == 'cds'  # Filter CDS features
+            ]
+    except BAKTA_DECODE_ERRORS:
+        if bakta_parser == 'streaming':
+            # ijson rejects a few documents the full parser accepts, such as integers beyond 64 bits
+            return parse_bakta_file(json_file, plasmid_id, 'full')
+        return plasmid_id, None, f"Error decoding JSON for {plasmid_id}"
+    return plasmid_id, genes, None
+
+def iter_bakta_features(f, bakta_parser='full'):
+    """
+    Iterate over the features of a Bakta annotation.
+    The 'full' parser decodes the whole file. The 'streaming' parser (ijson) builds one feature
+    at a time; the contig sequences, statistics and run information that follow the features
+    array are still read to the end of the document, so a truncated or corrupt file fails as
+    with the full parser, but they are never built into objects. It falls back to the full
+    parser when ijson is not installed.
+    Args:
+        f (file): Bakta JSON file opened in binary mode.
+        bakta_parser (str): 'full' or 'streaming'.
+    Returns:
+        iterator: Feature dicts.
+    """
+    if bakta_parser == 'streaming' and ijson is not None:
+        return ijson.items(f, 'features.item', use_float=True, buf_size=BAKTA_STREAM_BUFFER_SIZE)
+    return iter(json_backend.load(f).get('features', []))
+
+def _parse_bakta_task(task, bakta_parser='full'):
+    """
+    Process pool entry point unpacking a (json_file, plasmid_id) task.
+    """
+    return parse_bakta_file(*task, bakta_parser)
+
+def list_bakta_files(bakta_folder):
+    """
+    List the Bakta JSON files found in the result folders.
     Args:
         bakta_folder (str): Path to folder containing Bakta results.
     Returns:
-        dict: A dictionary with plasmid IDs as keys and gene lists as values.
+        list: Sorted (json_file, plasmid_id) tuples.
     """
-    plasmid_genes = {}
-    for folder_name in os.listdir(bakta_folder):
+    tasks = []
+    for folder_name in sorted(os.listdir(bakta_folder)):
         folder_path = os.path.join(bakta_folder, folder_name)
         if os.path.isdir(folder_path):  # Ensure it is a folder
             plasmid_id = folder_name.replace('_baktaresult', '')  # Extract plasmid ID
             json_file = os.path.join(folder_path, f"{plasmid_id}.json")
             if os.path.exists(json_file):
-                try:
-                    with open(json_file, 'r') as f:
-                        data = json.load(f)
-                        # Extract CDS features from JSON
-                        genes = [
-                            {
-                                'locus': feature.get('locus', ''),
-                                'id': feature.get('id', ''),
-                                'gene': feature.get('gene', ''),
-                                'product': feature.get('product', ''),
-                                'start': feature.get('start', 0),
-                                'stop': feature.get('stop', 0),
-                                'strand': feature.get('strand', ''),
-                                'contig': feature.get('contig', ''),
-                                'db_xrefs': feature.get('db_xrefs', []),
-                                'nt_sequence': feature.get('nt', ''),
-                                'aa_sequence': feature.get('aa', ''),
-                            }
-                            for feature in data.get('features', [])
-                            if feature.get('type', '').lower() == 'cds'  # Filter CDS features
-                        ]
-                        plasmid_genes[plasmid_id] = genes
-                except json.JSONDecodeError:
-                    logging.error(f"Error decoding JSON for {plasmid_id}")
+                tasks.append((json_file, plasmid_id))
+    return tasks
+
+def parse_bakta(bakta_folder, workers=None, bakta_parser='full'):
+    """
+    Parse Bakta annotation JSON files to extract gene data.
+    Args:
+        bakta_folder (str): Path to folder containing Bakta results.
+        workers (int): Number of worker processes. Defaults to BAKTA_WORKERS;
+            1 parses the files serially in this process.
+        bakta_parser (str): 'full' or 'streaming' (see iter_bakta_features).
+    Returns:
+        dict: A dictionary with plasmid IDs as keys and gene lists as values.
+    """
+    if workers is None:
+        workers = BAKTA_WORKERS
+    tasks = list_bakta_files(bakta_folder)
+
+    if workers > 1 and len(tasks) > 1:
+        logging.info(f"Parsing {len(tasks)} Bakta files with {workers} worker processes.")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            plasmid_genes = parse_bakta_tasks(tasks, executor, workers, bakta_parser)
+    else:
+        plasmid_genes = parse_bakta_tasks(tasks, bakta_parser=bakta_parser)
     logging.info(f"Total plasmid genes parsed: {sum(len(genes) for genes in plasmid_genes.values())}")
     return plasmid_genes
 
+def parse_bakta_tasks(tasks, executor=None, workers=1, bakta_parser='full'):
+    """
+    Parse a list of Bakta files, optionally through a process pool.
+    Args:
+        tasks (list): (json_file, plasmid_id) tuples to parse.
+        executor (ProcessPoolExecutor): Pool to spread the files over, or None to parse serially.
+        workers (int): Number of workers in the pool, used to size the chunks.
+        bakta_parser (str): 'full' or 'streaming' (see iter_bakta_features).
+    Returns:
+        dict: A dictionary with plasmid IDs as keys and gene lists as values.
+    """
+    if executor is not None:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        # map() yields in submission order, so results and errors stay deterministic
+        results = executor.map(_parse_bakta_task, tasks, itertools.repeat(bakta_parser), chunksize=chunksize)
+    else:
+        results = (parse_bakta_file(json_file, plasmid_id, bakta_parser) for json_file, plasmid_id in tasks)
+
+    plasmid_genes = {}
+    for plasmid_id, genes, error in results:
+        if error:
+            logging.error(error)
+        else:
+            plasmid_genes[plasmid_id] = genes
+    return plasmid_genes
+
 def parse_mobtyper(mobtyper_folder):
     """
     Parse MobTyper results and extract mobility and replicon types.
@@ -110,6 +368,27 @@ def parse_mobtyper(mobtyper_folder):
     logging.info(f"Total plasmid mobility data parsed: {len(plasmid_mobility)}")
     return plasmid_mobility
 
+def categorize_environments(isolation_sources):
+    """
+    Assign an environment category to each lower-cased isolation source.
+    Categories are tried in ENVIRONMENT_CATEGORIES order and the first one with a
+    matching keyword wins; sources matching none are labelled "Other". Each distinct
+    source string is categorized only once and the labels are mapped back.
+    Args:
+        isolation_sources (Series): Lower-cased isolation source strings.
+    Returns:
+        Series: Category labels aligned with isolation_sources.
+    """
+    unique_sources = pd.Series(isolation_sources.unique(), dtype=object)
+    labels = pd.Series("Other", index=unique_sources.index, dtype=object)
+    unassigned = pd.Series(True, index=unique_sources.index)
+    for category, pattern in ENVIRONMENT_PATTERNS.items():
+        candidates = unique_sources[unassigned]
+        matches = candidates.index[candidates.str.contains(pattern, regex=True)]
+        labels[matches] = category
+        unassigned[matches] = False
+    return isolation_sources.map(dict(zip(unique_sources, labels)))
+
 def parse_plsdb_metadata(metadata_file):
     """
     Parse metadata from PLSDB and categorize environments.
@@ -136,12 +415,7 @@ def parse_plsdb_metadata(metadata_file):
 
     # Categorize environments based on isolation source
     metadata_df['IsolationSource_lower'] = metadata_df['BIOSAMPLE_IsolationSource'].astype(str).str.lower()
-    def categorize(isolation_source):
-        for category, keywords in ENVIRONMENT_CATEGORIES.items():
-            if any(keyword in isolation_source for keyword in keywords):
-                return category
-        return "Other"
-    metadata_df['Categorized_Environment'] = metadata_df['IsolationSource_lower'].apply(categorize)
+    metadata_df['Categorized_Environment'] = categorize_environments(metadata_df['IsolationSource_lower'])
     metadata_df.drop(columns=['IsolationSource_lower'], inplace=True)
 
     logging.info(f"Columns in metadata_df: {metadata_df.columns.tolist()}")
@@ -228,13 +502,18 @@ def insert_environments(metadata_df, db):
         dict: Mapping of environment names to MongoDB IDs.
     """
     environment_id_map = {}
-    unique_environments = metadata_df['Categorized_Environment'].unique()
-    environment_data_list = [{'name': env} for env in unique_environments]
+    unique_environments = [str(env) for env in metadata_df['Categorized_Environment'].unique()]
+
+    # Reuse environments that already exist so re-runs do not duplicate them
+    for environment in db.environments.find({'name': {'$in': unique_environments}}):
+        environment_id_map.setdefault(environment['name'], environment['_id'])
+    new_environments = [env for env in unique_environments if env not in environment_id_map]
+    environment_data_list = [{'name': env} for env in new_environments]
 
     if environment_data_list:
         try:
             result = db.environments.insert_many(environment_data_list)
-            for idx, environment in enumerate(unique_environments):
+            for idx, environment in enumerate(new_environments):
                 environment_id_map[environment] = result.inserted_ids[idx]
             logging.info(f"Inserted {len(result.inserted_ids)} unique environments into the database.")
         except Exception as e:
@@ -314,7 +593,83 @@ def insert_hosts(metadata_df, environment_id_map, db):
     return host_id_map
 
 
-def insert_plasmids(plasmid_sequences, plasmid_mobility, metadata_df, host_id_map, environment_id_map, db):
+def build_metadata_index(metadata_df):
+    """
+    Index the metadata by accession so plasmids can be joined to it in constant time.
+    When an accession appears more than once, its first row is used.
+    Args:
+        metadata_df (DataFrame): Metadata DataFrame.
+    Returns:
+        dict: Mapping of NUCCORE_ACC to a dict of the metadata fields used for plasmids.
+    """
+    columns = ['Categorized_Environment', 'TAXONOMY_genus', 'TAXONOMY_species', 'ASSEMBLY_Status', 'ASSEMBLY_ACC']
+    first_rows = metadata_df.drop_duplicates(subset='NUCCORE_ACC', keep='first')
+    return first_rows.set_index('NUCCORE_ACC')[columns].to_dict('index')
+
+def build_plasmid_document(plasmid_id, sequence, plasmid_mobility, metadata_index, host_id_map, environment_id_map):
+    """
+    Build the plasmids collection document for one plasmid.
+    Args:
+        plasmid_id (str): Plasmid ID.
+        sequence (str or PackedSequence): Plasmid sequence.
+        plasmid_mobility (dict): Mobility data for plasmids.
+        metadata_index (dict): Metadata keyed by accession, from build_metadata_index.
+        host_id_map (dict): Mapping of host names to MongoDB IDs.
+        environment_id_map (dict): Mapping of environment names to MongoDB IDs.
+    Returns:
+        dict: The plasmid document. The sequence is kept as given; see prepare_sequence_fields.
+    """
+    plasmid_data = {
+        'plasmid_id': plasmid_id,
+        'sequence': sequence,
+        'sequence_length': len(sequence),
+        'mobility': plasmid_mobility.get(plasmid_id, {}).get('mobility'),
+        'replicon_type': plasmid_mobility.get(plasmid_id, {}).get('replicon_type')
+    }
+
+    plasmid_metadata = metadata_index.get(plasmid_id)
+    if plasmid_metadata is not None:
+        # Add environment and host information
+        environment_name = plasmid_metadata['Categorized_Environment']
+        host_genus = plasmid_metadata['TAXONOMY_genus']
+        species_list = plasmid_metadata['TAXONOMY_species'].split("_")
+        host_species = ' '.join(species_list[:2])
+        host_name = f"{host_genus} {host_species}"
+        plasmid_data['environment_id'] = environment_id_map.get(environment_name)
+        plasmid_data['host_id'] = host_id_map.get(host_name)
+
+        # Include assembly metadata
+        plasmid_data['assembly_status'] = plasmid_metadata['ASSEMBLY_Status']
+        plasmid_data['assembly_accession'] = plasmid_metadata['ASSEMBLY_ACC']
+    else:
+        # Handle missing metadata
+        plasmid_data['environment_id'] = None
+        plasmid_data['host_id'] = None
+        plasmid_data['assembly_status'] = None
+        plasmid_data['assembly_accession'] = None
+
+    return plasmid_data
+
+def prepare_sequence_fields(document, collection_name, name, sequence_storage, sequence_codec):
+    """
+    Get a document's sequence fields ready for writing.
+    Args:
+        document (dict): Plasmid or gene document, modified in place.
+        collection_name (str): 'plasmids' or 'genes'.
+        name (str): Plasmid ID or gene locus.
+        sequence_storage (str): 'embedded' turns packed sequences into strings, 'blob' moves
+            sequences out to sequence blobs.
+        sequence_codec (str): Codec for sequence blobs ('zlib' or '2bit').
+    Returns:
+        list: Sequence blobs to insert before the document.
+    """
+    if sequence_storage == 'blob':
+        return detach_sequences(document, SEQUENCE_FIELDS[collection_name], name, sequence_codec)
+    embed_sequences(document, SEQUENCE_FIELDS[collection_name])
+    return []
+
+def insert_plasmids(plasmid_sequences, plasmid_mobility, metadata_df, host_id_map, environment_id_map, db,
+                    metadata_index=None, sequence_storage='embedded', sequence_codec=DEFAULT_CODEC):
     """
     Insert plasmid data into the database.
     Args:
@@ -324,49 +679,34 @@ def insert_plasmids(plasmid_sequences, plasmid_mobility, metadata_df, host_id_ma
         host_id_map (dict): Mapping of host names to MongoDB IDs.
         environment_id_map (dict): Mapping of environment names to MongoDB IDs.
         db: MongoDB database instance.
+        metadata_index (dict): Prebuilt result of build_metadata_index, to reuse across batches.
+        sequence_storage (str): 'embedded' keeps sequences in the plasmid documents, 'blob' moves
+            them to the compressed sequences collection (see sequence_store.py).
+        sequence_codec (str): Codec for sequence blobs ('zlib' or '2bit').
     Returns:
         dict: Mapping of plasmid IDs to MongoDB IDs.
     """
     plasmid_data_list = []
+    sequence_blobs = []
     plasmid_id_list = []
     plasmid_id_map = {}
+    if metadata_index is None:
+        metadata_index = build_metadata_index(metadata_df)
 
     for plasmid_id, sequence in plasmid_sequences.items():
-        plasmid_data = {
-            'plasmid_id': plasmid_id,
-            'sequence': sequence,
-            'sequence_length': len(sequence),
-            'mobility': plasmid_mobility.get(plasmid_id, {}).get('mobility'),
-            'replicon_type': plasmid_mobility.get(plasmid_id, {}).get('replicon_type')
-        }
-
-        plasmid_metadata = metadata_df[metadata_df['NUCCORE_ACC'] == plasmid_id]
-        if not plasmid_metadata.empty:
-            # Add environment and host information
-            environment_name = plasmid_metadata['Categorized_Environment'].values[0]
-            host_genus = plasmid_metadata['TAXONOMY_genus'].values[0]
-            species_list = plasmid_metadata['TAXONOMY_species'].values[0].split("_")
-            host_species = ' '.join(species_list[:2])
-            host_name = f"{host_genus} {host_species}"
-            plasmid_data['environment_id'] = environment_id_map.get(environment_name)
-            plasmid_data['host_id'] = host_id_map.get(host_name)
-
-            # Include assembly metadata
-            plasmid_data['assembly_status'] = plasmid_metadata['ASSEMBLY_Status'].values[0]
-            plasmid_data['assembly_accession'] = plasmid_metadata['ASSEMBLY_ACC'].values[0]
-        else:
-            # Handle missing metadata
-            plasmid_data['environment_id'] = None
-            plasmid_data['host_id'] = None
-            plasmid_data['assembly_status'] = None
-            plasmid_data['assembly_accession'] = None
-
+        plasmid_data = build_plasmid_document(plasmid_id, sequence, plasmid_mobility, metadata_index,
+                                              host_id_map, environment_id_map)
+        sequence_blobs.extend(prepare_sequence_fields(plasmid_data, 'plasmids', plasmid_id, sequence_storage,
+                                                      sequence_codec))
         plasmid_data_list.append(plasmid_data)
         plasmid_id_list.append(plasmid_id)
 
     # Insert plasmid data into the database
     if plasmid_data_list:
         try:
+            # Sequences first, so references are never left dangling
+            if sequence_blobs:
+                db[SEQUENCES_COLLECTION].insert_many(sequence_blobs)
             result = db.plasmids.insert_many(plasmid_data_list)
             for idx, inserted_id in enumerate(result.inserted_ids):
                 plasmid_id_map[plasmid_id_list[idx]] = inserted_id
@@ -376,15 +716,23 @@ def insert_plasmids(plasmid_sequences, plasmid_mobility, metadata_df, host_id_ma
 
     return plasmid_id_map
 
-def insert_genes(plasmid_genes, plasmid_id_map, db):
+def insert_genes(plasmid_genes, plasmid_id_map, db, batch_size=None, sequence_storage='embedded',
+                 sequence_codec=DEFAULT_CODEC):
     """
     Insert gene data into the database.
     Args:
         plasmid_genes (dict): Gene data for plasmids.
         plasmid_id_map (dict): Mapping of plasmid IDs to MongoDB IDs.
         db: MongoDB database instance.
+        batch_size (int): Number of genes sent per bulk write. Defaults to GENE_BATCH_SIZE.
+        sequence_storage (str): 'embedded' or 'blob', as in insert_plasmids.
+        sequence_codec (str): Codec for sequence blobs ('zlib' or '2bit').
     """
+    if batch_size is None:
+        batch_size = GENE_BATCH_SIZE
     bulk_operations = []
+    sequence_blobs = []
+    inserted_count = 0
 
     for plasmid_id, genes in plasmid_genes.items():
         plasmid_object_id = plasmid_id_map.get(plasmid_id)
@@ -406,21 +754,502 @@ def insert_genes(plasmid_genes, plasmid_id_map, db):
                 'antibiotic_resistance': gene.get('antibiotic_resistance', False),
                 'resistance_info': gene.get('resistance_info', {})
             }
+            sequence_blobs.extend(prepare_sequence_fields(gene_data, 'genes', gene['locus'], sequence_storage,
+                                                          sequence_codec))
             bulk_operations.append(InsertOne(gene_data))
+            if len(bulk_operations) >= batch_size:
+                inserted_count += _write_genes(bulk_operations, db, sequence_blobs)
+                bulk_operations = []
+                sequence_blobs = []
 
-    # Perform bulk write operation for genes
+    # Perform bulk write operation for the remaining genes
     if bulk_operations:
+        inserted_count += _write_genes(bulk_operations, db, sequence_blobs)
+    logging.info(f"Inserted {inserted_count} genes into the database.")
+
+def _write_genes(bulk_operations, db, sequence_blobs=None):
+    """
+    Send one batch of gene insert operations, and the sequence blobs they reference, to the database.
+    Returns:
+        int: Number of genes inserted.
+    """
+    try:
+        if sequence_blobs:
+            db[SEQUENCES_COLLECTION].insert_many(sequence_blobs)
+        result = db.genes.bulk_write(bulk_operations)
+        return result.inserted_count
+    except Exception as e:
+        logging.error(f"Failed to insert genes: {e}")
+        return 0
+
+def insert_plasmids_streaming(fasta_folder, bakta_folder, plasmid_mobility, metadata_df, resistance_genes,
+                              host_id_map, environment_id_map, db, batch_size=None, workers=None,
+                              sequence_storage='embedded', sequence_codec=DEFAULT_CODEC, bakta_parser='full'):
+    """
+    Stream plasmids through parse, resistance merge and insert in bounded-size batches.
+    Only one batch of sequences and gene annotations is held in memory at a time.
+    Args:
+        fasta_folder (str): Path to the folder containing FASTA files.
+        bakta_folder (str): Path to folder containing Bakta results.
+        plasmid_mobility (dict): Mobility data for plasmids.
+        metadata_df (DataFrame): Metadata DataFrame.
+        resistance_genes (dict): Resistance gene data.
+        host_id_map (dict): Mapping of host names to MongoDB IDs.
+        environment_id_map (dict): Mapping of environment names to MongoDB IDs.
+        db: MongoDB database instance.
+        batch_size (int): Number of plasmids per batch. Defaults to BUILD_BATCH_SIZE.
+        workers (int): Number of worker processes for Bakta parsing. Defaults to BAKTA_WORKERS.
+        sequence_storage (str): 'embedded' or 'blob', as in insert_plasmids.
+        sequence_codec (str): Codec for sequence blobs ('zlib' or '2bit').
+        bakta_parser (str): 'full' or 'streaming' (see iter_bakta_features).
+    Returns:
+        int: Number of plasmids inserted.
+    """
+    if batch_size is None:
+        batch_size = BUILD_BATCH_SIZE
+    if workers is None:
+        workers = BAKTA_WORKERS
+    bakta_files = {plasmid_id: json_file for json_file, plasmid_id in list_bakta_files(bakta_folder)}
+    metadata_index = build_metadata_index(metadata_df)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    inserted_count = 0
+
+    def flush(batch):
+        tasks = [(bakta_files[plasmid_id], plasmid_id) for plasmid_id in batch if plasmid_id in bakta_files]
+        plasmid_genes = parse_bakta_tasks(tasks, executor, workers, bakta_parser)
+        plasmid_genes = integrate_resistance_data(plasmid_genes, resistance_genes)
+        plasmid_id_map = insert_plasmids(batch, plasmid_mobility, metadata_df, host_id_map, environment_id_map, db,
+                                         metadata_index, sequence_storage, sequence_codec)
+        insert_genes(plasmid_genes, plasmid_id_map, db, sequence_storage=sequence_storage,
+                     sequence_codec=sequence_codec)
+        return len(plasmid_id_map)
+
+    try:
+        batch = {}
+        for plasmid_id, sequence in iter_fasta(fasta_folder):
+            batch[plasmid_id] = sequence
+            if len(batch) >= batch_size:
+                inserted_count += flush(batch)
+                batch = {}
+        if batch:
+            inserted_count += flush(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logging.info(f"Streamed {inserted_count} plasmids into the database.")
+    return inserted_count
+
+# Incremental Build Functions
+
+def fingerprint_file(path):
+    """
+    Fingerprint the contents of an input file.
+    Args:
+        path (str): Path to the file, or None.
+    Returns:
+        str: SHA-256 hex digest of the file, or None if it does not exist.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def fingerprint_record(record):
+    """
+    Fingerprint a parsed input record (metadata row or ResFinder hits).
+    Args:
+        record: JSON-serializable record, or None.
+    Returns:
+        str: SHA-256 hex digest of the record.
+    """
+    return hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def compute_plasmid_fingerprints(fasta_files, bakta_files, mobtyper_folder, metadata_index, resistance_genes):
+    """
+    Fingerprint every input that contributes to a plasmid and its genes.
+    Args:
+        fasta_files (list): (filepath, plasmid_id) tuples, as returned by list_fasta_files.
+        bakta_files (dict): Mapping of plasmid IDs to Bakta JSON files.
+        mobtyper_folder (str): Path to folder containing MobTyper files.
+        metadata_index (dict): Metadata keyed by accession, from build_metadata_index.
+        resistance_genes (dict): Resistance gene data keyed by "plasmid_id|locus".
+    Returns:
+        dict: Mapping of plasmid IDs to a combined fingerprint of their inputs.
+    """
+    resistance_by_plasmid = {}
+    for query_id, resistance_info in resistance_genes.items():
+        resistance_by_plasmid.setdefault(query_id.split('|', 1)[0], {})[query_id] = resistance_info
+
+    fingerprints = {}
+    for filepath, plasmid_id in fasta_files:
+        parts = [
+            fingerprint_file(filepath),
+            fingerprint_file(bakta_files.get(plasmid_id)),
+            fingerprint_file(os.path.join(mobtyper_folder, f"{plasmid_id}_mobtyper.fasta")),
+            fingerprint_record(metadata_index.get(plasmid_id)),
+            fingerprint_record(resistance_by_plasmid.get(plasmid_id)),
+        ]
+        fingerprints[plasmid_id] = hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return fingerprints
+
+def record_build_fingerprints(fasta_folder, bakta_folder, mobtyper_folder, metadata_df, resistance_genes, db):
+    """
+    Store the input fingerprints of the plasmids a full or streaming build inserted, so the
+    next incremental build only rewrites plasmids whose inputs changed after it.
+    Plasmids missing from the database (e.g. a failed batch) get no fingerprint and are
+    written by the next incremental build.
+    Args:
+        fasta_folder (str): Path to the folder containing FASTA files.
+        bakta_folder (str): Path to folder containing Bakta results.
+        mobtyper_folder (str): Path to folder containing MobTyper files.
+        metadata_df (DataFrame): Metadata DataFrame.
+        resistance_genes (dict): Resistance gene data.
+        db: MongoDB database instance.
+    Returns:
+        int: Number of fingerprints stored.
+    """
+    bakta_files = {plasmid_id: json_file for json_file, plasmid_id in list_bakta_files(bakta_folder)}
+    fingerprints = compute_plasmid_fingerprints(list_fasta_files(fasta_folder), bakta_files, mobtyper_folder,
+                                                build_metadata_index(metadata_df), resistance_genes)
+    stored_ids = set(db.plasmids.distinct('plasmid_id'))
+    db.build_fingerprints.delete_many({})
+    documents = [{'_id': plasmid_id, 'fingerprint': fingerprint}
+                 for plasmid_id, fingerprint in fingerprints.items() if plasmid_id in stored_ids]
+    if documents:
+        db.build_fingerprints.insert_many(documents)
+    logging.info(f"Recorded input fingerprints of {len(documents)} plasmids.")
+    return len(documents)
+
+def duplicate_plasmid_ids(db):
+    """
+    Plasmid IDs stored in more than one plasmid document, e.g. by full builds run twice.
+    Args:
+        db: MongoDB database instance.
+    Returns:
+        set: The duplicated plasmid IDs.
+    """
+    return {doc['_id'] for doc in db.plasmids.aggregate([
+        {'$group': {'_id': '$plasmid_id', 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ])}
+
+def stored_sequence_refs(plasmids, db):
+    """
+    Collect the sequence blobs referenced by plasmids and their genes.
+    Args:
+        plasmids (list): Plasmid documents with their '_id' and 'sequence_ref' fields.
+        db: MongoDB database instance.
+    Returns:
+        list: Blob IDs.
+    """
+    gene_ref_fields = {f"{field}_ref": 1 for field in SEQUENCE_FIELDS['genes']}
+    genes = db.genes.find({'plasmid_id': {'$in': [plasmid['_id'] for plasmid in plasmids]}}, gene_ref_fields)
+    return sequence_refs(plasmids, SEQUENCE_FIELDS['plasmids']) + sequence_refs(genes, SEQUENCE_FIELDS['genes'])
+
+def record_summary_scopes(summary_scopes, plasmids):
+    """
+    Note the hosts and environments of plasmids about to change, so their summary rows get refreshed.
+    Args:
+        summary_scopes (dict): 'host_id' and 'environment_id' sets to add to, or None.
+        plasmids (iterable): Plasmid documents with their 'host_id' and 'environment_id' fields.
+    """
+    if summary_scopes is None:
+        return
+    for plasmid in plasmids:
+        summary_scopes['host_id'].add(plasmid.get('host_id'))
+        summary_scopes['environment_id'].add(plasmid.get('environment_id'))
+
+def delete_plasmids(plasmid_ids, db, summary_scopes=None):
+    """
+    Delete plasmids, their genes, their sequence blobs and their stored fingerprints.
+    Args:
+        plasmid_ids (list): Plasmid IDs (accessions) to delete.
+        db: MongoDB database instance.
+        summary_scopes (dict): Collects the hosts and environments affected, see record_summary_scopes.
+    """
+    plasmids = list(db.plasmids.find({'plasmid_id': {'$in': plasmid_ids}},
+                                     {'_id': 1, 'sequence_ref': 1, 'host_id': 1, 'environment_id': 1}))
+    record_summary_scopes(summary_scopes, plasmids)
+    object_ids = [plasmid['_id'] for plasmid in plasmids]
+    try:
+        refs = stored_sequence_refs(plasmids, db)
+        genes_result = db.genes.delete_many({'plasmid_id': {'$in': object_ids}})
+        plasmids_result = db.plasmids.delete_many({'_id': {'$in': object_ids}})
+        delete_sequences(db, refs)
+        db.build_fingerprints.delete_many({'_id': {'$in': plasmid_ids}})
+        logging.info(f"Deleted {plasmids_result.deleted_count} plasmids and {genes_result.deleted_count} genes "
+                     f"whose inputs disappeared.")
+    except Exception as e:
+        logging.error(f"Failed to delete plasmids: {e}")
+
+def update_plasmids_incremental(fasta_folder, bakta_folder, mobtyper_folder, plasmid_mobility, metadata_df,
+                                resistance_genes, host_id_map, environment_id_map, db, batch_size=None, workers=None,
+                                sequence_storage='embedded', sequence_codec=DEFAULT_CODEC, summary_scopes=None,
+                                bakta_parser='full'):
+    """
+    Bring the plasmids and genes collections in line with the inputs, touching only
+    plasmids whose input fingerprints changed since the last build.
+    New or changed plasmids are upserted and their genes replaced; plasmids whose
+    FASTA file disappeared are deleted along with their genes. Plasmids stored more than
+    once are rewritten as a single document.
+    Full and streaming builds record fingerprints too (record_build_fingerprints). On a
+    database built before they did, the first incremental build finds no fingerprints
+    and rewrites every plasmid once.
+    Args:
+        fasta_folder (str): Path to the folder containing FASTA files.
+        bakta_folder (str): Path to folder containing Bakta results.
+        mobtyper_folder (str): Path to folder containing MobTyper files.
+        plasmid_mobility (dict): Mobility data for plasmids.
+        metadata_df (DataFrame): Metadata DataFrame.
+        resistance_genes (dict): Resistance gene data.
+        host_id_map (dict): Mapping of host names to MongoDB IDs.
+        environment_id_map (dict): Mapping of environment names to MongoDB IDs.
+        db: MongoDB database instance.
+        batch_size (int): Number of plasmids per batch. Defaults to BUILD_BATCH_SIZE.
+        workers (int): Number of worker processes for Bakta parsing. Defaults to BAKTA_WORKERS.
+        sequence_storage (str): 'embedded' or 'blob', as in insert_plasmids.
+        sequence_codec (str): Codec for sequence blobs ('zlib' or '2bit').
+        summary_scopes (dict): 'host_id' and 'environment_id' sets that collect the hosts and
+            environments of every plasmid added, changed or removed, for refresh_summary_collections.
+        bakta_parser (str): 'full' or 'streaming' (see iter_bakta_features).
+    Returns:
+        int: Number of plasmids upserted.
+    """
+    if batch_size is None:
+        batch_size = BUILD_BATCH_SIZE
+    if workers is None:
+        workers = BAKTA_WORKERS
+    fasta_files = list_fasta_files(fasta_folder)
+    bakta_files = {plasmid_id: json_file for json_file, plasmid_id in list_bakta_files(bakta_folder)}
+    metadata_index = build_metadata_index(metadata_df)
+
+    current_fingerprints = compute_plasmid_fingerprints(fasta_files, bakta_files, mobtyper_folder,
+                                                        metadata_index, resistance_genes)
+    stored_fingerprints = {doc['_id']: doc['fingerprint'] for doc in db.build_fingerprints.find()}
+    stored_ids = set(db.plasmids.distinct('plasmid_id'))
+    duplicate_ids = duplicate_plasmid_ids(db)
+    changed_files = [(filepath, plasmid_id) for filepath, plasmid_id in fasta_files
+                     if stored_fingerprints.get(plasmid_id) != current_fingerprints[plasmid_id]
+                     or plasmid_id not in stored_ids or plasmid_id in duplicate_ids]
+    removed_ids = sorted((stored_ids | set(stored_fingerprints)) - set(current_fingerprints))
+    logging.info(f"Incremental build: {len(changed_files)} new or changed plasmids, {len(removed_ids)} removed, "
+                 f"{len(current_fingerprints) - len(changed_files)} unchanged.")
+
+    # Upserts and deletes look plasmids and genes up by their plasmid ID
+    ensure_indexes(db)
+
+    if removed_ids:
+        delete_plasmids(removed_ids, db, summary_scopes)
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    upserted_count = 0
+
+    def flush(batch):
+        tasks = [(bakta_files[plasmid_id], plasmid_id) for plasmid_id in batch if plasmid_id in bakta_files]
+        plasmid_genes = parse_bakta_tasks(tasks, executor, workers, bakta_parser)
+        plasmid_genes = integrate_resistance_data(plasmid_genes, resistance_genes)
+        plasmid_documents = {
+            plasmid_id: build_plasmid_document(plasmid_id, sequence, plasmid_mobility, metadata_index,
+                                               host_id_map, environment_id_map)
+            for plasmid_id, sequence in batch.items()
+        }
+        sequence_blobs = []
+        for plasmid_id, plasmid_data in plasmid_documents.items():
+            sequence_blobs.extend(prepare_sequence_fields(plasmid_data, 'plasmids', plasmid_id, sequence_storage,
+                                                          sequence_codec))
+        try:
+            # Sequence blobs of the previous versions are deleted once nothing references them
+            previous_plasmids = list(db.plasmids.find({'plasmid_id': {'$in': list(batch)}},
+                                                      {'_id': 1, 'plasmid_id': 1, 'sequence_ref': 1, 'host_id': 1,
+                                                       'environment_id': 1}))
+            previous_refs = stored_sequence_refs(previous_plasmids, db)
+            record_summary_scopes(summary_scopes, previous_plasmids)
+            record_summary_scopes(summary_scopes, plasmid_documents.values())
+            if sequence_blobs:
+                db[SEQUENCES_COLLECTION].insert_many(sequence_blobs)
+            # Keep one document per plasmid ID for ReplaceOne to rewrite; extra copies go with their genes
+            kept_ids = {}
+            for plasmid in previous_plasmids:
+                kept_ids.setdefault(plasmid['plasmid_id'], plasmid['_id'])
+            kept = set(kept_ids.values())
+            extra_ids = [plasmid['_id'] for plasmid in previous_plasmids if plasmid['_id'] not in kept]
+            if extra_ids:
+                db.plasmids.delete_many({'_id': {'$in': extra_ids}})
+            db.plasmids.bulk_write([
+                ReplaceOne({'plasmid_id': plasmid_id}, plasmid_data, upsert=True)
+                for plasmid_id, plasmid_data in plasmid_documents.items()
+            ])
+            plasmid_id_map = {
+                doc['plasmid_id']: doc['_id']
+                for doc in db.plasmids.find({'plasmid_id': {'$in': list(batch)}}, {'plasmid_id': 1})
+            }
+            previous_ids = [plasmid['_id'] for plasmid in previous_plasmids]
+            db.genes.delete_many({'plasmid_id': {'$in': previous_ids + list(plasmid_id_map.values())}})
+            delete_sequences(db, previous_refs)
+        except Exception as e:
+            logging.error(f"Failed to upsert plasmids: {e}")
+            return 0
+        insert_genes(plasmid_genes, plasmid_id_map, db, sequence_storage=sequence_storage,
+                     sequence_codec=sequence_codec)
+
+        # Record fingerprints last so a failed batch is retried on the next run
+        db.build_fingerprints.bulk_write([
+            UpdateOne({'_id': plasmid_id}, {'$set': {'fingerprint': current_fingerprints[plasmid_id]}}, upsert=True)
+            for plasmid_id in batch
+        ])
+        return len(plasmid_id_map)
+
+    try:
+        batch = {}
+        for plasmid_id, sequence in read_fasta_files(changed_files):
+            batch[plasmid_id] = sequence
+            if len(batch) >= batch_size:
+                upserted_count += flush(batch)
+                batch = {}
+        if batch:
+            upserted_count += flush(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logging.info(f"Upserted {upserted_count} new or changed plasmids.")
+    return upserted_count
+
+# Index Functions
+
+def ensure_indexes(db):
+    """
+    Create the curated INDEX_SPECS indexes and drop the OBSOLETE_INDEXES ones.
+    Other existing indexes are left untouched.
+    Args:
+        db: MongoDB database instance.
+    Returns:
+        dict: Mapping of collection names to the index names ensured on them.
+    """
+    for collection_name, index_names in OBSOLETE_INDEXES.items():
+        existing = db[collection_name].index_information()
+        for index_name in index_names:
+            if index_name in existing:
+                db[collection_name].drop_index(index_name)
+                logging.info(f"Dropped obsolete index {index_name} on {collection_name}.")
+    created = {}
+    for collection_name, index_specs in INDEX_SPECS.items():
+        created[collection_name] = []
+        for keys in index_specs:
+            try:
+                created[collection_name].append(db[collection_name].create_index(keys))
+            except Exception as e:
+                logging.error(f"Failed to create index {keys} on {collection_name}: {e}")
+        logging.info(f"Ensured {len(created[collection_name])} indexes on {collection_name}.")
+    return created
+
+# Summary Collection Functions
+
+def summary_pipeline(name, scope_values=None, refreshed_at=None):
+    """
+    Build the $merge pipeline that (re)computes a summary collection.
+    Args:
+        name (str): Summary collection name, a key of SUMMARY_COLLECTIONS.
+        scope_values (list): Only recompute the rows for these values of the scope field. None recomputes all rows.
+        refreshed_at (datetime): Stamp written on every row produced, so rows that were not are found afterwards.
+    Returns:
+        list: The aggregation pipeline, to run on the summary's source collection.
+    """
+    spec = SUMMARY_COLLECTIONS[name]
+    pipeline = []
+    if scope_values is not None:
+        pipeline.append({'$match': {spec['scope_field']: {'$in': list(scope_values)}}})
+    pipeline.extend(spec['pipeline'])
+    pipeline.append({'$set': {'refreshed_at': refreshed_at}})
+    pipeline.append({'$merge': {'into': name, 'on': '_id', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}})
+    return pipeline
+
+def refresh_summary_collections(db, summary_scopes=None):
+    """
+    Recompute the SUMMARY_COLLECTIONS on the server with $merge. Rows are replaced in place and
+    rows whose group disappeared are deleted afterwards, so readers never see a summary half empty.
+    Servers older than SUMMARY_MIN_SERVER_VERSION (MongoDB 4.2) are skipped with an error logged.
+    Args:
+        db: MongoDB database instance.
+        summary_scopes (dict): 'host_id' and 'environment_id' sets from an incremental build.
+            Only the summary rows of these hosts (and their genera) and environments are refreshed.
+            None refreshes everything.
+    """
+    server_version = tuple(db.client.server_info()['versionArray'][:2])
+    if server_version < SUMMARY_MIN_SERVER_VERSION:
+        logging.error(f"Summary collections need MongoDB {'.'.join(map(str, SUMMARY_MIN_SERVER_VERSION))} or later "
+                      f"(server is {'.'.join(map(str, server_version))}); not refreshed.")
+        return
+
+    refreshed_at = datetime.now(timezone.utc)
+    scope_values = None
+    if summary_scopes is not None:
+        host_ids = [host_id for host_id in summary_scopes['host_id'] if host_id is not None]
+        scope_values = {
+            'host_id': list(summary_scopes['host_id']),
+            'environment_id': list(summary_scopes['environment_id']),
+            'genus': db.hosts.distinct('genus', {'_id': {'$in': host_ids}}) if host_ids else [],
+        }
+
+    for name, spec in SUMMARY_COLLECTIONS.items():
+        scope_field = spec['scope_field']
+        values = None if scope_values is None else scope_values[scope_field]
+        if values is not None and not values:
+            continue
         try:
-            result = db.genes.bulk_write(bulk_operations)
-            logging.info(f"Inserted {result.inserted_count} genes into the database.")
+            db[spec['source']].aggregate(summary_pipeline(name, values, refreshed_at), allowDiskUse=True)
+            stale_filter = {'refreshed_at': {'$ne': refreshed_at}}
+            if values is not None:
+                stale_filter[scope_field] = {'$in': values}
+            stale = db[name].delete_many(stale_filter).deleted_count
+            logging.info(f"Refreshed summary collection {name}"
+                         f"{'' if values is None else f' for {len(values)} {scope_field} values'}, "
+                         f"{stale} stale rows removed.")
         except Exception as e:
-            logging.error(f"Failed to insert genes: {e}")
+            logging.error(f"Failed to refresh summary collection {name}: {e}")
+
+def mark_build_complete(db):
+    """
+    Record that a build finished by bumping the build generation, which tells the
+    web application to drop its cached query results.
+    Args:
+        db: MongoDB database instance.
+    """
+    try:
+        db.build_info.update_one(
+            {'_id': 'build'},
+            {'$inc': {'generation': 1}, '$set': {'completed_at': datetime.now(timezone.utc)}},
+            upsert=True
+        )
+    except Exception as e:
+        logging.error(f"Failed to record build completion: {e}")
 
 # Main function
-def main():
+def main(streaming=False, incremental=False, batch_size=None, workers=None, sequence_storage='embedded',
+         sequence_codec=DEFAULT_CODEC, bakta_parser='full'):
     """
     Main function to parse input data and populate the MongoDB database.
+    Args:
+        streaming (bool): Stream plasmids and genes in bounded-size batches instead of
+            loading every sequence and annotation up front.
+        incremental (bool): Only upsert plasmids whose inputs changed since the last
+            incremental build and delete those whose inputs disappeared.
+        batch_size (int): Plasmids per batch in streaming and incremental modes. Defaults to BUILD_BATCH_SIZE.
+        workers (int): Number of worker processes for Bakta parsing. Defaults to BAKTA_WORKERS.
+        sequence_storage (str): 'embedded' keeps sequences in plasmid and gene documents, 'blob' stores
+            them compressed in the sequences collection (see sequence_store.py).
+        sequence_codec (str): Codec for sequence blobs: 'zlib', or '2bit' to pack nucleotide sequences.
+        bakta_parser (str): 'full' decodes each Bakta file whole, 'streaming' builds only its features
+            with ijson, which lowers the memory used per parsing worker.
     """
+    if bakta_parser == 'streaming' and ijson is None:
+        logging.warning("ijson is not installed; parsing Bakta files with the full parser.")
+        bakta_parser = 'full'
+
     # MongoDB setup
     username, password = 'XXXXXXX', 'XXXXXXX'
     client = MongoClient("mongodb://localhost:XXXXXXX")
@@ -435,12 +1264,13 @@ def main():
     resfinder_tab_file = 'XXXXXXX'
     
     # Parse files
-    plasmid_sequences = parse_fasta(fasta_folder)
-    plasmid_genes = parse_bakta(bakta_folder)
     plasmid_mobility = parse_mobtyper(mobtyper_folder)
     metadata_df = parse_plsdb_metadata(metadata_file)
     resistance_genes = parse_resfinder_tab(resfinder_tab_file)
-    plasmid_genes = integrate_resistance_data(plasmid_genes, resistance_genes)
+    if not streaming and not incremental:
+        plasmid_sequences = parse_fasta(fasta_folder)
+        plasmid_genes = parse_bakta(bakta_folder, workers, bakta_parser)
+        plasmid_genes = integrate_resistance_data(plasmid_genes, resistance_genes)
 
     # Insert environments, hosts, plasmids, and genes
     environment_id_map = insert_environments(metadata_df, db)
@@ -453,15 +1283,57 @@ def main():
         logging.error("No host IDs found. Exiting.")
         return
 
-    plasmid_id_map = insert_plasmids(plasmid_sequences, plasmid_mobility, metadata_df, host_id_map, environment_id_map, db)
-    if not plasmid_id_map:
-        logging.error("No plasmid IDs found. Exiting.")
-        return
+    # Full builds recompute every summary row, incremental builds only those of the hosts and
+    # environments whose plasmids changed
+    summary_scopes = None
+    if incremental:
+        summary_scopes = {'host_id': set(), 'environment_id': set()}
+        update_plasmids_incremental(fasta_folder, bakta_folder, mobtyper_folder, plasmid_mobility, metadata_df,
+                                    resistance_genes, host_id_map, environment_id_map, db, batch_size, workers,
+                                    sequence_storage, sequence_codec, summary_scopes, bakta_parser)
+    elif streaming:
+        inserted_count = insert_plasmids_streaming(fasta_folder, bakta_folder, plasmid_mobility, metadata_df,
+                                                   resistance_genes, host_id_map, environment_id_map, db,
+                                                   batch_size, workers, sequence_storage, sequence_codec,
+                                                   bakta_parser)
+        if not inserted_count:
+            logging.error("No plasmid IDs found. Exiting.")
+            return
+        record_build_fingerprints(fasta_folder, bakta_folder, mobtyper_folder, metadata_df, resistance_genes, db)
+    else:
+        plasmid_id_map = insert_plasmids(plasmid_sequences, plasmid_mobility, metadata_df, host_id_map, environment_id_map, db,
+                                         sequence_storage=sequence_storage, sequence_codec=sequence_codec)
+        if not plasmid_id_map:
+            logging.error("No plasmid IDs found. Exiting.")
+            return
+
+        insert_genes(plasmid_genes, plasmid_id_map, db, sequence_storage=sequence_storage,
+                     sequence_codec=sequence_codec)
+        record_build_fingerprints(fasta_folder, bakta_folder, mobtyper_folder, metadata_df, resistance_genes, db)
 
-    insert_genes(plasmid_genes, plasmid_id_map, db)
+    ensure_indexes(db)
+    refresh_summary_collections(db, summary_scopes)
+    mark_build_complete(db)
     
     logging.info("Data import completed.")
 
 if __name__ == '__main__':
-    main()
-
+    parser = argparse.ArgumentParser(description="Build the PlasmID MongoDB database.")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Parse and insert plasmids in bounded-size batches to cap memory use.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only rebuild plasmids whose input files or rows changed since the last incremental run.")
+    parser.add_argument('--batch-size', type=int, default=BUILD_BATCH_SIZE,
+                        help="Plasmids per batch in streaming and incremental modes.")
+    parser.add_argument('--workers', type=int, default=BAKTA_WORKERS,
+                        help="Worker processes used to parse Bakta JSON files.")
+    parser.add_argument('--sequence-storage', choices=SEQUENCE_STORAGE_MODES, default='embedded',
+                        help="Keep sequences in plasmid/gene documents, or in a separate compressed collection "
+                             "(changing it requires a full rebuild).")
+    parser.add_argument('--sequence-codec', choices=SEQUENCE_CODECS, default=DEFAULT_CODEC,
+                        help="Codec for the separate sequence collection: zlib, or 2bit for nucleotide sequences.")
+    parser.add_argument('--bakta-parser', choices=BAKTA_PARSERS, default='full',
+                        help="Decode Bakta JSON files whole, or stream their features with ijson to use less memory.")
+    args = parser.parse_args()
+    main(streaming=args.streaming, incremental=args.incremental, batch_size=args.batch_size, workers=args.workers,
+         sequence_storage=args.sequence_storage, sequence_codec=args.sequence_codec, bakta_parser=args.bakta_parser)
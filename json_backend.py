@@ -0,0 +1,113 @@
+"""
+JSON decoding and encoding for the build and the web application.
+
+Uses orjson when it is installed and falls back to the standard library json
+module otherwise. The JSON_BACKEND environment variable ('orjson' or 'json')
+chooses explicitly; 'json' forces the standard library.
+
+Results match the standard library:
+- loads() retries with json.loads whatever orjson rejects (NaN and Infinity,
+  invalid UTF-8), so the same documents are accepted and errors are the ones
+  json.loads raises. orjson reads integers beyond 64 bits as floats instead of
+  rejecting them, so texts with runs of 19 or more digits go to json.loads directly.
+- dumps() retries with json.dumps whatever orjson cannot encode (non-string keys,
+  integers beyond 64 bits). The json.dumps path encodes the types orjson supports
+  natively (datetime, date, time, UUID, Enum, dataclasses) as orjson does, so the text
+  does not depend on the backend; other values raise TypeError either way. Output is
+  compact and keeps non-ASCII characters as they are, so callers that show or hash the
+  text, or indent it, should keep using json.dumps.
+"""
+import dataclasses
+import datetime
+import enum
+import json
+import os
+import re
+import uuid
+
+JSON_BACKENDS = ('orjson', 'json')
+
+# Digit runs long enough to hold an integer outside the 64-bit range of orjson
+LONG_DIGITS = re.compile(r'[0-9]{19}')
+LONG_DIGITS_BYTES = re.compile(rb'[0-9]{19}')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def select_backend(name=None):
+    """
+    Pick the backend used by loads, load and dumps.
+    Args:
+        name (str): 'orjson' or 'json'; None picks orjson when it is installed.
+    Returns:
+        str: Name of the backend in use.
+    """
+    global BACKEND
+    if name not in (None,) + JSON_BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name}")
+    if name == 'orjson' and orjson is None:
+        raise ValueError("The orjson JSON backend is not installed")
+    BACKEND = name or ('orjson' if orjson is not None else 'json')
+    return BACKEND
+
+
+BACKEND = select_backend(os.environ.get('JSON_BACKEND') or None)
+
+
+def loads(data):
+    """
+    Decode a JSON document.
+    Args:
+        data (str or bytes): JSON text.
+    Returns:
+        The decoded value.
+    """
+    if BACKEND == 'orjson':
+        long_digits = LONG_DIGITS if isinstance(data, str) else LONG_DIGITS_BYTES
+        if not long_digits.search(data):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+    return json.loads(data)
+
+
+def load(f):
+    """
+    Decode a JSON file opened in binary mode (text mode also works).
+    """
+    return loads(f.read())
+
+
+def _default(value):
+    """
+    Encode for json.dumps the values orjson encodes natively, in orjson's format.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """
+    Encode a value as compact JSON text.
+    Args:
+        value: Value to encode.
+    Returns:
+        str: JSON text.
+    """
+    if BACKEND == 'orjson':
+        try:
+            return orjson.dumps(value).decode('utf-8')
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=_default)
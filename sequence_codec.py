@@ -0,0 +1,156 @@
+"""
+2-bit packed nucleotide sequences.
+
+A, C, G and T take 2 bits each, four bases per byte. Any other character (IUPAC
+ambiguity codes such as N or R, gaps, lower-case bases) is recorded in an exception
+list of (start, run) pairs and written back over the unpacked bases when decoding.
+Encoding, decoding and substring extraction are vectorized with NumPy.
+"""
+import numpy as np
+
+BASES = b'ACGT'
+
+# Byte value -> 2-bit code, 255 for characters that go to the exception list
+_ENCODE_TABLE = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+    _ENCODE_TABLE[_base] = _code
+
+_DECODE_TABLE = np.frombuffer(BASES, dtype=np.uint8)
+_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+
+class PackedSequence:
+    """
+    Immutable nucleotide sequence stored at 2 bits per base.
+
+    len() and slicing work as on str; str() decodes the whole sequence. It compares and
+    hashes equal to the str it encodes, so pack_sequence results of either type mix freely.
+    """
+
+    __slots__ = ('length', 'packed', 'exceptions')
+
+    def __init__(self, length, packed, exceptions=()):
+        self.length = length
+        self.packed = packed
+        self.exceptions = [(int(start), run) for start, run in exceptions]
+
+    @classmethod
+    def encode(cls, sequence):
+        """
+        Pack a sequence.
+        Args:
+            sequence (str): Nucleotide sequence.
+        Returns:
+            PackedSequence: The packed sequence.
+        """
+        raw = np.frombuffer(sequence.encode('utf-8'), dtype=np.uint8)
+        if len(raw) != len(sequence):
+            raise ValueError("Only single-byte characters can be packed.")
+        codes = _ENCODE_TABLE[raw]
+
+        # Runs of characters other than ACGT
+        is_exception = codes == 255
+        exceptions = []
+        if is_exception.any():
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], is_exception.view(np.int8), [0]))))
+            exceptions = [(start, sequence[start:stop]) for start, stop in zip(edges[::2].tolist(), edges[1::2].tolist())]
+            codes = np.where(is_exception, 0, codes)
+
+        padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+        padded[:len(codes)] = codes
+        quads = padded.reshape(-1, 4)
+        packed = (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+        return cls(len(sequence), packed.astype(np.uint8).tobytes(), exceptions)
+
+    def decode(self):
+        """
+        Unpack the whole sequence.
+        Returns:
+            str: The sequence.
+        """
+        return self.substring(0, self.length)
+
+    def substring(self, start, stop):
+        """
+        Unpack sequence[start:stop] without decoding the rest of the sequence.
+        Args:
+            start (int): First position (0-based).
+            stop (int): Position after the last one.
+        Returns:
+            str: The subsequence.
+        """
+        start, stop, _ = slice(start, stop).indices(self.length)
+        if stop <= start:
+            return ''
+        first_byte, last_byte = start // 4, -(-stop // 4)
+        packed = np.frombuffer(self.packed, dtype=np.uint8, offset=first_byte, count=last_byte - first_byte)
+        codes = ((packed[:, None] >> _SHIFTS) & 3).ravel()
+        offset = first_byte * 4
+        chars = _DECODE_TABLE[codes[start - offset:stop - offset]]
+
+        # Exception runs are sorted by start; only those overlapping [start, stop) are applied
+        if self.exceptions:
+            for run_start, run in self.exceptions:
+                if run_start >= stop:
+                    break
+                run_stop = run_start + len(run)
+                if run_stop <= start:
+                    continue
+                lo, hi = max(run_start, start), min(run_stop, stop)
+                chars[lo - start:hi - start] = np.frombuffer(run[lo - run_start:hi - run_start].encode('utf-8'),
+                                                             dtype=np.uint8)
+        return chars.tobytes().decode('utf-8')
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return self.decode()
+
+    def __repr__(self):
+        return f"PackedSequence(length={self.length}, exceptions={len(self.exceptions)})"
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                return self.decode()[key]
+            return self.substring(*key.indices(self.length)[:2])
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("PackedSequence index out of range")
+        return self.substring(key, key + 1)
+
+    def __eq__(self, other):
+        if isinstance(other, PackedSequence):
+            return (self.length, self.packed, self.exceptions) == (other.length, other.packed, other.exceptions)
+        if isinstance(other, str):
+            return self.decode() == other
+        return NotImplemented
+
+    def __hash__(self):
+        # Equal to the matching str, so it must hash like it (sets and dict keys may mix both)
+        return hash(self.decode())
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory held by the packed bases and the exception runs.
+        """
+        return len(self.packed) + sum(len(run) + 8 for _, run in self.exceptions)
+
+
+def pack_sequence(sequence):
+    """
+    Pack a nucleotide sequence when that makes it smaller.
+    Args:
+        sequence (str): Nucleotide sequence.
+    Returns:
+        PackedSequence or str: The packed sequence, or the original string when it has
+        multi-byte characters or so many exception runs that packing would not save memory.
+    """
+    try:
+        packed = PackedSequence.encode(sequence)
+    except ValueError:
+        return sequence
+    return packed if packed.nbytes < len(sequence) else sequence
@@ -0,0 +1,236 @@
+"""
+Compressed blob storage for plasmid and gene sequences.
+
+In the 'blob' sequence storage mode of database_build.py, sequences are not embedded
+in plasmid and gene documents. Each one is stored compressed in its own document of
+the sequences collection, and the owning document keeps a '<field>_ref' with its _id,
+so metadata queries, $lookups and the working set never carry sequence data.
+The web application resolves references only when a sequence is displayed or requested.
+
+Two codecs are available: 'zlib' for any sequence, and '2bit' (sequence_codec.py) for
+nucleotide sequences, which falls back to zlib for protein sequences and other text
+that does not pack well.
+"""
+import zlib
+
+from bson import Binary, ObjectId
+
+from sequence_codec import PackedSequence, pack_sequence
+
+SEQUENCES_COLLECTION = 'sequences'
+
+# Sequence fields per collection
+SEQUENCE_FIELDS = {
+    'plasmids': ('sequence',),
+    'genes': ('nt_sequence', 'aa_sequence'),
+}
+
+SEQUENCE_STORAGE_MODES = ('embedded', 'blob')
+
+SEQUENCE_CODECS = ('zlib', '2bit')
+DEFAULT_CODEC = 'zlib'
+ZLIB_LEVEL = 6
+
+
+def encode_sequence(sequence, codec=DEFAULT_CODEC):
+    """
+    Compress a sequence.
+    Args:
+        sequence (str or PackedSequence): Nucleotide or amino acid sequence.
+        codec (str): Compression codec.
+    Returns:
+        dict: 'codec', 'length' and the compressed 'data' (plus 'exceptions' for '2bit').
+    """
+    if codec not in SEQUENCE_CODECS:
+        raise ValueError(f"Unknown sequence codec: {codec}")
+    if codec == '2bit':
+        packed = sequence if isinstance(sequence, PackedSequence) else pack_sequence(sequence)
+        if isinstance(packed, PackedSequence):
+            return {
+                'codec': codec,
+                'length': len(packed),
+                'data': Binary(packed.packed),
+                'exceptions': [[start, run] for start, run in packed.exceptions],
+            }
+    return {
+        'codec': 'zlib',
+        'length': len(sequence),
+        'data': Binary(zlib.compress(str(sequence).encode('utf-8'), ZLIB_LEVEL)),
+    }
+
+
+def decode_sequence(blob):
+    """
+    Decompress a sequence stored by encode_sequence.
+    Args:
+        blob (dict): Sequences collection document.
+    Returns:
+        str: The sequence.
+    """
+    if blob['codec'] == '2bit':
+        return unpack_blob(blob).decode()
+    if blob['codec'] != 'zlib':
+        raise ValueError(f"Unknown sequence codec: {blob['codec']}")
+    return zlib.decompress(blob['data']).decode('utf-8')
+
+
+def decode_sequence_prefix(blob, length):
+    """
+    Decode only the first characters of a stored sequence.
+    Args:
+        blob (dict): Sequences collection document.
+        length (int): Number of characters wanted.
+    Returns:
+        str: sequence[:length].
+    """
+    if blob['codec'] == '2bit':
+        return unpack_blob(blob).substring(0, length)
+    if blob['codec'] != 'zlib':
+        raise ValueError(f"Unknown sequence codec: {blob['codec']}")
+    # Sequences are ASCII, so one byte per character
+    return zlib.decompressobj().decompress(blob['data'], length).decode('utf-8', 'ignore')
+
+
+def unpack_blob(blob):
+    """
+    Rebuild the PackedSequence of a '2bit' blob without decoding it.
+    """
+    return PackedSequence(blob['length'], bytes(blob['data']), blob.get('exceptions', []))
+
+
+def detach_sequences(document, fields, name, codec=DEFAULT_CODEC):
+    """
+    Move the sequence fields of a document out into sequence blobs.
+    Each field is replaced, in place, by '<field>_ref' holding the blob _id.
+    Args:
+        document (dict): Plasmid or gene document, modified in place.
+        fields (tuple): Sequence fields to detach.
+        name (str): Name of the sequence owner (plasmid ID or gene locus), kept with the blob.
+        codec (str): Compression codec.
+    Returns:
+        list: Sequences collection documents to insert.
+    """
+    blobs = []
+    detached = {}
+    for field in fields:
+        sequence = document.get(field)
+        if isinstance(sequence, (str, PackedSequence)):
+            blob = {'_id': ObjectId(), 'name': name, 'field': field, **encode_sequence(sequence, codec)}
+            blobs.append(blob)
+            detached[field] = blob['_id']
+    if detached:
+        items = [(f"{key}_ref", detached[key]) if key in detached else (key, value) for key, value in document.items()]
+        document.clear()
+        document.update(items)
+    return blobs
+
+
+def sequence_refs(documents, fields):
+    """
+    Collect the sequence blob IDs referenced by documents.
+    Args:
+        documents (iterable): Plasmid or gene documents.
+        fields (tuple): Sequence fields whose references are collected.
+    Returns:
+        list: Blob IDs.
+    """
+    return [document[f"{field}_ref"] for document in documents for field in fields if document.get(f"{field}_ref")]
+
+
+def embed_sequences(document, fields):
+    """
+    Turn packed sequence fields of a document back into strings, for embedded storage.
+    Args:
+        document (dict): Plasmid or gene document, modified in place.
+        fields (tuple): Sequence fields.
+    """
+    for field in fields:
+        if isinstance(document.get(field), PackedSequence):
+            document[field] = document[field].decode()
+
+
+def collect_sequence_refs(data):
+    """
+    Find the sequence references anywhere in query results ('<field>_ref' ObjectIds for the
+    fields of SEQUENCE_FIELDS, also inside joined sub-documents and arrays).
+    Args:
+        data: Query result documents.
+    Returns:
+        list: Blob IDs, without duplicates.
+    """
+    ref_keys = {f"{field}_ref" for fields in SEQUENCE_FIELDS.values() for field in fields}
+    refs = {}
+
+    def walk(value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key in ref_keys and isinstance(item, ObjectId):
+                    refs[item] = None
+                else:
+                    walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    walk(data)
+    return list(refs)
+
+
+def add_sequence_prefixes(data, blobs, length):
+    """
+    Put the first characters of each referenced sequence back under its field name,
+    just before its '<field>_ref', so results display as with embedded storage.
+    Args:
+        data: Query result documents, modified in place.
+        blobs (iterable): Sequences collection documents for the references in data.
+        length (int): Number of characters kept.
+    """
+    prefixes = {blob['_id']: decode_sequence_prefix(blob, length) for blob in blobs}
+    ref_keys = {f"{field}_ref": field for fields in SEQUENCE_FIELDS.values() for field in fields}
+
+    def walk(value):
+        if isinstance(value, dict):
+            items = []
+            for key, item in value.items():
+                if key in ref_keys and isinstance(item, ObjectId) and item in prefixes:
+                    items.append((ref_keys[key], prefixes[item]))
+                else:
+                    walk(item)
+                items.append((key, item))
+            value.clear()
+            value.update(items)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    walk(data)
+
+
+def fetch_sequences(db, refs, max_time_ms=None):
+    """
+    Fetch and decompress sequences by blob ID in one query.
+    Args:
+        db: MongoDB database instance.
+        refs (list): Blob IDs.
+        max_time_ms (int): Server-side time limit for the query, or None for no limit.
+    Returns:
+        dict: Mapping of blob IDs to (name, field, sequence) for the blobs found.
+    """
+    return {
+        blob['_id']: (blob['name'], blob['field'], decode_sequence(blob))
+        for blob in db[SEQUENCES_COLLECTION].find({'_id': {'$in': list(refs)}}, max_time_ms=max_time_ms)
+    }
+
+
+def delete_sequences(db, refs):
+    """
+    Delete sequence blobs by ID.
+    Args:
+        db: MongoDB database instance.
+        refs (list): Blob IDs.
+    Returns:
+        int: Number of blobs deleted.
+    """
+    if not refs:
+        return 0
+    return db[SEQUENCES_COLLECTION].delete_many({'_id': {'$in': list(refs)}}).deleted_count